@@ -1,5 +1,4 @@
 import os
-import re
 import pandas as pd
 import simplekml
 import streamlit as st
@@ -7,17 +6,7 @@ from io import BytesIO
 import tempfile  # ✅ ใช้โฟลเดอร์ชั่วคราว
 from datetime import datetime
 import xml.etree.ElementTree as ET
-
-# ฟังก์ชันดึงค่าพิกัดจากข้อความโดยใช้ Regex
-def parse_coordinates(coord_str):
-    try:
-        matches = re.findall(r"[-+]?\d*\.\d+|[-+]?\d+", coord_str)
-        if len(matches) != 2:
-            raise ValueError("Invalid coordinate format")
-        lat, lon = map(float, matches)
-        return lon, lat
-    except Exception:
-        return None
+from excel_coordinates import parse_coordinate_column, coordinate_rejects
 
 # ฟังก์ชันแปลง Excel เป็น KML โดยแยก ID ในโฟลเดอร์
 def convert_excel_to_kml(uploaded_file, sheet_name):
@@ -30,9 +19,12 @@ def convert_excel_to_kml(uploaded_file, sheet_name):
         # ลบช่องว่างจากชื่อคอลัมน์
         data.columns = data.columns.str.strip()
 
-        # แปลงค่าพิกัด
-        data['พิกัด'] = data['พิกัด'].apply(lambda x: parse_coordinates(str(x)) if pd.notna(x) else None)
-        data = data.dropna(subset=['พิกัด'])
+        # แปลงค่าพิกัด แถวที่แปลงไม่ได้เก็บไว้ในรายงานแทนการทิ้งไปเงียบๆ
+        parsed = parse_coordinate_column(data['พิกัด'])
+        rejects = coordinate_rejects(data, parsed)
+        valid = parsed['lat'].notna()
+        data = data[valid].copy()
+        data['พิกัด'] = list(zip(parsed.loc[valid, 'lon'].tolist(), parsed.loc[valid, 'lat'].tolist()))
 
         # ✅ สร้างไฟล์ KML
         kml = simplekml.Kml()
@@ -75,12 +67,12 @@ def convert_excel_to_kml(uploaded_file, sheet_name):
 
         status_text.text("✅ ประมวลผลเสร็จสิ้น!")
 
-        return temp_file_path, output_filename, kml_bytes
+        return temp_file_path, output_filename, kml_bytes, rejects
 
     except Exception as e:
         status_text.text("❌ เกิดข้อผิดพลาด!")
         st.error(f"เกิดข้อผิดพลาด: {e}")
-        return None, None, None
+        return None, None, None, None
 
 # ค้นหา Namespace (KML ใช้ namespace)
 namespace = {'kml': 'http://www.opengis.net/kml/2.2'}
@@ -112,7 +104,7 @@ if uploaded_file is not None:
         remove_points = st.checkbox("❌ ลบหมุด (Point)")
 
         if st.button("🚀 เริ่มแปลงเป็น KML"):
-            temp_file_path, output_filename, kml_bytes = convert_excel_to_kml(uploaded_file, sheet_name)
+            temp_file_path, output_filename, kml_bytes, rejects = convert_excel_to_kml(uploaded_file, sheet_name)
 
             if kml_bytes:
                 st.success("✅ แปลงไฟล์ KML สำเร็จ!")
@@ -149,5 +141,16 @@ if uploaded_file is not None:
                     mime="application/vnd.google-earth.kml+xml"
                 )
 
+                # 🔹 รายงานแถวที่แปลงพิกัดไม่ได้ (ไม่ถูกใส่ใน KML)
+                if not rejects.empty:
+                    st.warning(f"⚠️ มี {len(rejects):,} แถวที่แปลงพิกัดไม่ได้ และไม่ได้ถูกใส่ในไฟล์ KML")
+                    st.dataframe(rejects, use_container_width=True)
+                    st.download_button(
+                        label="📥 ดาวน์โหลดรายงานแถวที่แปลงพิกัดไม่ได้ (CSV)",
+                        data=rejects.to_csv(index=False).encode("utf-8-sig"),
+                        file_name=f"{os.path.splitext(output_filename)[0]}_rejects.csv",
+                        mime="text/csv"
+                    )
+
     except Exception as e:
         st.error(f"❌ ไม่สามารถโหลดไฟล์: {e}")
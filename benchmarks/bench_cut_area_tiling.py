@@ -0,0 +1,90 @@
+"""
+Benchmark grid-tiled boundary clipping against whole-polygon intersection.
+
+Builds a coastline-like boundary with many vertices and a set of lines that
+cross it, then times ``geom.intersection(boundary)`` against
+``intersection_tiled`` from ``cut_area_clip.py`` (used by ``pages/cut-area.py``),
+checking that both give the same coordinates (the tile seam vertices are removed).
+
+    python benchmarks/bench_cut_area_tiling.py --vertices 80000 --features 2000
+"""
+import argparse
+import time
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString, Polygon
+
+import page_loader  # noqa: F401 (เพิ่ม root ของ repo ใน sys.path)
+from cut_area_clip import intersection_tiled, tile_boundary
+
+
+def coastline_polygon(n_vertices, rng):
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    # รัศมีแบบมีคลื่นหลายความถี่ ให้ขอบหยักคล้ายแนวชายฝั่ง
+    radius = 1.0 + sum(
+        rng.uniform(0.005, 0.05) / k * np.sin(k * angles + rng.uniform(0, 2 * np.pi))
+        for k in range(1, 200, 7)
+    )
+    return Polygon(np.column_stack([100 + radius * np.cos(angles), 13 + radius * np.sin(angles)]))
+
+
+def crossing_lines(n_features, rng):
+    lines = []
+    for _ in range(n_features):
+        angle = rng.uniform(0, 2 * np.pi)
+        start = rng.uniform(0.85, 0.95)
+        end = rng.uniform(1.05, 1.2)
+        steps = np.linspace(start, end, 20)
+        wobble = rng.normal(0, 0.002, size=(20, 2))
+        xy = np.column_stack([100 + steps * np.cos(angle), 13 + steps * np.sin(angle)]) + wobble
+        lines.append(LineString(xy))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vertices", type=int, default=80000)
+    parser.add_argument("--features", type=int, default=2000)
+    parser.add_argument("--tile-vertices", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    boundary = coastline_polygon(args.vertices, rng)
+    lines = crossing_lines(args.features, rng)
+
+    start = time.perf_counter()
+    whole = [line.intersection(boundary) for line in lines]
+    whole_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tiles = tile_boundary(boundary, args.tile_vertices)
+    tile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tiled = [intersection_tiled(line, tiles) for line in lines]
+    tiled_time = time.perf_counter() - start
+
+    max_error = max(
+        shapely.hausdorff_distance(a, b) for a, b in zip(whole, tiled) if not a.is_empty
+    )
+    length_error = abs(sum(g.length for g in whole) - sum(g.length for g in tiled))
+    identical = sum(
+        shapely.normalize(a).equals_exact(shapely.normalize(b), 0) for a, b in zip(whole, tiled)
+    )
+
+    print(f"boundary vertices     : {args.vertices:,}")
+    print(f"crossing features     : {args.features:,}")
+    print(f"tiles                 : {len(tiles[0]):,} (max {args.tile_vertices:,} vertices per tile target)")
+    print(f"whole-polygon clip    : {whole_time:.3f} s")
+    print(f"tile build (once)     : {tile_time:.3f} s")
+    print(f"tiled clip            : {tiled_time:.3f} s")
+    print(f"speed-up (incl. build): {whole_time / (tiled_time + tile_time):.1f}x")
+    print(f"max Hausdorff error   : {max_error:.2e}")
+    print(f"total length error    : {length_error:.2e}")
+    print(f"identical coordinates : {identical:,} / {len(lines):,}")
+
+
+if __name__ == "__main__":
+    main()
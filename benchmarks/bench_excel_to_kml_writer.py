@@ -0,0 +1,114 @@
+"""
+Benchmark the KML writers in ``pages/excel-to-kml.py``.
+
+Builds an NTSP style coordinate table (one row per point, grouped by ``id``
+and ordered by ``ลำดับพิกัด``), then times the original simplekml writer
+(object graph, save to the temp directory, read back) against the streaming
+lxml writer into a BytesIO, records peak Python memory of each with
+tracemalloc and checks that both produce the same folders, names,
+descriptions and coordinates.
+
+    python benchmarks/bench_excel_to_kml_writer.py --points 100000 --points-per-id 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import pandas as pd
+from lxml import etree
+
+from page_loader import load_page
+
+KML = "{http://www.opengis.net/kml/2.2}"
+
+
+def ntsp_table(points, points_per_id, rng):
+    rows = []
+    for i in range(points):
+        device_id = 100000 + i // points_per_id
+        lon = 100 + rng.random()
+        lat = 13 + rng.random()
+        rows.append({
+            "id": device_id,
+            "วันที่สร้าง": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}",
+            "รหัสอุปกรณ์": f"EQ{device_id}",
+            "ชื่ออุปกรณ์": rng.choice(["เสา", "บ่อพัก", "ตู้ & กล่อง"]),
+            "ชื่อโปรเจค": f"โครงการ {device_id % 7}",
+            "ชื่อชุมสาย": f"ชุมสาย {device_id % 50}",
+            "ระยะทาง": round(rng.random() * 1000, 2),
+            "ลำดับพิกัด": points_per_id - i % points_per_id,
+            "พิกัด": (lon, lat),
+        })
+    return pd.DataFrame(rows)
+
+
+def simplekml_bytes(excel_to_kml, data):
+    temp_file_path = os.path.join(tempfile.gettempdir(), "bench_excel_to_kml_writer.kml")
+    excel_to_kml.save_simplekml(data, temp_file_path)
+    with open(temp_file_path, "rb") as f:
+        kml_bytes = BytesIO(f.read())
+    os.remove(temp_file_path)
+    return kml_bytes
+
+
+def stream_bytes(excel_to_kml, data):
+    kml_bytes = BytesIO()
+    excel_to_kml.write_kml_stream(data, kml_bytes)
+    return kml_bytes
+
+
+def measure(write, excel_to_kml, data):
+    start = time.perf_counter()
+    kml_bytes = write(excel_to_kml, data)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    write(excel_to_kml, data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return kml_bytes, elapsed, peak
+
+
+def layout(kml_bytes):
+    """Folder names with (name, description, coordinates) of each Placemark, ignoring ids and styles."""
+    folders = []
+    for folder in etree.fromstring(kml_bytes.getvalue()).iter(f"{KML}Folder"):
+        placemarks = [
+            (
+                placemark.findtext(f"{KML}name"),
+                placemark.findtext(f"{KML}description"),
+                [tuple(map(float, c.split(","))) for c in placemark.findtext(f".//{KML}coordinates").split()],
+            )
+            for placemark in folder.iterfind(f"{KML}Placemark")
+        ]
+        folders.append((folder.findtext(f"{KML}name"), placemarks))
+    return folders
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--points-per-id", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    excel_to_kml = load_page("excel-to-kml.py")
+    data = ntsp_table(args.points, args.points_per_id, random.Random(args.seed))
+
+    before, simplekml_time, simplekml_peak = measure(simplekml_bytes, excel_to_kml, data)
+    after, stream_time, stream_peak = measure(stream_bytes, excel_to_kml, data)
+
+    print(f"points                : {args.points:,} ({data['id'].nunique():,} ids)")
+    print(f"simplekml             : {simplekml_time:.3f} s, peak {simplekml_peak / 2**20:,.0f} MB, "
+          f"{len(before.getvalue()) / 2**20:,.1f} MB file")
+    print(f"lxml xmlfile stream   : {stream_time:.3f} s ({simplekml_time / stream_time:.1f}x), "
+          f"peak {stream_peak / 2**20:,.0f} MB, {len(after.getvalue()) / 2**20:,.1f} MB file")
+    print(f"same layout           : {layout(before) == layout(after)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark description table extraction in ``kml_to_excel_convert.py``
+(used by ``pages/kml-to-excel.py``).
+
+Builds ArcGIS/Google Earth style HTML descriptions (a layer title row and a
+nested attribute table) for a number of Placemarks, then times the original
+BeautifulSoup extractor against the lxml fast path with the layout memo and
+checks that both return the same rows.
+
+    python benchmarks/bench_kml_to_excel_description.py --features 50000 --fields 12
+"""
+import argparse
+import random
+import time
+
+import page_loader  # noqa: F401 (เพิ่ม root ของ repo ใน sys.path)
+import kml_to_excel_convert as kml_to_excel
+
+
+def arcgis_description(fields, rng, layer):
+    rows = "".join(
+        f'<tr bgcolor="{"#D4E4F3" if i % 2 else ""}"><td>FIELD_{i}</td>'
+        f"<td>{rng.choice(['A &amp; B', 'สาย ' + str(rng.randrange(10**6)), '&lt;Null&gt;', ''])}</td></tr>"
+        for i in range(fields)
+    )
+    return (
+        '<html xmlns:fo="http://www.w3.org/1999/XSL/Format"><head>'
+        '<META http-equiv="Content-Type" content="text/html"></head>'
+        '<body style="margin:0px 0px 0px 0px;overflow:auto;background:#FFFFFF;">'
+        '<table style="font-family:Arial,Verdana,Times;font-size:12px;text-align:left;width:100%;">'
+        f'<tr style="text-align:center;font-weight:bold;background:#9CBCE2"><td>{layer}</td></tr>'
+        '<tr><td><table style="font-family:Arial,Verdana,Times;font-size:12px;">'
+        f"{rows}</table></td></tr></table></body></html>"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--features", type=int, default=50000)
+    parser.add_argument("--fields", type=int, default=12)
+    parser.add_argument("--layers", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    descriptions = [
+        arcgis_description(args.fields + i % args.layers, rng, f"Layer {i % args.layers}")
+        for i in range(args.features)
+    ]
+
+    start = time.perf_counter()
+    before = [kml_to_excel.extract_description_data_bs4(d) for d in descriptions]
+    bs4_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lxml_only = [kml_to_excel.extract_description_data_lxml(d) for d in descriptions]
+    lxml_time = time.perf_counter() - start
+
+    kml_to_excel.DESCRIPTION_TEMPLATES.clear()
+    start = time.perf_counter()
+    after = [kml_to_excel.extract_description_data(d) for d in descriptions]
+    fast_time = time.perf_counter() - start
+
+    mismatches = sum(
+        list(a.items()) != list(b.items()) or list(a.items()) != list(c.items())
+        for a, b, c in zip(before, lxml_only, after)
+    )
+
+    print(f"descriptions          : {args.features:,} ({args.fields}+ fields, {args.layers} layouts)")
+    print(f"BeautifulSoup         : {bs4_time:.3f} s")
+    print(f"lxml.html + XPath     : {lxml_time:.3f} s ({bs4_time / lxml_time:.1f}x)")
+    print(f"lxml + layout memo    : {fast_time:.3f} s ({bs4_time / fast_time:.1f}x)")
+    print(f"memoized layouts      : {len(kml_to_excel.DESCRIPTION_TEMPLATES):,}")
+    print(f"mismatching rows      : {mismatches:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Load a Streamlit page script (and the repo-root modules it imports) so its functions can be benchmarked."""
+import importlib.util
+import logging
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# โมดูลที่หน้าเว็บ import (เช่น cut_area_clip) อยู่ที่ root ของ repo เหมือนตอนรันด้วย streamlit run Home.py
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def load_page(file_name):
+    """
+    Import ``pages/<file_name>`` without running it under ``streamlit run``.
+
+    Streamlit calls at module level run in "bare" mode and only log warnings,
+    which are silenced here.
+    """
+    logging.disable(logging.WARNING)
+    module_name = os.path.splitext(file_name)[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(REPO_ROOT, "pages", file_name)
+    )
+    module = importlib.util.module_from_spec(spec)
+    # ต้องอยู่ใน sys.modules เพื่อให้ process pool หาฟังก์ชันของหน้าเจอ
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,438 @@
+# ส่วนอ่าน geometry และตัดเส้น/พื้นที่กับขอบเขตของหน้า cut-area (ไม่มีการเรียก Streamlit)
+# แยกเป็นโมดูลที่ import ได้ เพื่อให้ process pool ที่เริ่มด้วย forkserver/spawn หาฟังก์ชันของงานเจอ
+import copy
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from lxml import etree
+import shapely
+from shapely import STRtree
+from shapely.geometry import (
+    Point, LineString, Polygon, MultiPoint, MultiLineString, MultiPolygon, GeometryCollection
+)
+from worker_pool import worker_context
+
+KML_NS = "{http://www.opengis.net/kml/2.2}"
+
+# ชนิด geometry ที่ตัดได้ เรียงตามลำดับที่ใช้ค้นใน Placemark
+GEOMETRY_KINDS = {"MultiGeometry": "multi", "Point": "point", "LineString": "line", "Polygon": "polygon"}
+
+# ฟังก์ชันหา element geometry ของ Placemark (MultiGeometry / Point / LineString / Polygon)
+def find_geometry_elem(placemark):
+    for tag, kind in GEOMETRY_KINDS.items():
+        geom_elem = placemark.find(f".//{KML_NS}{tag}")
+        if geom_elem is not None:
+            return kind, geom_elem
+    return None, None
+
+# ฟังก์ชันหา element พิกัดของ Placemark (Point / LineString / วงนอกของ Polygon)
+# MultiGeometry มีพิกัดแยกตามแต่ละส่วน จึงคืนค่า None
+def find_coords_elem(placemark):
+    kind, geom_elem = find_geometry_elem(placemark)
+    if kind == "polygon":
+        return kind, geom_elem.find(f".//{KML_NS}outerBoundaryIs//{KML_NS}coordinates")
+    if kind in ("point", "line"):
+        return kind, geom_elem.find(f".//{KML_NS}coordinates")
+    return kind, None
+
+def parse_coords(coords_elem):
+    return [
+        tuple(map(float, c.split(',')[:2]))
+        for c in coords_elem.text.strip().split()
+    ]
+
+# ฟังก์ชันแปลง element geometry เป็น shapely (None = ไม่มีข้อมูลให้ตัด)
+# Polygon อ่านทั้งวงนอกและวงใน (รู) ส่วน MultiGeometry อ่านทุกส่วนเป็น GeometryCollection
+def parse_geometry(kind, geom_elem):
+    try:
+        if kind == "multi":
+            parts = []
+            for child in geom_elem:
+                child_kind = GEOMETRY_KINDS.get(etree.QName(child).localname) if isinstance(child.tag, str) else None
+                part = parse_geometry(child_kind, child) if child_kind else None
+                if part is not None:
+                    parts.extend(part.geoms if child_kind == "multi" else [part])
+            return GeometryCollection(parts) if parts else None
+
+        if kind == "polygon":
+            outer = geom_elem.find(f"{KML_NS}outerBoundaryIs//{KML_NS}coordinates")
+            inners = geom_elem.findall(f"{KML_NS}innerBoundaryIs//{KML_NS}coordinates")
+            return Polygon(parse_coords(outer), [parse_coords(inner) for inner in inners])
+
+        pts = parse_coords(geom_elem.find(f".//{KML_NS}coordinates"))
+        if kind == "point":
+            return Point(pts[0])
+        return LineString(pts)
+    except (AttributeError, ValueError, IndexError):
+        # พิกัดไม่ครบ/ผิดรูปแบบ ให้ถือว่าไม่มี geometry และเก็บ Placemark ไว้ตามเดิม
+        return None
+
+# ฟังก์ชันอ่าน geometry ของทุก Placemark ในรอบเดียว
+# Point เก็บเป็น array ของ x/y (ไม่สร้าง shapely Point ทีละจุด) ส่วนเส้น/พื้นที่เก็บเป็น array ของ shapely
+def read_features(placemarks):
+    kinds = []
+    geoms = np.full(len(placemarks), None, dtype=object)
+    xs = np.full(len(placemarks), np.nan)
+    ys = np.full(len(placemarks), np.nan)
+    for i, placemark in enumerate(placemarks):
+        kind, geom_elem = find_geometry_elem(placemark)
+        kinds.append(kind)
+        if kind == "point":
+            try:
+                xs[i], ys[i] = parse_coords(geom_elem.find(f".//{KML_NS}coordinates"))[0]
+            except (AttributeError, ValueError, IndexError):
+                # Point ที่ไม่มีพิกัดจะถูกเก็บไว้ตามเดิม
+                pass
+        elif kind is not None:
+            geoms[i] = parse_geometry(kind, geom_elem)
+    return {
+        "kinds": kinds,
+        "geoms": geoms,
+        "xs": xs,
+        "ys": ys,
+        "is_point": ~np.isnan(xs),
+    }
+
+# ผลการตัดของแต่ละ Placemark มี 3 แบบ:
+#   None  = ไม่ต้องแก้ geometry
+#   str   = ข้อความพิกัดใหม่ของ coordinates เดิม (LineString / Polygon ที่ไม่มีรู)
+#   bytes = WKB ของ geometry ใหม่ที่ใช้แทน element geometry เดิมทั้งก้อน (MultiGeometry / Polygon ที่มีรู)
+def is_structured_geometry(geom):
+    if isinstance(geom, Polygon):
+        return len(geom.interiors) > 0
+    return not isinstance(geom, LineString)
+
+# ฟังก์ชันแปลงผลการตัดหลายรายการเป็นข้อความพิกัดพร้อมกัน (ต่อทุกส่วนเป็นชุดเดียวเหมือนเดิม)
+# Polygon ใช้เฉพาะวงนอก ส่วน Point ที่ได้จากการตัดไม่นำมาต่อ; คืนค่า None ถ้าไม่มีพิกัดเหลือ
+def clipped_coords_texts(clipped):
+    parts, part_geom = shapely.get_parts(clipped, return_index=True)
+    type_ids = shapely.get_type_id(parts)
+    is_polygon = type_ids == shapely.GeometryType.POLYGON
+    parts[is_polygon] = shapely.get_exterior_ring(parts[is_polygon])
+    is_linear = np.isin(type_ids, (shapely.GeometryType.LINESTRING, shapely.GeometryType.LINEARRING)) | is_polygon
+
+    coords, coord_part = shapely.get_coordinates(parts[is_linear], return_index=True)
+    coord_geom = part_geom[is_linear][coord_part]
+    pairs = np.char.add(np.char.add(coords[:, 0].astype(str), ","), coords[:, 1].astype(str))
+    starts = np.searchsorted(coord_geom, np.arange(len(clipped) + 1))
+    return [
+        " ".join(pairs[start:end]) if end > start else None
+        for start, end in zip(starts[:-1], starts[1:])
+    ]
+
+def clipped_coords_text(clipped):
+    return clipped_coords_texts(np.array([clipped], dtype=object))[0]
+
+GEOMETRY_PROPERTY_TAGS = {f"{KML_NS}extrude", f"{KML_NS}tessellate", f"{KML_NS}altitudeMode"}
+
+# ฟังก์ชันสร้าง element KML จาก shapely geometry
+# template คือ element geometry เดิม ใช้คัดลอกค่าอย่าง tessellate / altitudeMode ของส่วนชนิดเดียวกัน
+def geometry_to_kml(geom, template=None):
+    if isinstance(geom, (MultiPoint, MultiPolygon, MultiLineString, GeometryCollection)):
+        geom_elem = etree.Element(f"{KML_NS}MultiGeometry")
+        for part in geom.geoms:
+            geom_elem.append(geometry_to_kml(part, template))
+        return geom_elem
+
+    tag = geom.geom_type if geom.geom_type != "LinearRing" else "LineString"
+    geom_elem = etree.Element(f"{KML_NS}{tag}")
+    if template is not None:
+        source = template if etree.QName(template).localname == tag else template.find(f".//{KML_NS}{tag}")
+        if source is not None:
+            for child in source:
+                if child.tag in GEOMETRY_PROPERTY_TAGS:
+                    geom_elem.append(copy.deepcopy(child))
+
+    def coords_elem(parent, ring):
+        etree.SubElement(parent, f"{KML_NS}coordinates").text = " ".join(f"{x},{y}" for x, y, *_ in ring.coords)
+
+    if isinstance(geom, Polygon):
+        linear_ring = etree.SubElement(etree.SubElement(geom_elem, f"{KML_NS}outerBoundaryIs"), f"{KML_NS}LinearRing")
+        coords_elem(linear_ring, geom.exterior)
+        for interior in geom.interiors:
+            linear_ring = etree.SubElement(etree.SubElement(geom_elem, f"{KML_NS}innerBoundaryIs"), f"{KML_NS}LinearRing")
+            coords_elem(linear_ring, interior)
+    else:
+        coords_elem(geom_elem, geom)
+    return geom_elem
+
+# ฟังก์ชันใส่ผลการตัดลงใน Placemark แล้วคืนค่าฟังก์ชันสำหรับคืน geometry เดิม
+def apply_clip_value(placemark, clip_value):
+    if clip_value is None:
+        return lambda: None
+
+    if isinstance(clip_value, str):
+        coords_elem = find_coords_elem(placemark)[1]
+        original_text = coords_elem.text
+        coords_elem.text = clip_value
+
+        def restore():
+            coords_elem.text = original_text
+        return restore
+
+    geom_elem = find_geometry_elem(placemark)[1]
+    new_elem = geometry_to_kml(shapely.from_wkb(clip_value), geom_elem)
+    new_elem.tail = geom_elem.tail
+    parent = geom_elem.getparent()
+    parent.replace(geom_elem, new_elem)
+
+    def restore():
+        parent.replace(new_elem, geom_elem)
+    return restore
+
+# สถิติว่าเส้น/พื้นที่ผ่านการทดสอบขั้นไหน (ใช้ดูว่าประหยัดการ intersection ไปได้เท่าไร)
+CLIP_TIERS = {
+    "bbox_reject": "ตัดทิ้งด้วย bounding box",
+    "outside": "อยู่นอกขอบเขตทั้งหมด",
+    "inside": "อยู่ในขอบเขตทั้งหมด (ไม่แก้พิกัด)",
+    "intersect": "คร่อมขอบเขต (ตัดจริง)",
+}
+
+def new_clip_stats():
+    return dict.fromkeys(CLIP_TIERS, 0)
+
+# ฟังก์ชันแบ่งขอบเขตที่มีจุดยอดมาก (เช่นจังหวัดติดชายฝั่ง) เป็นตาราง tile ล่วงหน้า
+# คืนค่า (array ของ tile, STRtree ของ tile, แนวเส้นตารางแกน x, แกน y) หรือ None ถ้าขอบเขตไม่ใหญ่พอที่จะแบ่ง
+def tile_boundary(boundary_polygon, max_vertices):
+    n_vertices = shapely.get_num_coordinates(boundary_polygon)
+    if not max_vertices or n_vertices <= max_vertices:
+        return None
+
+    cells = math.ceil(math.sqrt(n_vertices / max_vertices))
+    minx, miny, maxx, maxy = boundary_polygon.bounds
+    xs = np.linspace(minx, maxx, cells + 1)
+    ys = np.linspace(miny, maxy, cells + 1)
+    grid = shapely.box(
+        xs[:-1, np.newaxis], ys[np.newaxis, :-1], xs[1:, np.newaxis], ys[np.newaxis, 1:]
+    ).ravel()
+    tiles = shapely.intersection(boundary_polygon, grid)
+    tiles = tiles[~shapely.is_empty(tiles)]
+    return tiles, STRtree(tiles), xs, ys
+
+# จุดที่ห่างจากเส้นตาราง tile และจากแนวเส้นของจุดข้างเคียงไม่เกินค่านี้ (องศา ≈ 0.1 มม.) ถือเป็นจุดรอยต่อ tile
+SEAM_TOLERANCE = 1e-9
+
+# ฟังก์ชันลบจุดยอดรอยต่อ tile ออกจากลำดับพิกัดหนึ่งชุด (เส้นหรือวงของพื้นที่)
+# จุดรอยต่อคือจุดที่อยู่บนเส้นตาราง ไม่ใช่จุดยอดเดิมของ geometry และอยู่ในแนวเดียวกับจุดข้างเคียง
+def drop_seam_vertices(coords, original, xs, ys, closed):
+    coords = np.asarray(coords)
+    if closed:
+        coords = coords[:-1]
+    if len(coords) < 3:
+        return None
+    xy = coords[:, :2]
+    prev_xy = np.roll(xy, 1, axis=0)
+    next_xy = np.roll(xy, -1, axis=0)
+    chord = next_xy - prev_xy
+    offset = np.abs(
+        chord[:, 0] * (xy[:, 1] - prev_xy[:, 1]) - chord[:, 1] * (xy[:, 0] - prev_xy[:, 0])
+    ) / np.maximum(np.hypot(chord[:, 0], chord[:, 1]), np.finfo(float).tiny)
+    seam = (
+        (offset <= SEAM_TOLERANCE)
+        & (
+            (np.abs(xy[:, 0, np.newaxis] - xs).min(axis=1) <= SEAM_TOLERANCE)
+            | (np.abs(xy[:, 1, np.newaxis] - ys).min(axis=1) <= SEAM_TOLERANCE)
+        )
+    )
+    if not closed:
+        # ปลายเส้นเป็นจุดที่ตัดกับขอบเขต ต้องเก็บไว้เสมอ
+        seam[0] = seam[-1] = False
+    for i in np.flatnonzero(seam):
+        if tuple(xy[i]) in original:
+            seam[i] = False
+    if not seam.any():
+        return None
+    kept = coords[~seam]
+    if closed:
+        if len(kept) < 3:
+            return None
+        kept = np.vstack([kept, kept[:1]])
+    return kept
+
+# ฟังก์ชันลบจุดยอดรอยต่อ tile ของทุกส่วนของผลการตัด ให้พิกัดตรงกับการตัดกับขอบเขตทั้งก้อน
+def remove_seam_vertices(clipped, original, xs, ys):
+    if isinstance(clipped, LineString):
+        kept = drop_seam_vertices(clipped.coords, original, xs, ys, closed=False)
+        return clipped if kept is None else LineString(kept)
+    if isinstance(clipped, Polygon):
+        rings = [clipped.exterior, *clipped.interiors]
+        kept = [drop_seam_vertices(ring.coords, original, xs, ys, closed=True) for ring in rings]
+        if all(ring is None for ring in kept):
+            return clipped
+        kept = [ring.coords if new is None else new for ring, new in zip(rings, kept)]
+        return Polygon(kept[0], kept[1:])
+    if isinstance(clipped, (MultiLineString, MultiPolygon, GeometryCollection)):
+        return type(clipped)([remove_seam_vertices(part, original, xs, ys) for part in clipped.geoms])
+    return clipped
+
+# ฟังก์ชันตัด geometry กับเฉพาะ tile ที่ซ้อนทับ แล้วต่อชิ้นที่ได้กลับเป็นชิ้นเดียว
+def intersection_tiled(geom, tiles):
+    tile_geoms, tile_tree, xs, ys = tiles
+    pieces = shapely.intersection(geom, tile_geoms[tile_tree.query(geom)])
+    pieces = pieces[~shapely.is_empty(pieces)]
+    if not len(pieces):
+        return GeometryCollection()
+
+    clipped = shapely.union_all(pieces)
+    if isinstance(clipped, MultiLineString):
+        # ต่อเส้นที่ถูกแบ่งตามรอยต่อ tile กลับเป็นเส้นเดียว (คงทิศทางเดิม)
+        clipped = shapely.line_merge(clipped, directed=True)
+    if len(pieces) == 1:
+        return clipped
+    original = set(map(tuple, shapely.get_coordinates(geom)))
+    return remove_seam_vertices(clipped, original, xs, ys)
+
+# ฟังก์ชันตัด geometry หลายรายการกับขอบเขตพร้อมกัน (ถ้าแบ่ง tile ไว้จะตัดกับเฉพาะ tile ที่ซ้อนทับ)
+def intersect_boundary(geoms, boundary_polygon, tiles=None):
+    if tiles is None:
+        return shapely.intersection(geoms, boundary_polygon)
+    clipped = np.empty(len(geoms), dtype=object)
+    clipped[:] = [intersection_tiled(geom, tiles) for geom in geoms]
+    return clipped
+
+# ฟังก์ชันตัด MultiGeometry / Polygon ที่มีรู ทีละส่วน โดยคงรูและส่วนย่อยไว้ในผลลัพธ์
+def clip_structured_geometry(geom, boundary_polygon, stats, tiles=None):
+    parts = shapely.get_parts(geom)
+    hits = shapely.intersects(boundary_polygon, parts)
+    if not hits.any():
+        stats["outside"] += 1
+        return False, None
+    inside = shapely.contains(boundary_polygon, parts)
+    if inside.all():
+        stats["inside"] += 1
+        return True, None
+
+    stats["intersect"] += 1
+    crossing = hits & ~inside
+    parts[crossing] = intersect_boundary(parts[crossing], boundary_polygon, tiles)
+    parts = parts[hits]
+    parts = parts[~shapely.is_empty(parts)]
+    if not len(parts):
+        return False, None
+    clipped = parts[0] if len(parts) == 1 else GeometryCollection(list(parts))
+    return True, shapely.to_wkb(clipped)
+
+# ฟังก์ชันทดสอบ/ตัดเส้นหรือพื้นที่หนึ่งรายการกับขอบเขตเดียว
+# คืนค่า (เก็บไว้หรือไม่, ผลการตัด: None / ข้อความพิกัดใหม่ / WKB ดู is_structured_geometry)
+def clip_geometry(geom, boundary_polygon, boundary_bounds, stats, tiles=None):
+    bminx, bminy, bmaxx, bmaxy = boundary_bounds
+    minx, miny, maxx, maxy = geom.bounds
+    if minx > bmaxx or maxx < bminx or miny > bmaxy or maxy < bminy:
+        stats["bbox_reject"] += 1
+        return False, None
+    if is_structured_geometry(geom):
+        return clip_structured_geometry(geom, boundary_polygon, stats, tiles)
+    if not boundary_polygon.intersects(geom):
+        stats["outside"] += 1
+        return False, None
+    if boundary_polygon.contains(geom):
+        # อยู่ในขอบเขตทั้งหมด เก็บพิกัดเดิมไว้ไม่ต้องแก้
+        stats["inside"] += 1
+        return True, None
+
+    stats["intersect"] += 1
+    if tiles is None:
+        clipped = geom.intersection(boundary_polygon)
+    else:
+        clipped = intersection_tiled(geom, tiles)
+    if clipped.is_empty:
+        return False, None
+    return True, clipped_coords_text(clipped)
+
+# ฟังก์ชันตัด feature ที่เป็นผู้สมัครทั้งหมดด้วยขอบเขตเดียว
+# คืนค่า list ของ (index ของ feature, ผลการตัด: None / ข้อความพิกัดใหม่ / WKB)
+# เส้น/พื้นที่ทั้งชุดทดสอบเป็นขั้นด้วยคำสั่งแบบ array: bounding box -> prepared intersects/contains
+# -> shapely.intersection + shapely.is_empty แล้วแปลงพิกัดกลับเป็นข้อความพร้อมกัน
+# MultiGeometry และ Polygon ที่มีรู (มีน้อย) ตัดทีละรายการด้วย clip_structured_geometry
+# Point ทั้งชุดทดสอบด้วย shapely.contains_xy ครั้งเดียว แล้วตัดสินเก็บ/ลบพร้อมกัน
+# tile_vertices > 0 จะแบ่งขอบเขตที่มีจุดยอดเกินค่านี้เป็น tile ก่อนตัด
+def clip_area(features, boundary_polygon, candidates, stats=None, tile_vertices=0):
+    if stats is None:
+        stats = new_clip_stats()
+    shapely.prepare(boundary_polygon)
+    boundary_bounds = boundary_polygon.bounds
+    tiles = tile_boundary(boundary_polygon, tile_vertices)
+
+    candidates = np.asarray(candidates, dtype=np.intp)
+    keep = np.zeros(len(candidates), dtype=bool)
+    values = np.full(len(candidates), None, dtype=object)
+
+    is_point = features["is_point"][candidates]
+    point_idx = candidates[is_point]
+    keep[is_point] = shapely.contains_xy(
+        boundary_polygon, features["xs"][point_idx], features["ys"][point_idx]
+    )
+
+    # feature ที่ไม่มี geometry ให้ตัด เก็บไว้ตามเดิม
+    pos = np.flatnonzero(~is_point)
+    geoms = features["geoms"][candidates[pos]]
+    has_geom = shapely.is_geometry(geoms)
+    keep[pos[~has_geom]] = True
+    pos, geoms = pos[has_geom], geoms[has_geom]
+
+    type_ids = shapely.get_type_id(geoms)
+    structured = (type_ids != shapely.GeometryType.LINESTRING) & ~(
+        (type_ids == shapely.GeometryType.POLYGON) & (shapely.get_num_interior_rings(geoms) == 0)
+    )
+    for p, geom in zip(pos[structured], geoms[structured]):
+        keep[p], values[p] = clip_geometry(geom, boundary_polygon, boundary_bounds, stats, tiles)
+    pos, geoms = pos[~structured], geoms[~structured]
+
+    bminx, bminy, bmaxx, bmaxy = boundary_bounds
+    bounds = shapely.bounds(geoms).reshape(-1, 4)
+    in_bbox = (bounds[:, 0] <= bmaxx) & (bounds[:, 2] >= bminx) & (bounds[:, 1] <= bmaxy) & (bounds[:, 3] >= bminy)
+    stats["bbox_reject"] += int(np.count_nonzero(~in_bbox))
+    pos, geoms = pos[in_bbox], geoms[in_bbox]
+
+    hits = shapely.intersects(boundary_polygon, geoms)
+    stats["outside"] += int(np.count_nonzero(~hits))
+    pos, geoms = pos[hits], geoms[hits]
+
+    # อยู่ในขอบเขตทั้งหมด เก็บพิกัดเดิมไว้ไม่ต้องแก้
+    inside = shapely.contains(boundary_polygon, geoms)
+    stats["inside"] += int(np.count_nonzero(inside))
+    keep[pos[inside]] = True
+    pos, geoms = pos[~inside], geoms[~inside]
+
+    stats["intersect"] += len(pos)
+    clipped = intersect_boundary(geoms, boundary_polygon, tiles)
+    nonempty = ~shapely.is_empty(clipped)
+    pos, clipped = pos[nonempty], clipped[nonempty]
+    keep[pos] = True
+    values[pos] = clipped_coords_texts(clipped)
+    return [(int(idx), value) for idx, value in zip(candidates[keep], values[keep])]
+
+# geometry ของ input ที่ process ลูกได้รับครั้งเดียวตอนเริ่ม (ไม่ต้องส่งซ้ำทุกงาน)
+worker_features = None
+
+def init_clip_worker(features):
+    global worker_features
+    worker_features = features
+
+def clip_area_worker(b, boundary_polygon, candidates, tile_vertices):
+    stats = new_clip_stats()
+    return b, clip_area(worker_features, boundary_polygon, candidates, stats, tile_vertices), stats
+
+# ฟังก์ชันกระจายงานตัดแต่ละขอบเขตไปยัง process pool
+# ผลลัพธ์เก็บตามลำดับขอบเขตเสมอ ไฟล์ที่ได้จึงเหมือนเดิมทุกไบต์ไม่ว่างานไหนเสร็จก่อน
+# area_callback(b, kept) ถูกเรียกทันทีที่แต่ละขอบเขตตัดเสร็จ (ตามลำดับที่เสร็จ)
+def clip_areas_parallel(features, tasks, workers, progress_callback=None, stats=None, area_callback=None):
+    area_results = [None] * len(tasks)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=worker_context([__name__]),
+        initializer=init_clip_worker,
+        initargs=(features,),
+    ) as pool:
+        futures = [pool.submit(clip_area_worker, *task) for task in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            b, kept, area_stats = future.result()
+            area_results[b] = kept
+            if stats is not None:
+                for key, count in area_stats.items():
+                    stats[key] += count
+            if area_callback:
+                area_callback(b, kept)
+            if progress_callback:
+                progress_callback(done, len(tasks), b)
+    return area_results
@@ -0,0 +1,46 @@
+# การแปลงคอลัมน์พิกัดของตาราง Excel ที่ใช้ร่วมกันระหว่างหน้าแรก (app.py) และหน้า excel-to-kml
+import re
+import pandas as pd
+import pyarrow as pa
+
+# ฟังก์ชันดึงค่าพิกัดจากข้อความโดยใช้ Regex
+def parse_coordinates(coord_str):
+    try:
+        matches = re.findall(r"[-+]?\d*\.\d+|[-+]?\d+", coord_str)
+        if len(matches) != 2:
+            raise ValueError("Invalid coordinate format")
+        lat, lon = map(float, matches)
+        return lon, lat
+    except Exception:
+        return None
+
+# รูปแบบพิกัดทั่วไป "lat, lon" หรือ "(lat, lon)" ที่แยกได้ในคำสั่งเดียวด้วย regex ของ pyarrow
+# ตัวเลขใช้ regex เดียวกับ parse_coordinates และตัวคั่นไม่มีตัวเลขปน ผลจึงตรงกับ re.findall ทุกแถวที่เข้ารูปแบบ
+NUMBER_PATTERN = r"[-+]?\d*\.\d+|[-+]?\d+"
+COORDINATE_PATTERN = rf"^\s*\(?\s*(?P<lat>{NUMBER_PATTERN})\s*[,\s]\s*(?P<lon>{NUMBER_PATTERN})\s*\)?\s*$"
+
+# ฟังก์ชันแยกคอลัมน์พิกัดเป็นคอลัมน์ lat/lon (float) แถวที่แปลงไม่ได้เป็น NaN
+def parse_coordinate_column(coords):
+    text = coords.dropna().astype(str)
+    parsed = (
+        text.astype(pd.ArrowDtype(pa.string()))
+        .str.extract(COORDINATE_PATTERN)
+        .astype("float64")
+    )
+
+    # แถวที่ไม่เข้ารูปแบบทั่วไป (เช่น มีข้อความปน) ใช้ parse_coordinates ทีละแถวเหมือนเดิม
+    fallback = text[parsed['lat'].isna()].map(parse_coordinates).dropna()
+    if not fallback.empty:
+        parsed.loc[fallback.index, 'lon'] = [lon for lon, _ in fallback]
+        parsed.loc[fallback.index, 'lat'] = [lat for _, lat in fallback]
+
+    return parsed.reindex(coords.index)
+
+# ฟังก์ชันรวบรวมแถวที่แปลงพิกัดไม่ได้เป็นรายงาน (เลขแถวนับตาม Excel รวมแถวหัวตาราง)
+def coordinate_rejects(data, parsed):
+    rejected = data[parsed['lat'].isna()]
+    columns = [col for col in ['id', 'ลำดับพิกัด', 'พิกัด'] if col in rejected.columns]
+    rejects = rejected[columns].copy()
+    rejects.insert(0, 'แถวใน Excel', rejected.index + 2)
+    rejects['สาเหตุ'] = rejected['พิกัด'].isna().map({True: "ไม่มีค่าพิกัด", False: "รูปแบบพิกัดไม่ถูกต้อง"})
+    return rejects.reset_index(drop=True)
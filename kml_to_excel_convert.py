@@ -0,0 +1,1220 @@
+# ส่วนอ่าน KML และเขียนไฟล์ผลลัพธ์ของหน้า kml-to-excel
+# แยกเป็นโมดูลที่ import ได้ เพื่อให้ process pool ที่เริ่มด้วย forkserver/spawn หาฟังก์ชันของงานเจอ
+# (เรียก Streamlit เฉพาะใน notify เมื่อไม่ได้รันในงานเบื้องหลังหรือ process ลูก)
+import os
+import io
+import re
+import html
+import json
+import hashlib
+import zipfile
+import tempfile
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import shapely
+import xlsxwriter
+import streamlit as st
+from lxml import etree
+import lxml.html
+from shapely.geometry import LineString
+from bs4 import BeautifulSoup
+import traceback
+from worker_pool import worker_context
+
+# -------------------------------------
+# 🚀 ฟังก์ชันประมวลผล
+# -------------------------------------
+# ข้อความเตือน (messages) และตัวนับเส้น (line_counters) ของงานแปลงที่กำลังรัน เก็บแยกต่อ thread
+# หลาย session แปลงพร้อมกันใน server เดียวได้โดยไม่เขียนทับกัน และข้อความของ process ลูกถูกส่งกลับไปแสดงใน process หลัก
+convert_state = threading.local()
+
+@contextmanager
+def using_convert_state(**values):
+    """Set ``convert_state`` attributes of the current thread for the duration of the block."""
+    saved = {name: getattr(convert_state, name, None) for name in values}
+    for name, value in values.items():
+        setattr(convert_state, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(convert_state, name, value)
+
+def notify(message, level="warning"):
+    """Show a warning/error in the page, or collect it when running in a conversion task or job."""
+    messages = getattr(convert_state, "messages", None)
+    if messages is not None:
+        messages.append((level, message))
+    else:
+        getattr(st, level)(message)
+
+# XPath ที่คอมไพล์ไว้ครั้งเดียวสำหรับอ่านตาราง <tr><td> ใน description
+HTML_ROWS = etree.XPath("//tr")
+ROW_CELLS = etree.XPath(".//td")
+CELL_TEXTS = etree.XPath(".//text()")
+
+# แยก HTML เป็นลำดับ [ข้อความ, แท็ก, ข้อความ, แท็ก, ...]
+HTML_TOKENS = re.compile(r"(<[^>]*>)")
+TABLE_TAG = re.compile(r"<(/?)(tr|td)\b", re.IGNORECASE)
+HAS_ROW = re.compile(r"<tr\b", re.IGNORECASE)
+
+# memo ของรูปแบบตาราง: โครงแท็กของ description -> ตำแหน่งข้อความของ header/value ในแต่ละแถว
+# หรือฟังก์ชัน parser ที่ต้องใช้ทุกครั้งถ้ารูปแบบนี้อ่านจากตำแหน่งข้อความไม่ได้
+DESCRIPTION_TEMPLATES = {}
+MAX_DESCRIPTION_TEMPLATES = 1024
+
+def cell_text(texts):
+    """Join text nodes the way BeautifulSoup's ``get_text(strip=True)`` does."""
+    return "".join(text.strip() for text in texts)
+
+def extract_description_data_bs4(description_html):
+    """
+    Extract ``<tr><td>header</td><td>value</td></tr>`` pairs with BeautifulSoup.
+
+    Slow but tolerant; used when lxml cannot parse the description.
+    """
+    soup = BeautifulSoup(description_html, 'html.parser')
+    extracted_data = {}
+    for row in soup.find_all('tr'):
+        cells = row.find_all('td')
+        if len(cells) >= 2:
+            extracted_data[cells[0].get_text(strip=True)] = cells[1].get_text(strip=True)
+    return extracted_data
+
+def extract_description_data_lxml(description_html):
+    """
+    Extract ``<tr><td>header</td><td>value</td></tr>`` pairs with lxml.html.
+
+    Follows the BeautifulSoup semantics: every ``<td>`` below a row counts,
+    including cells of nested tables.
+    """
+    root = lxml.html.document_fromstring(description_html)
+    extracted_data = {}
+    for row in HTML_ROWS(root):
+        cells = ROW_CELLS(row)
+        if len(cells) >= 2:
+            extracted_data[cell_text(CELL_TEXTS(cells[0]))] = cell_text(CELL_TEXTS(cells[1]))
+    return extracted_data
+
+def description_template(tokens):
+    """
+    Map each table row of a tokenized description to the text tokens of its first two cells.
+
+    Returns a list of ``(header_token_indices, value_token_indices)``, or None
+    when the tags are not explicitly opened and closed.
+    """
+    # แถว/ช่องที่เปิดอยู่ พร้อมจำนวนช่อง/แถวที่เปิดอยู่ตอนเริ่ม เพื่อตรวจว่าแท็กปิดครบตามลำดับ
+    rows, open_rows, open_cells = [], [], []
+    for i, token in enumerate(tokens):
+        if i % 2 == 0:
+            for cell, _ in open_cells:
+                cell.append(i // 2)
+            continue
+        match = TABLE_TAG.match(token)
+        if not match:
+            continue
+        closing, tag = match.group(1), match.group(2).lower()
+        if tag == "tr":
+            if closing:
+                if not open_rows or open_rows[-1][1] != len(open_cells):
+                    return None
+                open_rows.pop()
+            else:
+                row = []
+                rows.append(row)
+                open_rows.append((row, len(open_cells)))
+        elif closing:
+            if not open_cells or open_cells[-1][1] != len(open_rows):
+                return None
+            open_cells.pop()
+        else:
+            cell = []
+            for row, _ in open_rows:
+                row.append(cell)
+            open_cells.append((cell, len(open_rows)))
+    if open_rows or open_cells:
+        return None
+    return [(row[0], row[1]) for row in rows if len(row) >= 2]
+
+def read_description_template(tokens, template):
+    """Read header/value pairs of a memoized table layout from the text tokens."""
+    texts = [html.unescape(text).strip() if "&" in text else text.strip() for text in tokens[0::2]]
+    return {
+        "".join([texts[i] for i in header]): "".join([texts[i] for i in value])
+        for header, value in template
+    }
+
+def extract_description_data(description_html):
+    """
+    Extract structured data from the HTML description.
+
+    Descriptions exported from the same layer usually share one table layout
+    and only differ in cell text. The tag skeleton of each description is used
+    as a memo key: the first description of a layout is parsed with lxml and
+    the layout is remembered, later ones only slice their text between tags.
+    BeautifulSoup is the fallback for malformed HTML (unbalanced table tags or
+    markup lxml cannot parse), so such descriptions read as they always have.
+
+    Args:
+        description_html (str): HTML content from KML description
+
+    Returns:
+        dict: Dictionary containing extracted data
+    """
+    try:
+        if not HAS_ROW.search(description_html):
+            return {}
+
+        tokens = HTML_TOKENS.split(description_html)
+        skeleton = "".join(tokens[1::2])
+        template = DESCRIPTION_TEMPLATES.get(skeleton)
+        if isinstance(template, list):
+            return read_description_template(tokens, template)
+        if template is not None:
+            return template(description_html)
+
+        template = description_template(tokens)
+        if template is None:
+            # แท็ก <tr>/<td> เปิดปิดไม่ครบ ให้ BeautifulSoup อ่านแบบเดิม
+            extractor = extract_description_data_bs4
+            extracted_data = extractor(description_html)
+        else:
+            extractor = extract_description_data_lxml
+            try:
+                extracted_data = extractor(description_html)
+            except (etree.ParserError, ValueError):
+                extractor = extract_description_data_bs4
+                extracted_data = extractor(description_html)
+            if list(read_description_template(tokens, template).items()) != list(extracted_data.items()):
+                template = extractor
+
+        if len(DESCRIPTION_TEMPLATES) < MAX_DESCRIPTION_TEMPLATES:
+            DESCRIPTION_TEMPLATES[skeleton] = extractor if template is None else template
+        return extracted_data
+    except Exception as e:
+        notify(f"ไม่สามารถแยกข้อมูลจาก HTML description ได้: {str(e)}")
+        return {}
+
+def parse_coordinates(coords_text):
+    """
+    Parse coordinate text into list of coordinate tuples.
+    
+    Args:
+        coords_text (str): Text containing coordinates
+        
+    Returns:
+        list: List of coordinate tuples [(lon, lat), ...]
+    """
+    coords = []
+    try:
+        for c in coords_text.split():
+            parts = c.split(',')
+            if len(parts) >= 2:
+                coords.append((float(parts[0]), float(parts[1])))
+            else:
+                notify(f"ข้อมูลพิกัดไม่ถูกต้อง: {c}")
+    except ValueError as e:
+        notify(f"ไม่สามารถแปลงพิกัดเป็นตัวเลขได้: {str(e)}")
+    
+    return coords
+
+KML_NS = {'kml': 'http://www.opengis.net/kml/2.2'}
+KML_ROOT_TAG = '{http://www.opengis.net/kml/2.2}kml'
+KML_PLACEMARK_TAG = '{http://www.opengis.net/kml/2.2}Placemark'
+# XPath ที่คอมไพล์ไว้ครั้งเดียวสำหรับอ่านข้อมูลของแต่ละ Placemark
+# (smart_strings=False เพื่อไม่ให้ข้อความที่ได้ยึด element ไว้ในหน่วยความจำหลังถูกล้างแล้ว)
+PLACEMARK_LINE_COORDS = etree.XPath('.//kml:LineString/kml:coordinates', namespaces=KML_NS)
+PLACEMARK_NAME = etree.XPath('./kml:name/text()', namespaces=KML_NS, smart_strings=False)
+PLACEMARK_DESCRIPTION = etree.XPath('./kml:description/text()', namespaces=KML_NS, smart_strings=False)
+PLACEMARK_SCHEMA_DATA = etree.XPath('./kml:ExtendedData/kml:SchemaData', namespaces=KML_NS)
+SCHEMA_DATA_VALUES = etree.XPath('./kml:SimpleData', namespaces=KML_NS)
+PLACEMARK_DATA = etree.XPath('./kml:ExtendedData/kml:Data', namespaces=KML_NS)
+DATA_DISPLAY_NAME = etree.XPath('string(./kml:displayName)', namespaces=KML_NS, smart_strings=False)
+DATA_VALUE = etree.XPath('string(./kml:value)', namespaces=KML_NS, smart_strings=False)
+SCHEMA_FIELDS = etree.XPath('./kml:SimpleField', namespaces=KML_NS)
+KML_SCHEMA_TAG = '{http://www.opengis.net/kml/2.2}Schema'
+
+# ชนิดข้อมูลของ SimpleField ที่แปลงเป็นตัวเลข/บูลีน (ที่เหลือเก็บเป็นข้อความ)
+SIMPLE_FIELD_TYPES = {
+    "int": int, "uint": int, "short": int, "ushort": int,
+    "float": float, "double": float,
+    "bool": lambda text: text.strip().lower() in ("1", "true"),
+}
+
+def read_schema(schema):
+    """
+    Read a KML ``<Schema>`` definition.
+
+    Returns:
+        list: ``(field_name, header, converter)`` in schema order; the header
+        is the field's ``displayName`` when it has one
+    """
+    return [
+        (field.get("name"), DATA_DISPLAY_NAME(field) or field.get("name"), SIMPLE_FIELD_TYPES.get(field.get("type")))
+        for field in SCHEMA_FIELDS(schema)
+    ]
+
+def read_extended_data(placemark, schemas):
+    """
+    Read the structured attributes of a Placemark from ``<ExtendedData>``.
+
+    ``SchemaData``/``SimpleData`` values (QGIS, ogr2ogr) follow the field order
+    and types of their ``<Schema>``; fields a Placemark leaves out, or whose
+    value does not parse as the field type, are None so every line of a layer
+    has the same columns with one type each. Untyped ``Data``/``value`` pairs
+    (Google Earth) are added after them.
+
+    Args:
+        placemark: Placemark element
+        schemas (dict): Schema id -> output of ``read_schema``
+
+    Returns:
+        dict: Header -> value, empty when the Placemark has no ExtendedData
+    """
+    extracted_data = {}
+    for schema_data in PLACEMARK_SCHEMA_DATA(placemark):
+        values = {simple_data.get("name"): simple_data.text for simple_data in SCHEMA_DATA_VALUES(schema_data)}
+        fields = schemas.get(schema_data.get("schemaUrl", "").rpartition("#")[2])
+        if fields is None:
+            extracted_data.update(values)
+            continue
+        for name, header, converter in fields:
+            value = values.pop(name, None)
+            if value is not None and converter is not None:
+                try:
+                    value = converter(value)
+                except ValueError:
+                    # ค่าที่ไม่ตรงชนิดของ Schema (เช่น "N/A" ในฟิลด์ int) ถือว่าไม่มีค่า
+                    # เพื่อไม่ให้คอลัมน์ปนทั้งตัวเลขและข้อความ
+                    value = None
+            extracted_data[header] = value
+        # SimpleData ที่ไม่มีใน Schema
+        extracted_data.update(values)
+
+    for data in PLACEMARK_DATA(placemark):
+        extracted_data[DATA_DISPLAY_NAME(data) or data.get("name")] = DATA_VALUE(data)
+    return extracted_data
+
+def iter_kml_lines(uploaded_file, attributes=True):
+    """
+    Yield lines from a KML file as Shapely LineString objects with metadata, one Placemark at a time.
+
+    The file is read with ``etree.iterparse`` and every Placemark is cleared
+    once it has been read, so memory stays flat however large the file is.
+    Attributes come from ``<ExtendedData>`` when present, otherwise from the
+    HTML table in the description.
+
+    Args:
+        uploaded_file: Streamlit uploaded file object
+        attributes (bool): Read the attributes; False leaves ``Description``
+            empty for passes that only need names and geometry
+
+    Yields:
+        dict: Line data
+    """
+    try:
+        uploaded_file.seek(0)
+        context = etree.iterparse(
+            uploaded_file, events=("end",), tag=(KML_SCHEMA_TAG, KML_PLACEMARK_TAG), huge_tree=True
+        )
+        root_checked = False
+        schemas = {}
+
+        for _, placemark in context:
+            # ตรวจสอบความถูกต้องของไฟล์ KML
+            if not root_checked:
+                if placemark.getroottree().getroot().tag != KML_ROOT_TAG:
+                    notify(f"ไฟล์ {uploaded_file.name} ไม่ใช่ไฟล์ KML ที่ถูกต้อง", "error")
+                    return
+                root_checked = True
+
+            # Schema ของ ExtendedData อยู่ก่อน Placemark ที่ใช้งาน
+            if placemark.tag == KML_SCHEMA_TAG:
+                schemas[placemark.get("id") or placemark.get("name")] = read_schema(placemark)
+                continue
+
+            # ดึงชื่อของ Placemark
+            name_elements = PLACEMARK_NAME(placemark)
+            name = name_elements[0] if name_elements else "Unnamed"
+
+            try:
+                line_string = PLACEMARK_LINE_COORDS(placemark)
+
+                if line_string and line_string[0].text:
+                    coords_text = line_string[0].text.strip()
+                    coords = parse_coordinates(coords_text)
+
+                    if len(coords) > 1:
+                        line_geom = LineString(coords)
+
+                        # ข้อมูลแบบมีโครงสร้างใน ExtendedData อ่านได้ตรง ไม่ต้อง parse HTML ของคำอธิบาย
+                        description_data = read_extended_data(placemark, schemas) if attributes else {}
+                        description_elements = [] if description_data or not attributes else PLACEMARK_DESCRIPTION(placemark)
+
+                        # ดึงคำอธิบายของ Placemark
+                        if description_elements:
+                            try:
+                                description_data = extract_description_data(description_elements[0])
+                            except Exception as e:
+                                notify(f"ไม่สามารถแยกข้อมูลจากคำอธิบายของ '{name}' ได้: {str(e)}")
+
+                        yield {
+                            "Name": name,
+                            "Description": description_data,
+                            "Line": line_geom,
+                            "Start_Coordinate": coords[0] if coords else None,
+                            "End_Coordinate": coords[-1] if coords else None
+                        }
+                    else:
+                        notify(f"ไม่มีพิกัดเพียงพอสำหรับการสร้าง LineString: {name}")
+                else:
+                    # ข้ามข้อมูลที่ไม่มี LineString
+                    pass
+
+            except Exception as e:
+                notify(f"เกิดข้อผิดพลาดในการประมวลผล Placemark '{name}': {str(e)}")
+
+            # ล้าง Placemark ที่อ่านแล้ว (และ Placemark ก่อนหน้าในโฟลเดอร์เดียวกัน) ออกจาก tree
+            placemark.clear(keep_tail=False)
+            while placemark.getprevious() is not None:
+                del placemark.getparent()[0]
+
+        if not root_checked and context.root.tag != KML_ROOT_TAG:
+            notify(f"ไฟล์ {uploaded_file.name} ไม่ใช่ไฟล์ KML ที่ถูกต้อง", "error")
+
+    except Exception as e:
+        notify(f"ไม่สามารถโหลดไฟล์ KML ได้: {str(e)}", "error")
+        notify(traceback.format_exc(), "error")
+
+def load_kml_lines(uploaded_file):
+    """
+    Load lines from a KML file and return them as Shapely LineString objects with metadata.
+
+    Args:
+        uploaded_file: Streamlit uploaded file object
+
+    Returns:
+        list: List of dictionaries containing line data
+    """
+    return list(iter_kml_lines(uploaded_file))
+
+# รัศมีเฉลี่ยของโลก (เมตร) สำหรับคำนวณระยะทางแบบ haversine
+EARTH_RADIUS_M = 6_371_008.8
+# จำนวนเส้นที่คำนวณสถิติพร้อมกันในรอบเดียวของ NumPy
+STATISTICS_BATCH_LINES = 10_000
+LINE_STATISTICS = ["Length_m", "Vertex_Count", "Min_Lon", "Min_Lat", "Max_Lon", "Max_Lat"]
+
+def line_statistics(geoms):
+    """
+    Compute haversine length (metres, spherical Earth), vertex count and bounding box of many lines at once.
+
+    All coordinates are processed in one vectorized NumPy pass; segments
+    between the last vertex of a line and the first of the next are masked out.
+    The bounding box is taken from the coordinates as given, only the length
+    uses radians.
+
+    Args:
+        geoms (list): Shapely LineStrings (lon/lat)
+
+    Returns:
+        dict: ``LINE_STATISTICS`` name -> NumPy array with one value per line
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    counts = shapely.get_num_coordinates(geoms)
+    coords = shapely.get_coordinates(geoms)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    dlon, dlat = np.diff(lon), np.diff(lat)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    segments = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    # ส่วนที่เชื่อมจุดสุดท้ายของเส้นหนึ่งกับจุดแรกของเส้นถัดไปไม่ใช่ส่วนของเส้น
+    segments[starts[1:] - 1] = 0.0
+
+    lengths = np.add.reduceat(np.append(segments, 0.0), starts)
+    lon, lat = coords[:, 0], coords[:, 1]
+    return {
+        "Length_m": np.round(lengths, 2),
+        "Vertex_Count": counts,
+        "Min_Lon": np.minimum.reduceat(lon, starts),
+        "Min_Lat": np.minimum.reduceat(lat, starts),
+        "Max_Lon": np.maximum.reduceat(lon, starts),
+        "Max_Lat": np.maximum.reduceat(lat, starts),
+    }
+
+def with_line_statistics(lines, batch_size=STATISTICS_BATCH_LINES):
+    """
+    Add ``LINE_STATISTICS`` values to line dictionaries, computed per batch of lines.
+
+    Args:
+        lines (iterable): Line dictionaries, e.g. from ``iter_kml_lines``
+        batch_size (int): Number of lines per vectorized pass
+
+    Yields:
+        dict: The same line dictionaries with the statistics keys set
+    """
+    lines = iter(lines)
+    while True:
+        batch = list(itertools.islice(lines, batch_size))
+        if not batch:
+            return
+        statistics = line_statistics([line["Line"] for line in batch])
+        for i, line in enumerate(batch):
+            for name, values in statistics.items():
+                line[name] = values[i].item()
+        yield from batch
+
+def excel_rows(lines, flag_duplicates=False):
+    """
+    Yield the worksheet rows (header first) for line data.
+
+    Lines are consumed lazily: only the lines before the first one with a
+    description are held back, until the description headers are known.
+
+    Args:
+        lines (iterable): Line dictionaries, e.g. from ``iter_kml_lines``
+        flag_duplicates (bool): Add a last ``Duplicate_Of`` column from the
+            lines' ``Duplicate_Of`` key (see ``deduplicated_lines``)
+
+    Yields:
+        list: Rows to append to a worksheet
+    """
+    lines = with_line_statistics(lines)
+
+    # เพิ่มส่วนหัวจากข้อมูล Description ของเส้นแรก
+    held_lines = []
+    description_headers = []
+    for line in lines:
+        held_lines.append(line)
+        if isinstance(line.get('Description'), dict) and line['Description']:
+            description_headers = list(line['Description'].keys())
+            break
+
+    # กรณีไม่มีข้อมูลเลย
+    if not held_lines:
+        yield ['ไม่พบข้อมูลเส้นที่ถูกต้อง']
+        return
+
+    # สร้างส่วนหัวของตาราง
+    yield (
+        ['Name', 'Start_Coordinate', 'End_Coordinate'] + LINE_STATISTICS + description_headers
+        + ([DUPLICATE_COLUMN] if flag_duplicates else [])
+    )
+
+    # เพิ่มข้อมูลแต่ละแถว
+    for line in itertools.chain(held_lines, lines):
+        row = [
+            line.get("Name", "N/A"),
+            f"{line['Start_Coordinate'][0]},{line['Start_Coordinate'][1]}" if line.get("Start_Coordinate") else "N/A",
+            f"{line['End_Coordinate'][0]},{line['End_Coordinate'][1]}" if line.get("End_Coordinate") else "N/A"
+        ] + [line[name] for name in LINE_STATISTICS]
+
+        # เพิ่มข้อมูล Description
+        if isinstance(line.get('Description'), dict):
+            for header in description_headers:
+                row.append(line['Description'].get(header, "N/A"))
+        else:
+            # เพิ่มช่องว่างสำหรับคอลัมน์ Description ที่ไม่มีข้อมูล
+            for _ in description_headers:
+                row.append("N/A")
+
+        if flag_duplicates:
+            row.append(line[DUPLICATE_COLUMN] or "")
+
+        yield row
+    held_lines.clear()
+
+# จำนวนแถวสูงสุดต่อ sheet ของ Excel (รวมแถวหัวตาราง)
+EXCEL_MAX_ROWS = 1_048_576
+
+def new_workbook(output):
+    """
+    Create a streaming xlsxwriter workbook.
+
+    In ``constant_memory`` mode each row is flushed to a temporary file once
+    the next row starts, so memory stays flat however many rows are written.
+    Values are written as plain text, without number, formula or URL conversion.
+    """
+    return xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "strings_to_numbers": False,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+    })
+
+def write_sheet(sheet, rows):
+    """
+    Stream rows into a worksheet in one pass, fitting column widths as they are written.
+
+    Args:
+        sheet: xlsxwriter worksheet
+        rows (iterable): Rows from ``excel_rows``
+
+    Returns:
+        int: Number of rows written
+    """
+    widths = []
+    row_count = 0
+    for row_count, row in enumerate(rows, 1):
+        if row_count > EXCEL_MAX_ROWS:
+            continue
+        sheet.write_row(row_count - 1, 0, row)
+        for col, value in enumerate(row):
+            length = len(str(value)) if value is not None else 0
+            if col == len(widths):
+                widths.append(length)
+            elif length > widths[col]:
+                widths[col] = length
+
+    # ปรับความกว้างของคอลัมน์ให้เหมาะสม
+    for col, max_length in enumerate(widths):
+        sheet.set_column(col, col, (max_length + 2) if max_length < 50 else 50)
+    if row_count > EXCEL_MAX_ROWS:
+        notify(
+            f"ข้อมูลมี {row_count - 1:,} แถว เกินจำนวนแถวสูงสุดของ Excel "
+            f"ตัดเหลือ {EXCEL_MAX_ROWS - 1:,} แถว กรุณาใช้ CSV, Parquet หรือ GeoPackage แทน"
+        )
+    return min(row_count, EXCEL_MAX_ROWS)
+
+def save_sheets_to_excel_memory(sheets):
+    """
+    Save several sheets of rows to one Excel workbook in memory.
+
+    Args:
+        sheets (iterable): ``(sheet_title, rows)`` pairs; rows may be generators
+
+    Returns:
+        BytesIO: Excel file in memory
+    """
+    try:
+        output = io.BytesIO()
+        workbook = new_workbook(output)
+        for title, rows in sheets:
+            write_sheet(workbook.add_worksheet(title), rows)
+        workbook.close()
+        output.seek(0)
+        return output
+
+    except Exception as e:
+        notify(f"เกิดข้อผิดพลาดในการสร้างไฟล์ Excel: {str(e)}", "error")
+        notify(traceback.format_exc(), "error")
+        # สร้างไฟล์ Excel ว่างเพื่อไม่ให้โปรแกรมล่ม
+        empty_output = io.BytesIO()
+        empty_workbook = xlsxwriter.Workbook(empty_output)
+        empty_workbook.add_worksheet().write_row(0, 0, ['เกิดข้อผิดพลาดในการสร้างไฟล์ Excel'])
+        empty_workbook.close()
+        empty_output.seek(0)
+        return empty_output
+
+def save_to_excel_memory(lines, flag_duplicates=False):
+    """
+    Save line data to Excel in memory.
+
+    Args:
+        lines (iterable): Line dictionaries; a generator is written as it is consumed
+        flag_duplicates (bool): Add the ``Duplicate_Of`` column (see ``excel_rows``)
+
+    Returns:
+        BytesIO: Excel file in memory
+    """
+    return save_sheets_to_excel_memory([("KML Data", excel_rows(lines, flag_duplicates))])
+
+# -------------------------------------
+# 🧮 ไฟล์ผลลัพธ์แบบตาราง (CSV / Parquet / GeoPackage)
+# -------------------------------------
+FORMAT_XLSX = "Excel (.xlsx)"
+FORMAT_CSV = "CSV (.csv)"
+FORMAT_PARQUET = "Parquet (.parquet)"
+FORMAT_GPKG = "GeoPackage (.gpkg)"
+EXPORT_FORMATS = {
+    FORMAT_XLSX: (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    FORMAT_CSV: (".csv", "text/csv"),
+    FORMAT_PARQUET: (".parquet", "application/vnd.apache.parquet"),
+    FORMAT_GPKG: (".gpkg", "application/geopackage+sqlite3"),
+}
+LINE_COLUMNS = ["Name", "Start_Coordinate", "End_Coordinate"]
+GEOMETRY_COLUMN = "geometry"
+
+def format_coordinate(coord):
+    return f"{coord[0]},{coord[1]}" if coord else None
+
+def line_columns(lines, flag_duplicates=False):
+    """
+    Accumulate line data column by column, with the geometry as WKB.
+
+    Unlike the Excel rows, the description columns are the union of the
+    headers of all lines (in first-seen order); lines without a header get None.
+
+    Args:
+        lines (iterable): Line dictionaries, e.g. from ``iter_kml_lines``
+        flag_duplicates (bool): Add a ``Duplicate_Of`` column before the
+            geometry from the lines' ``Duplicate_Of`` key
+
+    Returns:
+        dict: Column name -> list of values, ``geometry`` holding WKB bytes
+    """
+    columns = {name: [] for name in LINE_COLUMNS + LINE_STATISTICS}
+    descriptions = {}
+    duplicate_of = []
+    geometries = []
+    for count, line in enumerate(with_line_statistics(lines)):
+        columns["Name"].append(line.get("Name"))
+        columns["Start_Coordinate"].append(format_coordinate(line.get("Start_Coordinate")))
+        columns["End_Coordinate"].append(format_coordinate(line.get("End_Coordinate")))
+        for name in LINE_STATISTICS:
+            columns[name].append(line[name])
+        geometries.append(line["Line"].wkb)
+        if flag_duplicates:
+            duplicate_of.append(line[DUPLICATE_COLUMN])
+
+        description = line.get("Description")
+        if not isinstance(description, dict):
+            description = {}
+        for header in description:
+            if header not in descriptions:
+                descriptions[header] = [None] * count
+        for header, values in descriptions.items():
+            values.append(description.get(header))
+
+    # หัวคอลัมน์จาก description ต้องไม่ซ้ำกับคอลัมน์หลักหรือว่าง
+    used = {name.lower() for name in LINE_COLUMNS + LINE_STATISTICS + [GEOMETRY_COLUMN]}
+    if flag_duplicates:
+        used.add(DUPLICATE_COLUMN.lower())
+    for header, values in descriptions.items():
+        columns[unique_name(header or "Description", used)] = values
+    if flag_duplicates:
+        columns[DUPLICATE_COLUMN] = duplicate_of
+    columns[GEOMETRY_COLUMN] = geometries
+    return columns
+
+def text_if_mixed(values):
+    """
+    Convert a column whose values are of more than one type (e.g. numbers and
+    text from different Schemas or untyped ``Data``; int and float count as one)
+    to text, None staying None,
+    so pyarrow and GDAL see a single type per column instead of failing on it.
+    """
+    kinds = {
+        "number" if isinstance(value, (int, float)) and not isinstance(value, bool) else type(value)
+        for value in values if value is not None
+    }
+    if len(kinds) <= 1:
+        return values
+    return [None if value is None else str(value) for value in values]
+
+def columns_frame(columns, geometry_as=None):
+    """
+    Build a DataFrame from accumulated columns; columns of mixed types become text.
+
+    Args:
+        columns (dict): Output of ``line_columns``
+        geometry_as (str): ``"wkt"`` to convert the WKB geometry to WKT text,
+            None to keep WKB bytes
+
+    Returns:
+        DataFrame: Attribute columns followed by the geometry column
+    """
+    frame = pd.DataFrame({name: text_if_mixed(values) for name, values in columns.items() if name != GEOMETRY_COLUMN})
+    geometries = np.array(columns[GEOMETRY_COLUMN], dtype=object)
+    if geometry_as == "wkt":
+        geometries = shapely.to_wkt(shapely.from_wkb(geometries), rounding_precision=-1)
+    frame[GEOMETRY_COLUMN] = geometries
+    return frame
+
+def save_csv(columns):
+    """Save accumulated columns as UTF-8 CSV (with BOM so Excel reads Thai text), geometry as WKT."""
+    return columns_frame(columns, geometry_as="wkt").to_csv(index=False).encode("utf-8-sig")
+
+def save_parquet(columns):
+    """
+    Save accumulated columns as GeoParquet: a Parquet file with WKB geometry
+    and the ``geo`` schema metadata, so ``geopandas.read_parquet`` restores the geometry.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(columns_frame(columns), preserve_index=False)
+    geo = {
+        "version": "1.0.0",
+        "primary_column": GEOMETRY_COLUMN,
+        "columns": {GEOMETRY_COLUMN: {"encoding": "WKB", "geometry_types": ["LineString"]}},
+    }
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"geo": json.dumps(geo).encode()})
+    output = io.BytesIO()
+    pq.write_table(table, output)
+    return output.getvalue()
+
+def write_gpkg_layer(path, layer_name, columns):
+    """Add ``columns`` as a layer of the GeoPackage at ``path`` (EPSG:4326), creating the file if needed."""
+    import geopandas as gpd
+
+    frame = columns_frame(columns)
+    frame = gpd.GeoDataFrame(
+        frame.drop(columns=GEOMETRY_COLUMN),
+        geometry=gpd.GeoSeries.from_wkb(frame[GEOMETRY_COLUMN], crs="EPSG:4326"),
+    )
+    frame.to_file(path, layer=layer_name, driver="GPKG")
+
+def save_gpkg(layers):
+    """
+    Save one or more ``(layer_name, columns)`` pairs as layers of one GeoPackage (EPSG:4326).
+
+    Returns:
+        bytes: GeoPackage file content
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "lines.gpkg")
+        for layer_name, columns in layers:
+            write_gpkg_layer(path, layer_name, columns)
+        with open(path, "rb") as f:
+            return f.read()
+
+def save_columns(columns, export_format, layer_name="lines"):
+    if export_format == FORMAT_CSV:
+        return save_csv(columns)
+    if export_format == FORMAT_PARQUET:
+        return save_parquet(columns)
+    return save_gpkg([(layer_name, columns)])
+
+# -------------------------------------
+# 🧬 ตรวจเส้นซ้ำข้ามไฟล์ด้วย hash ของเนื้อหา
+# -------------------------------------
+DEDUP_OFF = "ไม่ตรวจเส้นซ้ำ"
+DEDUP_DROP = "ตัดเส้นซ้ำออก"
+DEDUP_FLAG = "ทำเครื่องหมายเส้นซ้ำ (คอลัมน์ Duplicate_Of)"
+DUPLICATE_COLUMN = "Duplicate_Of"
+# ปัดพิกัดก่อนคำนวณ hash (7 ตำแหน่ง ≈ 1 ซม.) เพื่อไม่ให้ความต่างของการเขียนตัวเลขทำให้ดูเป็นคนละเส้น
+LINE_HASH_DECIMALS = 7
+
+def line_hash(line):
+    """
+    Hash a line by its name and normalized coordinates.
+
+    Coordinates are rounded to ``LINE_HASH_DECIMALS`` and the vertex order is
+    normalized so a line digitized in the opposite direction hashes the same.
+
+    Returns:
+        bytes: 16-byte BLAKE2b digest
+    """
+    coords = np.round(shapely.get_coordinates(line["Line"]), LINE_HASH_DECIMALS) + 0.0
+    if tuple(coords[-1]) < tuple(coords[0]):
+        coords = coords[::-1]
+    digest = hashlib.blake2b(str(line.get("Name")).encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(coords).tobytes())
+    return digest.digest()
+
+def find_duplicates(file_hashes):
+    """
+    Find duplicate lines across files with one hash set, in upload order.
+
+    The first occurrence of a line (lowest file index, then row order) is kept.
+    Only the hashes are held here; the rows are dropped or flagged later by
+    ``deduplicated_lines`` while each file is written.
+
+    Args:
+        file_hashes (dict): File index -> list of line hashes
+
+    Returns:
+        tuple: ``(earlier, counts)``, both keyed by file index: the hashes of
+        the file first seen in an earlier file (hash -> index of that file),
+        and the number of duplicate lines in the file (repeats within the
+        file included)
+    """
+    first_seen = {}
+    earlier = {}
+    counts = {}
+    for index in sorted(file_hashes):
+        file_earlier = {}
+        seen = set()
+        count = 0
+        for digest in file_hashes[index]:
+            source = first_seen.setdefault(digest, index)
+            if source != index:
+                file_earlier[digest] = source
+            if source != index or digest in seen:
+                count += 1
+            seen.add(digest)
+        earlier[index] = file_earlier
+        counts[index] = count
+    return earlier, counts
+
+def deduplicated_lines(lines, file_name, earlier, dedup_mode):
+    """
+    Drop or flag duplicate lines of one file while they stream to the writer.
+
+    Args:
+        lines (iterable): Line dictionaries of the file, in file order
+        file_name (str): Name of the file, for repeats within the file
+        earlier (dict): Line hash -> name of the earlier file holding the
+            first occurrence (from ``find_duplicates``)
+        dedup_mode (str): ``DEDUP_DROP`` or ``DEDUP_FLAG``
+
+    Yields:
+        dict: Kept lines; with ``DEDUP_FLAG`` every line, its ``Duplicate_Of``
+        key set to the file of the first occurrence or None
+    """
+    seen = set()
+    for line in lines:
+        digest = line_hash(line)
+        source = earlier.get(digest)
+        if source is None and digest in seen:
+            source = file_name
+        seen.add(digest)
+        if dedup_mode == DEDUP_FLAG:
+            line[DUPLICATE_COLUMN] = source
+            yield line
+        elif source is None:
+            yield line
+
+def duplicate_report(counts, file_hashes, file_names, dedup_mode):
+    """Summarize ``find_duplicates`` counts as ``(level, message)`` pairs for the page."""
+    duplicate_count = sum(counts.values())
+    total_rows = sum(len(hashes) for hashes in file_hashes.values())
+    if dedup_mode == DEDUP_DROP:
+        report = [("info", f"🧬 พบเส้นซ้ำ {duplicate_count:,} เส้น จากทั้งหมด {total_rows:,} เส้น "
+                           f"ตัดออกแล้ว เหลือ {total_rows - duplicate_count:,} แถว")]
+    else:
+        report = [("info", f"🧬 พบเส้นซ้ำ {duplicate_count:,} เส้น จากทั้งหมด {total_rows:,} เส้น "
+                           f"(ระบุไฟล์ต้นฉบับไว้ในคอลัมน์ {DUPLICATE_COLUMN})")]
+    for index in sorted(counts):
+        if counts[index]:
+            report.append(("write", f"- {file_names[index]}: ซ้ำ {counts[index]:,} เส้น"))
+    return report
+
+# -------------------------------------
+# ⚙️ แปลงหลายไฟล์พร้อมกันด้วย process pool
+# -------------------------------------
+OUTPUT_SEPARATE = "แยกไฟล์ผลลัพธ์ต่อไฟล์ KML"
+OUTPUT_SHEETS = "ไฟล์เดียว (1 sheet / layer ต่อไฟล์)"
+OUTPUT_ZIP = "ZIP รวมทุกไฟล์ผลลัพธ์"
+# CSV และ Parquet เก็บได้ตารางเดียวต่อไฟล์ จึงรวมเป็นไฟล์เดียวแบบแยก sheet/layer ไม่ได้
+MULTI_TABLE_FORMATS = {FORMAT_XLSX, FORMAT_GPKG}
+
+# จำนวนเส้นที่อ่านแล้วของแต่ละไฟล์ (shared array) ให้หน้าเว็บแสดงความคืบหน้าระหว่างแปลง
+LINE_COUNTER_STEP = 1000
+
+def init_convert_worker(counters=None):
+    """Initializer of the pool worker processes; shared arrays can only reach them when they start."""
+    convert_state.line_counters = counters
+
+def hash_kml_file(index, file_name, kml_bytes):
+    """
+    Hash every line of one KML file for ``find_duplicates``; runs in a worker process or inline.
+
+    Only names and geometry are read, and only the 16-byte hashes are kept.
+
+    Returns:
+        tuple: ``(index, line_count, line_hashes, messages)``
+    """
+    messages = []
+    uploaded_file = io.BytesIO(kml_bytes)
+    uploaded_file.name = file_name
+    with using_convert_state(messages=messages):
+        line_hashes = [line_hash(line) for line in iter_kml_lines(uploaded_file, attributes=False)]
+    return index, len(line_hashes), line_hashes, messages
+
+def convert_kml_file(index, file_name, kml_bytes, output_mode, export_format=FORMAT_XLSX,
+                     duplicates=None, dedup_mode=DEDUP_OFF):
+    """
+    Convert one KML file; runs in a worker process or inline.
+
+    Args:
+        index (int): Position of the file in the upload list
+        file_name (str): Uploaded file name
+        kml_bytes (bytes): KML content
+        output_mode (str): One of the ``OUTPUT_*`` modes
+        export_format (str): One of the ``FORMAT_*`` formats
+        duplicates (dict): Line hash -> earlier file name for the lines of
+            this file already seen in an earlier file (``find_duplicates``)
+        dedup_mode (str): One of the ``DEDUP_*`` modes; duplicates are
+            dropped or flagged while the rows stream to the writer
+
+    Returns:
+        tuple: ``(index, line_count, payload, messages)`` where payload is the
+        worksheet rows (Excel) or columns (other formats) for ``OUTPUT_SHEETS``
+        and the output file bytes otherwise; ``line_count`` counts the lines
+        read, before duplicates are dropped
+    """
+    messages = []
+    uploaded_file = io.BytesIO(kml_bytes)
+    uploaded_file.name = file_name
+
+    # นับเส้นระหว่างที่ส่งต่อให้ตัวเขียน Excel โดยไม่ต้องเก็บทุกเส้นไว้ในหน่วยความจำ
+    line_counters = getattr(convert_state, "line_counters", None)
+    line_count = 0
+    def counted_lines():
+        nonlocal line_count
+        for line in iter_kml_lines(uploaded_file):
+            line_count += 1
+            if line_counters is not None and line_count % LINE_COUNTER_STEP == 0:
+                line_counters[index] = line_count
+            yield line
+        if line_counters is not None:
+            line_counters[index] = line_count
+
+    lines = counted_lines()
+    flag_duplicates = dedup_mode == DEDUP_FLAG
+    if dedup_mode != DEDUP_OFF:
+        lines = deduplicated_lines(lines, file_name, duplicates or {}, dedup_mode)
+
+    with using_convert_state(messages=messages):
+        if export_format != FORMAT_XLSX:
+            payload = line_columns(lines, flag_duplicates)
+            if output_mode != OUTPUT_SHEETS and line_count:
+                payload = save_columns(payload, export_format, os.path.splitext(file_name)[0])
+        elif output_mode == OUTPUT_SHEETS:
+            payload = list(excel_rows(lines, flag_duplicates))
+        else:
+            payload = save_to_excel_memory(lines, flag_duplicates).getvalue()
+    if not line_count:
+        payload = None
+    return index, line_count, payload, messages
+
+def failed_conversion(index, file_name, error):
+    return index, 0, None, [("error", f"เกิดข้อผิดพลาดในการประมวลผลไฟล์ {file_name}: {str(error)}")]
+
+def run_kml_files(task, files, workers, file_args=None, counters=None):
+    """
+    Run ``task(index, file_name, kml_bytes, *args)`` over ``(file_name, kml_bytes)`` pairs, yielding each result as soon as it finishes.
+
+    With more than one worker the files are spread over a process pool, so the
+    order of the results follows completion, not the upload order. Warnings
+    are always returned with the results rather than shown, and the running
+    line count of each file is written to ``counters`` when given.
+
+    Args:
+        file_args (callable): Index -> tuple of extra arguments for that file
+    """
+    file_args = file_args or (lambda index: ())
+    if workers <= 1 or len(files) <= 1:
+        # รันใน thread ที่เรียก ตั้งตัวนับเส้นเฉพาะระหว่างที่งานแต่ละไฟล์รัน เพื่อไม่ให้กระทบงานอื่นของ server
+        for index, (file_name, kml_bytes) in enumerate(files):
+            try:
+                with using_convert_state(line_counters=counters):
+                    result = task(index, file_name, kml_bytes, *file_args(index))
+            except Exception as e:
+                result = failed_conversion(index, file_name, e)
+            yield result
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(files)),
+        mp_context=worker_context([__name__]),
+        initializer=init_convert_worker,
+        initargs=(counters,),
+    ) as pool:
+        futures = {
+            pool.submit(task, index, file_name, kml_bytes, *file_args(index)): index
+            for index, (file_name, kml_bytes) in enumerate(files)
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                index = futures[future]
+                result = failed_conversion(index, files[index][0], e)
+            yield result
+
+def convert_kml_files(files, output_mode, workers, export_format=FORMAT_XLSX,
+                      duplicates=None, dedup_mode=DEDUP_OFF, counters=None):
+    """
+    Convert ``(file_name, kml_bytes)`` pairs with ``convert_kml_file``; see ``run_kml_files``.
+
+    ``duplicates`` maps a file index to the duplicates of that file from
+    ``find_duplicates`` (hash -> earlier file name).
+    """
+    duplicates = duplicates or {}
+    return run_kml_files(
+        convert_kml_file, files, workers,
+        lambda index: (output_mode, export_format, duplicates.get(index), dedup_mode),
+        counters,
+    )
+
+def unique_name(name, used, max_length=None):
+    """Return ``name`` (truncated to ``max_length``) made unique among ``used`` with a numeric suffix."""
+    base = name[:max_length] if max_length else name
+    candidate, n = base, 1
+    while candidate.lower() in used:
+        n += 1
+        suffix = f" ({n})"
+        candidate = (base[:max_length - len(suffix)] if max_length else base) + suffix
+    used.add(candidate.lower())
+    return candidate
+
+def sheet_title(file_name, used):
+    """Build a valid, unique worksheet title (max 31 chars, no ``[]:*?/\\``) from a file name."""
+    title = re.sub(r"[\[\]:*?/\\]", "_", os.path.splitext(file_name)[0]).strip("'") or "KML"
+    return unique_name(title, used, 31)
+
+def output_file_name(file_name, export_format=FORMAT_XLSX):
+    return os.path.splitext(file_name)[0] + EXPORT_FORMATS[export_format][0]
+
+# -------------------------------------
+# ⏳ งานแปลงเบื้องหลังพร้อมตัวอย่างข้อมูล
+# -------------------------------------
+PREVIEW_ROWS = 50
+
+def new_conversion_job(files):
+    """Create the shared state of a background conversion; it lives in ``st.session_state``."""
+    return {
+        "running": True,
+        "file_names": [file_name for file_name, _ in files],
+        # สร้างด้วย context เดียวกับ process pool เพื่อส่งให้ process ลูกตอนเริ่มได้
+        "counters": worker_context([__name__]).Array("q", len(files), lock=False),
+        "done": 0,
+        "success": 0,
+        "errors": 0,
+        "preview": None,
+        "log": [],
+        "report": [],
+        "downloads": [],
+        "started": time.time(),
+        "finished": None,
+    }
+
+def build_downloads(results, files, output_mode, export_format):
+    """
+    Turn per-file results into download files.
+
+    Every file is written on its own: a file that fails is reported and left
+    out (a sheet of the combined workbook stops at the failing row), and the
+    other files are still offered.
+
+    Returns:
+        tuple: ``(downloads, failed)`` with downloads as ``(label, data, file_name, mime)``
+        and the ``(level, message)`` errors of the files that could not be written
+    """
+    file_names = [file_name for file_name, _ in files]
+    mime = EXPORT_FORMATS[export_format][1]
+    failed = []
+    def write_failed(index, error):
+        failed.append(("error", f"เกิดข้อผิดพลาดในการเขียนผลลัพธ์ของไฟล์ {file_names[index]}: {str(error)}"))
+
+    # รวมผลลัพธ์ตามลำดับไฟล์ที่อัปโหลด
+    if not results:
+        return [], failed
+    if output_mode == OUTPUT_SEPARATE:
+        downloads = [
+            (f"📥 ดาวน์โหลด {output_file_name(file_names[index], export_format)}", results[index],
+             output_file_name(file_names[index], export_format), mime)
+            for index in sorted(results)
+        ]
+    elif output_mode == OUTPUT_SHEETS:
+        used = set()
+        written = 0
+        if export_format == FORMAT_GPKG:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                path = os.path.join(temp_dir, "lines.gpkg")
+                for index in sorted(results):
+                    try:
+                        write_gpkg_layer(path, unique_name(os.path.splitext(file_names[index])[0], used), results[index])
+                        written += 1
+                    except Exception as e:
+                        write_failed(index, e)
+                combined = None
+                if written:
+                    with open(path, "rb") as f:
+                        combined = f.read()
+            label = f"📥 ดาวน์โหลด GeoPackage รวม {written} layer"
+        else:
+            output = io.BytesIO()
+            workbook = new_workbook(output)
+            for index in sorted(results):
+                try:
+                    write_sheet(workbook.add_worksheet(sheet_title(file_names[index], used)), results[index])
+                    written += 1
+                except Exception as e:
+                    write_failed(index, e)
+            workbook.close()
+            combined = output.getvalue() if written else None
+            label = f"📥 ดาวน์โหลด Workbook รวม {written} sheet"
+        downloads = []
+        if combined is not None:
+            downloads = [(label, combined, "kml_to_excel" + EXPORT_FORMATS[export_format][0], mime)]
+    else:
+        used = set()
+        written = 0
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for index in sorted(results):
+                try:
+                    zipf.writestr(unique_name(output_file_name(file_names[index], export_format), used), results[index])
+                    written += 1
+                except Exception as e:
+                    write_failed(index, e)
+        downloads = []
+        if written:
+            downloads = [(f"📥 ดาวน์โหลด ZIP รวม {written} ไฟล์", zip_buffer.getvalue(), "kml_to_excel.zip", "application/zip")]
+    return downloads, failed
+
+def run_conversion_job(job, files, output_mode, workers, export_format, dedup_mode):
+    """
+    Body of the background conversion thread.
+
+    Shows a preview of the first rows of the first file, converts every file
+    and builds the downloads, writing all progress into ``job`` so the
+    Streamlit script thread only has to render it. With deduplication the
+    files are read twice: a first pass keeps only the line hashes to find the
+    duplicates, the second drops or flags them while streaming the rows to
+    the writer. No Streamlit calls are made from this thread.
+    """
+    try:
+        # ตัวอย่างข้อมูลเสียไม่ทำให้การแปลงทั้งชุดหยุด ข้อผิดพลาดของไฟล์จะแสดงอีกครั้งในรอบแปลงจริง
+        try:
+            preview_file = io.BytesIO(files[0][1])
+            preview_file.name = files[0][0]
+            with using_convert_state(messages=[]):
+                job["preview"] = list(excel_rows(itertools.islice(iter_kml_lines(preview_file), PREVIEW_ROWS)))
+        except Exception:
+            job["preview"] = None
+
+        # รอบแรกเก็บเฉพาะ hash ของเส้นเพื่อหาเส้นซ้ำข้ามไฟล์ ข้อความเตือนจะแสดงในรอบแปลงจริง
+        duplicates = {}
+        if dedup_mode != DEDUP_OFF:
+            file_names = job["file_names"]
+            file_hashes = {
+                index: hashes
+                for index, line_count, hashes, _ in run_kml_files(hash_kml_file, files, workers)
+                if line_count
+            }
+            earlier, counts = find_duplicates(file_hashes)
+            duplicates = {
+                index: {digest: file_names[source] for digest, source in file_earlier.items()}
+                for index, file_earlier in earlier.items()
+            }
+            job["report"] = duplicate_report(counts, file_hashes, file_names, dedup_mode)
+            del file_hashes, earlier
+
+        results = {}
+        for index, line_count, payload, messages in convert_kml_files(
+            files, output_mode, workers, export_format, duplicates, dedup_mode, job["counters"]
+        ):
+            job["log"].extend(messages)
+            if payload is not None:
+                job["log"].append(("success", f"{files[index][0]}: พบข้อมูลเส้นทั้งหมด {line_count} เส้น"))
+                results[index] = payload
+                job["success"] += 1
+            else:
+                job["log"].append(("warning", f"ไม่พบข้อมูลเส้นในไฟล์ {files[index][0]}"))
+                job["errors"] += 1
+            job["done"] += 1
+
+        # ข้อความเตือนระหว่างเขียนไฟล์รวม (เช่นแถวเกินขีดจำกัดของ Excel) เก็บไว้แสดงใน log ของงานนี้
+        messages = []
+        with using_convert_state(messages=messages):
+            job["downloads"], failed = build_downloads(results, files, output_mode, export_format)
+        job["log"].extend(messages)
+        job["log"].extend(failed)
+        job["success"] -= len(failed)
+        job["errors"] += len(failed)
+    except Exception as e:
+        job["log"].append(("error", f"เกิดข้อผิดพลาดในการประมวลผล: {str(e)}"))
+        job["log"].append(("error", traceback.format_exc()))
+    finally:
+        job["finished"] = time.time()
+        job["running"] = False
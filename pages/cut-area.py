@@ -1,530 +1,1666 @@
-import os, copy
-import streamlit as st
-import tempfile
-import zipfile
-import time
-from lxml import etree
-from shapely.geometry import Point, Polygon
-
-# Set page configuration
-st.set_page_config(
-    page_title="KML Area Clipper",
-    page_icon="🗺️",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# Custom CSS for styling
-st.markdown("""
-<style>
-    :root {
-        --bg-primary: #121212;
-        --bg-secondary: #1e1e1e;
-        --bg-tertiary: #2a2a2a;
-        --text-primary: #e0e0e0;
-        --text-secondary: #b0b0b0;
-        --accent-primary: #4f8bf9;
-        --accent-secondary: #3776cc;
-        --success-color: #1db954;
-        --warning-color: #ff9800;
-        --error-color: #f44336;
-        --border-color: #444444;
-    }
-
-    .main-header {
-        font-size: 2.5rem;
-        color: var(--accent-primary);
-        text-align: center;
-        margin-bottom: 1rem;
-    }
-    .sub-header {
-        font-size: 1.5rem;
-        color: var(--accent-secondary);
-        margin-top: 2rem;
-    }
-    .info-box {
-        background-color: var(--bg-secondary);
-        padding: 1rem;
-        border-radius: 10px;
-        margin-bottom: 1rem;
-        color: var(--text-primary);
-    }
-    .success-message {
-        background-color: var(--success-color);
-        color: var(--text-primary);
-        padding: 1rem;
-        border-radius: 5px;
-        margin: 1rem 0;
-        text-align: center;
-        font-weight: bold;
-    }
-    .stButton>button {
-        background-color: var(--accent-primary);
-        color: var(--text-primary);
-        font-weight: bold;
-        padding: 0.5rem 1rem;
-        border-radius: 5px;
-        width: 100%;
-    }
-    .stButton>button:hover {
-        background-color: var(--accent-secondary);
-    }
-    .download-btn {
-        background-color: var(--success-color);
-        color: var (--text-primary);
-        font-weight: bold;
-    }
-    .footer {
-        text-align: center;
-        margin-top: 2rem;
-        color: var(--text-secondary);
-        font-size: 0.8rem;
-    }
-    .upload-section {
-        padding: 1.5rem;
-        border-radius: 10px;
-        background-color: var(--bg-secondary);
-        margin-bottom: 1rem;
-        color: var(--text-primary);
-    }
-    .progress-bar {
-        height: 10px;
-        background-color: var(--bg-tertiary);
-        border-radius: 5px;
-        margin-bottom: 1rem;
-    }
-    .progress-bar-fill {
-        height: 100%;
-        background-color: var(--accent-primary);
-        border-radius: 5px;
-        transition: width 0.3s ease;
-    }
-</style>
-""", unsafe_allow_html=True)
-
-# Initialize session state for processing status
-if 'processing' not in st.session_state:
-    st.session_state.processing = False
-if 'progress' not in st.session_state:
-    st.session_state.progress = 0
-if 'processed_files' not in st.session_state:
-    st.session_state.processed_files = []
-if 'combined_kml' not in st.session_state:
-    st.session_state.combined_kml = None
-
-# ฟังก์ชันสำหรับตัดพื้นที่ที่อยู่นอกขอบเขต
-def clip_and_combine(input_kml, boundary_polygon, output_kml):
-    try:
-        tree = etree.parse(input_kml)
-        root = tree.getroot()
-        placemarks_to_remove = []  
-        total_placemarks = len(root.findall(".//{http://www.opengis.net/kml/2.2}Placemark"))
-        processed_placemarks = 0
-
-        for placemark in root.findall(".//{http://www.opengis.net/kml/2.2}Placemark"):
-            # 0) ตรวจสอบว่ามี Point ไหม ถ้ามีให้เช็คว่าอยู่ในขอบเขตหรือไม่
-            point_elem = placemark.find(
-                ".//{http://www.opengis.net/kml/2.2}Point"
-            )
-            if point_elem is not None:
-                coords_elem = point_elem.find(
-                    ".//{http://www.opengis.net/kml/2.2}coordinates"
-                )
-                if coords_elem is not None:
-                    lon, lat = map(float, coords_elem.text.strip().split(',')[:2])
-                    from shapely.geometry import Point as ShapelyPoint
-                    pt = ShapelyPoint(lon, lat)
-                    # ถ้าอยู่นอกขอบเขต ให้ลบ
-                    if not pt.within(boundary_polygon):
-                        placemarks_to_remove.append(placemark)
-                # อัพเดต progress แล้วข้ามไปเลย
-                processed_placemarks += 1
-                st.session_state.progress = processed_placemarks / total_placemarks
-                continue
-
-            # 1) หาองค์ประกอบ Geometry (LineString หรือ Polygon)
-            line_elem = placemark.find(".//{http://www.opengis.net/kml/2.2}LineString")
-            poly_elem = placemark.find(".//{http://www.opengis.net/kml/2.2}Polygon")
-            coords_elem = None
-            geom = None
-
-            if line_elem is not None:
-                coords_elem = line_elem.find(".//{http://www.opengis.net/kml/2.2}coordinates")
-                if coords_elem is not None:
-                    pts = [
-                        tuple(map(float, c.split(',')[:2]))
-                        for c in coords_elem.text.strip().split()
-                    ]
-                    from shapely.geometry import LineString
-                    geom = LineString(pts)
-
-            elif poly_elem is not None:
-                coords_elem = poly_elem.find(".//{http://www.opengis.net/kml/2.2}outerBoundaryIs//{http://www.opengis.net/kml/2.2}coordinates")
-                if coords_elem is not None:
-                    pts = [
-                        tuple(map(float, c.split(',')[:2]))
-                        for c in coords_elem.text.strip().split()
-                    ]
-                    from shapely.geometry import Polygon
-                    geom = Polygon(pts)
-
-            # 2) ถ้ามี geometry ให้ตัดด้วย boundary_polygon
-            if geom:
-                clipped = geom.intersection(boundary_polygon)
-                if clipped.is_empty:
-                    placemarks_to_remove.append(placemark)
-                else:
-                    # เตรียม list เก็บทุกส่วนที่มีพิกัด
-                    new_pts = []
-                    from shapely.geometry import LineString, Polygon, MultiLineString, MultiPolygon, GeometryCollection
-
-                    def collect_coords(g):
-                        if isinstance(g, Polygon):
-                            return list(g.exterior.coords)
-                        elif isinstance(g, LineString):
-                            return list(g.coords)
-                        return []
-
-                    # ถ้าเป็น single geometry
-                    if isinstance(clipped, (Polygon, LineString)):
-                        new_pts = collect_coords(clipped)
-                    # ถ้าเป็น multi-part หรือ collection
-                    elif isinstance(clipped, (MultiPolygon, MultiLineString, GeometryCollection)):
-                        for part in clipped.geoms:
-                            new_pts += collect_coords(part)
-
-                    # อัปเดต coordinates element
-                    if new_pts:
-                        coords_elem.text = " ".join(f"{x},{y}" for x, y in new_pts)
-
-            processed_placemarks += 1
-            st.session_state.progress = processed_placemarks / total_placemarks
-
-        # เอา placemark ที่ไม่ผ่านเงื่อนไขออก
-        for placemark in placemarks_to_remove:
-            placemark.getparent().remove(placemark)
-
-        # Set the name within the KML content
-        document_elem = root.find(".//{http://www.opengis.net/kml/2.2}Document")
-        if document_elem is not None:
-            name_elem = document_elem.find(".//{http://www.opengis.net/kml/2.2}name")
-            if name_elem is None:
-                name_elem = etree.SubElement(document_elem, "name")
-            name_elem.text = os.path.basename(output_kml)
-
-        # Create temp file for output
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.kml') as tmp_output:
-            tree.write(tmp_output.name, encoding="utf-8", xml_declaration=True)
-            return tmp_output.name
-    except Exception as e:
-        st.error(f"เกิดข้อผิดพลาดในการตัดข้อมูล: {e}")
-        return None
-
-# ฟังก์ชันสำหรับประมวลผลทุกขอบเขต
-def process_areas_with_red(input_kml, boundary_kml):
-    output_files = []
-    try:
-        boundary_tree = etree.parse(boundary_kml)
-        boundary_root = boundary_tree.getroot()
-        
-        boundaries = boundary_root.findall(".//{http://www.opengis.net/kml/2.2}Placemark")
-        total_boundaries = len(boundaries)
-        
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        for i, boundary_placemark in enumerate(boundaries):
-            boundary_coords = boundary_placemark.find(".//{http://www.opengis.net/kml/2.2}coordinates")
-            if boundary_coords is not None:
-                coords = boundary_coords.text.strip().split()
-                boundary_points = [(float(coord.split(',')[0]), float(coord.split(',')[1])) for coord in coords]
-                boundary_polygon = Polygon(boundary_points)
-
-                area_name = boundary_placemark.find(".//{http://www.opengis.net/kml/2.2}name")
-                area_name = area_name.text if area_name is not None else f"area_{i+1}"
-                
-                status_text.text(f"กำลังประมวลผลพื้นที่: {area_name} ({i+1}/{total_boundaries})")
-
-                output_kml = f"{area_name}.kml"
-                clipped_kml = clip_and_combine(input_kml, boundary_polygon, output_kml)
-                if clipped_kml:
-                    output_files.append((clipped_kml, area_name))
-            
-            progress_bar.progress((i + 1) / total_boundaries)
-            
-        status_text.text("ประมวลผลเสร็จสิ้น!")
-        time.sleep(1)
-        status_text.empty()
-        progress_bar.empty()
-    except Exception as e:
-        st.error(f"เกิดข้อผิดพลาดในการประมวลผลไฟล์ขอบเขต: {e}")
-    return output_files
-
-# ฟังก์ชันรวมไฟล์ KML
-def combine_kml_files(output_files, input_file_name, boundary_kml):
-    combined_output_kml = tempfile.NamedTemporaryFile(delete=False, suffix='.kml')
-    kml_elem = etree.Element("kml", xmlns="http://www.opengis.net/kml/2.2")
-    document_elem = etree.SubElement(kml_elem, "Document")
-
-    # Add a name element to the KML document
-    name_elem = etree.SubElement(document_elem, "name")
-    name_elem.text = os.path.splitext(input_file_name)[0]  # Set name to input file name without extension
-
-    # Add styles for better visualization in Google Earth
-    style_elem = etree.SubElement(document_elem, "Style", id="normalPlacemark")
-    line_style = etree.SubElement(style_elem, "LineStyle")
-    etree.SubElement(line_style, "color").text = "ff0000ff"  # Red
-    etree.SubElement(line_style, "width").text = "2"
-    
-    poly_style = etree.SubElement(style_elem, "PolyStyle")
-    etree.SubElement(poly_style, "color").text = "7f0000ff"  # Semi-transparent red
-    etree.SubElement(poly_style, "outline").text = "1"
-
-    # ===== สไตล์สำหรับขอบเขตพื้นที่ =====
-    boundary_style = etree.SubElement(document_elem, "Style", id="boundaryPlacemark")
-    # เส้นขอบ
-    ls_b = etree.SubElement(boundary_style, "LineStyle")
-    etree.SubElement(ls_b, "color").text = "ff00ff00"   # ทึบเขียว
-    etree.SubElement(ls_b, "width").text = "3"
-    # พื้นที่เติม
-    ps_b = etree.SubElement(boundary_style, "PolyStyle")
-    etree.SubElement(ps_b, "color").text   = "4000ff00"  # 25% โปร่งใสเขียว
-    etree.SubElement(ps_b, "fill").text    = "1"         # เปิดเติมสี
-    etree.SubElement(ps_b, "outline").text = "1"         # แสดงเส้นขอบด้วย
-
-    # ===== สไตล์สำหรับขอบเขตพื้นที่ =====
-    boundary_style = etree.SubElement(document_elem, "Style", id="boundaryPlacemark")
-    # เส้นขอบ
-    ls_b = etree.SubElement(boundary_style, "LineStyle")
-    etree.SubElement(ls_b, "color").text = "ff00ff00"   # เส้นขอบเขียวทึบ
-    etree.SubElement(ls_b, "width").text = "3"
-    # พื้นที่เติม
-    ps_b = etree.SubElement(boundary_style, "PolyStyle")
-    etree.SubElement(ps_b, "color").text   = "0000ff00"  # เติมสีเขียว แต่ alpha=00 => มองไม่เห็น
-    etree.SubElement(ps_b, "fill").text    = "1"         # เปิดเติม (แต่โปร่งใสหมด)
-    etree.SubElement(ps_b, "outline").text = "1"         # แสดงเส้นขอบ
-
-    # โหลด boundary KML มาเก็บตามชื่อ
-    boundary_tree = etree.parse(boundary_kml)
-    boundary_root = boundary_tree.getroot()
-    boundary_dict = {}
-    for b in boundary_root.findall(".//{http://www.opengis.net/kml/2.2}Placemark"):
-        nm = b.find(".//{http://www.opengis.net/kml/2.2}name")
-        if nm is not None:
-            boundary_dict[nm.text] = b
-
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for i, (file, area_name) in enumerate(output_files):
-        try:
-            status_text.text(f"กำลังรวมพื้นที่: {area_name}")
-            tree = etree.parse(file)
-            root = tree.getroot()
-            folder_elem = etree.SubElement(document_elem, "Folder")
-            folder_name_elem = etree.SubElement(folder_elem, "name")
-            folder_name_elem.text = area_name
-
-            # ----- เพิ่มขอบเขตเดิมก่อน placemark ที่ตัดแล้ว -----
-            if area_name in boundary_dict:
-                b_placemark = copy.deepcopy(boundary_dict[area_name])
-                style_url = etree.SubElement(b_placemark, "styleUrl")
-                style_url.text = "#boundaryPlacemark"
-                folder_elem.append(b_placemark)
-
-            for placemark in root.findall(".//{http://www.opengis.net/kml/2.2}Placemark"):
-                # Add style reference to each placemark
-                style_url = etree.SubElement(placemark, "styleUrl")
-                style_url.text = "#normalPlacemark"
-                folder_elem.append(placemark)
-                
-            # Remove the temporary file after it's been processed
-            os.unlink(file)
-            
-            progress_bar.progress((i + 1) / len(output_files))
-            
-        except Exception as e:
-            st.error(f"ไม่สามารถรวมไฟล์ {area_name}: {e}")
-
-    combined_tree = etree.ElementTree(kml_elem)
-    combined_tree.write(combined_output_kml.name, encoding="utf-8", xml_declaration=True)
-    
-    status_text.text("รวมไฟล์เสร็จสิ้น!")
-    time.sleep(1)
-    status_text.empty()
-    progress_bar.empty()
-    
-    return combined_output_kml.name
-
-# ฟังก์ชันสำหรับการแยกไฟล์ KML จาก ZIP
-def extract_kml_from_zip(zip_file):
-    kml_files = []
-    with zipfile.ZipFile(zip_file, 'r') as zipf:
-        all_files = zipf.namelist()
-        kml_files_in_zip = [f for f in all_files if f.endswith('.kml')]
-        total_files = len(kml_files_in_zip)
-        
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        for i, file_name in enumerate(kml_files_in_zip):
-            status_text.text(f"กำลังแยกไฟล์: {file_name}")
-            with zipf.open(file_name) as kml_file:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.kml') as temp_file:
-                    temp_file.write(kml_file.read())
-                    kml_files.append(temp_file.name)
-            progress_bar.progress((i + 1) / total_files)
-        
-        status_text.text(f"แยกไฟล์เสร็จสิ้น! พบไฟล์ KML จำนวน {len(kml_files)} ไฟล์")
-        time.sleep(1)
-        status_text.empty()
-        progress_bar.empty()
-        
-    return kml_files
-
-# ฟังก์ชันเริ่มประมวลผล
-def start_processing():
-    if st.session_state.input_file and st.session_state.boundary_file:
-        st.session_state.processing = True
-        
-        # Create spinner while processing
-        with st.spinner("กำลังประมวลผลข้อมูล..."):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{st.session_state.input_file.name.split('.')[-1]}") as tmp_input:
-                tmp_input.write(st.session_state.input_file.getvalue())
-                input_path = tmp_input.name
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.kml') as tmp_boundary:
-                tmp_boundary.write(st.session_state.boundary_file.getvalue())
-                boundary_path = tmp_boundary.name
-
-            try:
-                output_files = []
-
-                if st.session_state.input_file.name.endswith(".zip"):
-                    st.info("กำลังแยกไฟล์ KML จาก ZIP...")
-                    extracted_kml_files = extract_kml_from_zip(input_path)
-                    
-                    if len(extracted_kml_files) == 0:
-                        st.error("ไม่พบไฟล์ KML ในไฟล์ ZIP")
-                        st.session_state.processing = False
-                        return
-                        
-                    st.info(f"เริ่มประมวลผลไฟล์ KML จำนวน {len(extracted_kml_files)} ไฟล์...")
-                    # Use the first KML file for processing
-                    output_files = process_areas_with_red(extracted_kml_files[0], boundary_path)
-                    # Remove unused extracted files
-                    for file in extracted_kml_files[1:]:
-                        os.unlink(file)
-                else:
-                    st.info("เริ่มประมวลผลไฟล์ KML...")
-                    output_files = process_areas_with_red(input_path, boundary_path)
-
-                if output_files:
-                    st.info("กำลังรวมไฟล์ KML...")
-                    combined_kml = combine_kml_files(output_files, st.session_state.input_file.name, boundary_path)
-                    st.session_state.combined_kml = combined_kml
-                    st.session_state.processed_files = [name for _, name in output_files]
-                    
-                    st.success(f"ประมวลผลเสร็จสิ้น! ได้ทั้งหมด {len(output_files)} พื้นที่")
-                else:
-                    st.error("ไม่พบข้อมูลที่ตรงกับเงื่อนไข")
-            finally:
-                os.unlink(input_path)
-                os.unlink(boundary_path)
-                st.session_state.processing = False
-        
-    else:
-        st.error("กรุณาเลือกไฟล์ให้ครบถ้วน")
-
-# Streamlit UI
-def main():
-    # Header
-    st.markdown("<h1 class='main-header'>🗺️ โปรแกรมตัดพื้นที่จากไฟล์ KML</h1>", unsafe_allow_html=True)
-    st.markdown("<div class='info-box'>โปรแกรมสำหรับตัดพื้นที่จากไฟล์ KML ตามขอบเขตที่กำหนด</div>", unsafe_allow_html=True)
-    
-    # Create tabs
-    tab1, tab2 = st.tabs(["📋 ประมวลผลข้อมูล", "ℹ️ คำแนะนำการใช้งาน"])
-    
-    with tab1:
-        # Upload section
-        st.markdown("<h2 class='sub-header'>อัปโหลดไฟล์</h2>", unsafe_allow_html=True)
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("<div class='upload-section'>", unsafe_allow_html=True)
-            st.file_uploader(
-                "📁 เลือกไฟล์ KML หรือ ZIP ที่มี KML", 
-                type=['zip', 'kml'],
-                help="กรณีไฟล์ KML มีขนาดใหญ่ให้ทำเป็นไฟล์ ZIP",
-                key="input_file"
-            )
-            st.markdown("</div>", unsafe_allow_html=True)
-            
-        with col2:
-            st.markdown("<div class='upload-section'>", unsafe_allow_html=True)
-            st.file_uploader(
-                "📁 เลือกไฟล์ขอบเขต KML",
-                type=['kml'],
-                help="ไฟล์ KML ที่กำหนดขอบเขตพื้นที่ที่ต้องการตัด",
-                key="boundary_file"
-            )
-            st.markdown("</div>", unsafe_allow_html=True)
-        
-        # Process button
-        if st.session_state.processing:
-            st.button("⏳ กำลังประมวลผล...", disabled=True)
-        else:
-            st.button("🚀 เริ่มประมวลผล", on_click=start_processing, key="process_button")
-        
-        # Show results
-        if st.session_state.combined_kml:
-            st.markdown("<div class='success-message'>✅ ประมวลผลเสร็จสิ้น</div>", unsafe_allow_html=True)
-            
-            # Show processed areas
-            if st.session_state.processed_files:
-                with st.expander("📋 พื้นที่ที่ประมวลผล"):
-                    for i, area in enumerate(st.session_state.processed_files):
-                        st.write(f"{i+1}. {area}")
-            
-            # Download button
-            with open(st.session_state.combined_kml, "rb") as f:
-                download_label = "🔗 ดาวน์โหลดไฟล์ KML รวม"
-                input_file_name = os.path.splitext(st.session_state.input_file.name)[0]
-                combined_file_name = f"{input_file_name}_combined.kml"
-                
-                st.download_button(
-                    label=download_label,
-                    data=f,
-                    file_name=combined_file_name,
-                    mime="application/vnd.google-earth.kml+xml",
-                    key="download_button"
-                )
-    
-    with tab2:
-        st.markdown("""
-        ## 📌 คำแนะนำการใช้งาน
-        
-        ### วิธีการใช้งาน
-        1. อัปโหลดไฟล์ KML ที่ต้องการตัดพื้นที่ (หรือไฟล์ ZIP ที่มี KML อยู่ภายใน)
-            - กรณีที่ไฟล์ KML มีขนาดใหญ่ ให้บีบอัดเป็นไฟล์ ZIP ก่อนอัปโหลด
-            - โปรแกรมจะใช้ไฟล์ KML ไฟล์แรกที่พบในไฟล์ ZIP
-        
-        2. อัปโหลดไฟล์ขอบเขต KML
-            - ไฟล์นี้จะกำหนดขอบเขตพื้นที่ที่ต้องการตัด
-            - สามารถมีหลายพื้นที่ (Placemark) ในไฟล์เดียวกัน
-        
-        3. กดปุ่ม "เริ่มประมวลผล" เพื่อดำเนินการ
-            - โปรแกรมจะตัดพื้นที่ตามขอบเขตที่กำหนด
-            - ผลลัพธ์จะถูกรวมเป็นไฟล์ KML เดียว โดยแบ่งตามพื้นที่
-        
-        4. ดาวน์โหลดไฟล์ KML ผลลัพธ์
-        
-        ### หมายเหตุ
-        - พื้นที่ที่อยู่นอกขอบเขตจะถูกตัดออก
-        - ชื่อของแต่ละพื้นที่จะถูกนำมาจากชื่อ Placemark ในไฟล์ขอบเขต
-        - ไฟล์ผลลัพธ์สามารถเปิดด้วย Google Earth หรือโปรแกรมอื่นๆ ที่รองรับไฟล์ KML
-        """)
-
-if __name__ == "__main__":
-    main()
+import os, io, re, copy, shutil, hashlib, random
+from array import array
+import streamlit as st
+import tempfile
+import zipfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import numpy as np
+from lxml import etree
+import shapely
+from shapely import STRtree
+from shapely.geometry import Polygon
+from cut_area_clip import (
+    KML_NS, CLIP_TIERS, find_geometry_elem, parse_coords, parse_geometry, read_features, apply_clip_value,
+    new_clip_stats, tile_boundary, clip_geometry, clip_area, clip_areas_parallel
+)
+
+# Set page configuration
+st.set_page_config(
+    page_title="KML Area Clipper",
+    page_icon="🗺️",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+# Custom CSS for styling
+st.markdown("""
+<style>
+    :root {
+        --bg-primary: #121212;
+        --bg-secondary: #1e1e1e;
+        --bg-tertiary: #2a2a2a;
+        --text-primary: #e0e0e0;
+        --text-secondary: #b0b0b0;
+        --accent-primary: #4f8bf9;
+        --accent-secondary: #3776cc;
+        --success-color: #1db954;
+        --warning-color: #ff9800;
+        --error-color: #f44336;
+        --border-color: #444444;
+    }
+
+    .main-header {
+        font-size: 2.5rem;
+        color: var(--accent-primary);
+        text-align: center;
+        margin-bottom: 1rem;
+    }
+    .sub-header {
+        font-size: 1.5rem;
+        color: var(--accent-secondary);
+        margin-top: 2rem;
+    }
+    .info-box {
+        background-color: var(--bg-secondary);
+        padding: 1rem;
+        border-radius: 10px;
+        margin-bottom: 1rem;
+        color: var(--text-primary);
+    }
+    .success-message {
+        background-color: var(--success-color);
+        color: var(--text-primary);
+        padding: 1rem;
+        border-radius: 5px;
+        margin: 1rem 0;
+        text-align: center;
+        font-weight: bold;
+    }
+    .stButton>button {
+        background-color: var(--accent-primary);
+        color: var(--text-primary);
+        font-weight: bold;
+        padding: 0.5rem 1rem;
+        border-radius: 5px;
+        width: 100%;
+    }
+    .stButton>button:hover {
+        background-color: var(--accent-secondary);
+    }
+    .download-btn {
+        background-color: var(--success-color);
+        color: var (--text-primary);
+        font-weight: bold;
+    }
+    .footer {
+        text-align: center;
+        margin-top: 2rem;
+        color: var(--text-secondary);
+        font-size: 0.8rem;
+    }
+    .upload-section {
+        padding: 1.5rem;
+        border-radius: 10px;
+        background-color: var(--bg-secondary);
+        margin-bottom: 1rem;
+        color: var(--text-primary);
+    }
+    .progress-bar {
+        height: 10px;
+        background-color: var(--bg-tertiary);
+        border-radius: 5px;
+        margin-bottom: 1rem;
+    }
+    .progress-bar-fill {
+        height: 100%;
+        background-color: var(--accent-primary);
+        border-radius: 5px;
+        transition: width 0.3s ease;
+    }
+</style>
+""", unsafe_allow_html=True)
+
+# Initialize session state for processing status
+if 'processing' not in st.session_state:
+    st.session_state.processing = False
+if 'progress' not in st.session_state:
+    st.session_state.progress = 0
+if 'processed_files' not in st.session_state:
+    st.session_state.processed_files = []
+if 'combined_kml' not in st.session_state:
+    st.session_state.combined_kml = None
+if 'combined_suffix' not in st.session_state:
+    st.session_state.combined_suffix = ".kml"
+if 'clip_stats' not in st.session_state:
+    st.session_state.clip_stats = None
+if 'simplify_report' not in st.session_state:
+    st.session_state.simplify_report = None
+if 'preflight' not in st.session_state:
+    st.session_state.preflight = None
+
+
+# ฟังก์ชันแสดงสถิติการตัดแยกตามขั้นการทดสอบ
+def show_clip_stats(stats):
+    total = sum(stats.values())
+    if not total:
+        return
+    with st.expander("📊 สถิติการตัดเส้น/พื้นที่ (คู่ feature กับขอบเขต)"):
+        for key, label in CLIP_TIERS.items():
+            st.write(f"- {label}: {stats[key]:,} ({stats[key] / total:.1%})")
+
+# ฟังก์ชันอ่านขอบเขตทั้งหมดจากไฟล์ boundary เป็น list ของ (ชื่อพื้นที่, Polygon)
+# ถ้าเป็นชุดขอบเขตที่ลงทะเบียนไว้ จะโหลดจากไฟล์ compiled แทนการแปลงข้อความพิกัดใหม่
+def load_boundaries(boundary_kml):
+    compiled = compiled_boundary_path(boundary_kml)
+    if compiled and os.path.exists(compiled):
+        return load_compiled_boundaries(compiled)[0]
+    return parse_boundaries(boundary_kml)
+
+# ฟังก์ชัน parse KML จาก path หรือไฟล์ในหน่วยความจำ (เช่นไฟล์ที่อัปโหลด) ซึ่ง parse ซ้ำได้หลายครั้ง
+def parse_kml(source):
+    if hasattr(source, "seek") and source.seekable():
+        source.seek(0)
+    return etree.parse(source)
+
+def parse_boundaries(boundary_kml):
+    boundary_root = parse_kml(boundary_kml).getroot()
+    boundaries = []
+    for i, boundary_placemark in enumerate(boundary_root.findall(f".//{KML_NS}Placemark")):
+        boundary_coords = boundary_placemark.find(f".//{KML_NS}coordinates")
+        if boundary_coords is None:
+            continue
+        coords = boundary_coords.text.strip().split()
+        boundary_points = [(float(coord.split(',')[0]), float(coord.split(',')[1])) for coord in coords]
+
+        area_name = boundary_placemark.find(f".//{KML_NS}name")
+        area_name = area_name.text if area_name is not None else f"area_{i+1}"
+        boundaries.append((area_name, Polygon(boundary_points)))
+    return boundaries
+
+# คลังชุดขอบเขตที่ลงทะเบียนไว้: เก็บ KML ต้นฉบับคู่กับไฟล์ compiled (.boundaries.npz)
+# ที่มีชื่อพื้นที่, WKB ของ Polygon, bounding box และ XML ของ Placemark ขอบเขต
+BOUNDARY_LIBRARY_DIR = os.path.join(os.path.expanduser("~"), ".kml-boundary-library")
+
+def compiled_boundary_path(boundary_kml):
+    # ไฟล์ที่อัปโหลดมา (อยู่ในหน่วยความจำ) ไม่มีไฟล์ compiled
+    if not isinstance(boundary_kml, str):
+        return None
+    return f"{os.path.splitext(boundary_kml)[0]}.boundaries.npz"
+
+def boundary_library_path(set_name):
+    safe_name = re.sub(r'[\\/:*?"<>|]', "_", set_name).strip() or "boundary"
+    return os.path.join(BOUNDARY_LIBRARY_DIR, f"{safe_name}.kml")
+
+def list_boundary_library():
+    if not os.path.isdir(BOUNDARY_LIBRARY_DIR):
+        return []
+    return sorted(
+        os.path.splitext(f)[0] for f in os.listdir(BOUNDARY_LIBRARY_DIR)
+        if f.endswith(".kml") and os.path.exists(compiled_boundary_path(os.path.join(BOUNDARY_LIBRARY_DIR, f)))
+    )
+
+# เก็บ list ของ bytes เป็นบัฟเฟอร์เดียว + offset (ไม่ต้องใช้ pickle ใน npz)
+def pack_bytes(items):
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in items])
+    return np.frombuffer(b"".join(items), dtype=np.uint8), offsets
+
+def unpack_bytes(buffer, offsets):
+    data = buffer.tobytes()
+    return [data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+# ฟังก์ชันลงทะเบียนชุดขอบเขต: แปลง KML ครั้งเดียวแล้วเก็บในรูปแบบ binary
+def register_boundary_set(set_name, boundary_bytes):
+    os.makedirs(BOUNDARY_LIBRARY_DIR, exist_ok=True)
+    kml_path = boundary_library_path(set_name)
+    with open(kml_path, "wb") as f:
+        f.write(boundary_bytes)
+
+    boundaries = parse_boundaries(kml_path)
+    boundary_dict = load_boundary_placemarks(kml_path)
+    polygons = [polygon for _, polygon in boundaries]
+    wkb, wkb_offsets = pack_bytes(list(shapely.to_wkb(polygons)) if polygons else [])
+    placemark_names = list(boundary_dict)
+    placemark_xml, placemark_offsets = pack_bytes(
+        [etree.tostring(boundary_dict[name], with_tail=False) for name in placemark_names]
+    )
+
+    compiled = compiled_boundary_path(kml_path)
+    tmp_compiled = f"{compiled}.tmp.npz"
+    np.savez(
+        tmp_compiled,
+        names=np.array([name for name, _ in boundaries], dtype=str),
+        wkb=wkb,
+        wkb_offsets=wkb_offsets,
+        bounds=shapely.bounds(polygons) if polygons else np.empty((0, 4)),
+        placemark_names=np.array(placemark_names, dtype=str),
+        placemark_xml=placemark_xml,
+        placemark_offsets=placemark_offsets,
+        placemark_tails=np.array([boundary_dict[name].tail or "" for name in placemark_names], dtype=str),
+    )
+    os.replace(tmp_compiled, compiled)
+    return kml_path, len(boundaries)
+
+def load_compiled_boundaries(compiled):
+    with np.load(compiled) as data:
+        polygons = shapely.from_wkb(unpack_bytes(data["wkb"], data["wkb_offsets"]))
+        boundaries = list(zip(data["names"].tolist(), polygons))
+        placemarks = dict(zip(
+            data["placemark_names"].tolist(),
+            zip(
+                unpack_bytes(data["placemark_xml"], data["placemark_offsets"]),
+                data["placemark_tails"].tolist(),
+            ),
+        ))
+        return boundaries, data["bounds"], placemarks
+
+# ฟังก์ชันตัดทุกขอบเขตในรอบเดียว: อ่านไฟล์ input ครั้งเดียว แล้วใช้ STRtree
+# จับคู่ feature กับขอบเขตที่ bounding box ซ้อนทับกันเท่านั้น
+# area_callback(b, placemarks, kept) ถูกเรียกทันทีที่แต่ละขอบเขตตัดเสร็จ เพื่อเขียนผลได้โดยไม่ต้องรอครบทุกขอบเขต
+def clip_all_areas(input_kml, boundaries, progress_callback=None, stats=None, workers=1, tile_vertices=0, area_callback=None):
+    root = parse_kml(input_kml).getroot()
+    placemarks = root.findall(f".//{KML_NS}Placemark")
+    features = read_features(placemarks)
+    is_point = features["is_point"]
+
+    # Point สร้างเป็น shapely ทั้งชุดด้วย shapely.points เพื่อใช้ค้นใน STRtree
+    query_geoms = np.array(features["geoms"], dtype=object)
+    query_geoms[is_point] = shapely.points(features["xs"][is_point], features["ys"][is_point])
+
+    # feature ที่ไม่มี geometry ให้ตัด จะถูกเก็บไว้ในทุกพื้นที่เหมือนเดิม
+    has_geom = shapely.is_geometry(query_geoms)
+    no_geom = np.flatnonzero(~has_geom).tolist()
+    with_geom = np.flatnonzero(has_geom)
+
+    tree = STRtree([polygon for _, polygon in boundaries])
+    if len(with_geom):
+        feature_pos, boundary_idx = tree.query(query_geoms[with_geom])
+    else:
+        feature_pos = boundary_idx = np.empty(0, dtype=np.intp)
+    # เรียงตามขอบเขต แล้วตามลำดับ feature ในไฟล์ เพื่อให้ผลลัพธ์คงลำดับเดิม
+    order = np.lexsort((feature_pos, boundary_idx))
+    feature_idx = with_geom[feature_pos[order]]
+    splits = np.searchsorted(boundary_idx[order], np.arange(1, len(boundaries)))
+
+    if stats is not None:
+        # คู่เส้น/พื้นที่กับขอบเขตที่ STRtree ตัดทิ้งไปตั้งแต่ขั้น bounding box
+        clippable = np.count_nonzero(~is_point[with_geom])
+        stats["bbox_reject"] += int(
+            clippable * len(boundaries) - np.count_nonzero(~is_point[feature_idx])
+        )
+
+    tasks = [
+        (b, boundaries[b][1], sorted(no_geom + hits.tolist()), tile_vertices)
+        for b, hits in enumerate(np.split(feature_idx, splits))
+    ]
+    def on_area(b, kept):
+        if area_callback:
+            area_callback(b, placemarks, kept)
+
+    if workers > 1 and len(tasks) > 1:
+        area_results = clip_areas_parallel(features, tasks, workers, progress_callback, stats, on_area)
+        return placemarks, area_results
+
+    area_results = []
+    for b, boundary_polygon, candidates, tile_vertices in tasks:
+        area_results.append(clip_area(features, boundary_polygon, candidates, stats, tile_vertices))
+        on_area(b, area_results[-1])
+        if progress_callback:
+            progress_callback(b + 1, len(tasks), b)
+    return placemarks, area_results
+
+# ฟังก์ชันวน Placemark ที่ตัดแล้วของพื้นที่หนึ่ง โดยใช้ element จาก tree ของ input โดยตรง (ไม่ copy)
+# parts คือ list ของ (placemarks ของไฟล์ input, ผลการตัดของพื้นที่นี้) เรียงตามไฟล์ input
+# ผลการตัดจะถูกใส่ไว้ชั่วคราวระหว่างที่ผู้เรียกเขียน element แล้วคืน geometry เดิมก่อนไปตัวถัดไป
+def iter_area_placemarks(parts):
+    for placemarks, kept in parts:
+        for idx, clip_value in kept:
+            placemark = placemarks[idx]
+            restore = apply_clip_value(placemark, clip_value)
+            yield placemark
+            restore()
+
+# ฟังก์ชันเขียนผลการตัดของพื้นที่หนึ่งเป็นไฟล์ KML ลง output (ใช้เก็บผลลง cache)
+def write_area_kml(parts, area_name, output):
+    with etree.xmlfile(output, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(f"{KML_NS}kml", nsmap={None: KML_NS[1:-1]}):
+            with xf.element(f"{KML_NS}Document"):
+                with xf.element(f"{KML_NS}name"):
+                    xf.write(f"{area_name}.kml")
+                for placemark in iter_area_placemarks(parts):
+                    xf.write(placemark)
+
+# ผลลัพธ์เก็บในหน่วยความจำจนกว่าจะเกินขนาดนี้ จึงย้ายไปเก็บในไฟล์ชั่วคราวบนดิสก์
+IN_MEMORY_OUTPUT_LIMIT_MB = 512
+
+def new_output_buffer(limit_mb=IN_MEMORY_OUTPUT_LIMIT_MB):
+    return tempfile.SpooledTemporaryFile(max_size=limit_mb * 1024 ** 2)
+
+# cache ผลการตัดรายพื้นที่บนดิสก์ (key = hash ของไฟล์ input + geometry ขอบเขต + พารามิเตอร์)
+# อยู่ในโฟลเดอร์ชั่วคราวที่ใช้ร่วมกันทุกผู้ใช้ของ server จึงใช้เฉพาะเมื่อผู้ใช้เลือกเปิดเอง
+CLIP_CACHE_DIR = os.path.join(tempfile.gettempdir(), "kml-clip-cache")
+CLIP_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# เปลี่ยนค่านี้เมื่อวิธีตัดเปลี่ยน เพื่อไม่ให้นำผลเก่าใน cache กลับมาใช้
+CLIP_CACHE_VERSION = "3"
+
+def file_sha256(source):
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return file_sha256(f)
+    digest = hashlib.sha256()
+    source.seek(0)
+    for chunk in iter(partial(source.read, 1 << 20), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def clip_cache_path(input_hash, boundary_polygon, params=""):
+    key = hashlib.sha256()
+    key.update(input_hash.encode())
+    key.update(shapely.to_wkb(boundary_polygon))
+    key.update(f"{CLIP_CACHE_VERSION}|{params}".encode())
+    return os.path.join(CLIP_CACHE_DIR, f"{key.hexdigest()}.kml")
+
+# ฟังก์ชันหาผลการตัดใน cache (แตะเวลาไฟล์เมื่อใช้ เพื่อให้ลบแบบ LRU ได้)
+def clip_cache_lookup(cache_path):
+    try:
+        os.utime(cache_path)
+        return cache_path
+    except FileNotFoundError:
+        return None
+
+# ฟังก์ชันเขียนผลการตัดลง cache (เขียนไฟล์ชั่วคราวใน cache ก่อนแล้วเปลี่ยนชื่อ เพื่อไม่ให้มีไฟล์ที่เขียนไม่ครบ)
+def clip_cache_store(parts, area_name, cache_path):
+    os.makedirs(CLIP_CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=CLIP_CACHE_DIR, suffix=".tmp", delete=False) as tmp_area:
+        write_area_kml(parts, area_name, tmp_area)
+    os.replace(tmp_area.name, cache_path)
+    return cache_path
+
+# ฟังก์ชันหาขนาดรวมของไฟล์ใน cache (ไบต์) สำหรับแสดงในหน้าเว็บ
+def clip_cache_size():
+    total = 0
+    if os.path.isdir(CLIP_CACHE_DIR):
+        for entry in os.scandir(CLIP_CACHE_DIR):
+            try:
+                if entry.is_file():
+                    total += entry.stat().st_size
+            except FileNotFoundError:
+                pass  # ไฟล์ถูกลบหรือเปลี่ยนชื่อระหว่างสแกน (อีก session กำลังเขียน/ลบ cache)
+    return total
+
+# ฟังก์ชันลบผลที่ไม่ได้ใช้นานที่สุดออกจาก cache จนขนาดรวมไม่เกินที่กำหนด
+def evict_clip_cache(max_bytes=CLIP_CACHE_MAX_BYTES):
+    if not os.path.isdir(CLIP_CACHE_DIR):
+        return
+    entries = []
+    for entry in os.scandir(CLIP_CACHE_DIR):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# ลดจุดยอดของขอบเขตก่อนตัด: ค่าความคลาดเคลื่อนกำหนดเป็นเมตร แล้วแปลงเป็นองศาด้วยความยาว 1 องศาละติจูด
+# (ทางลองจิจูด 1 องศาสั้นกว่านี้ ค่าที่ได้จึงไม่เกินที่กำหนดเสมอ)
+METERS_PER_DEGREE = 111_320
+SIMPLIFY_CACHE_VERSION = "2"
+# จำนวนครั้งที่ลดค่าความคลาดเคลื่อนลงครึ่งหนึ่งแล้วลดจุดทั้งชุดใหม่ เมื่อมีขอบเขตที่หายไปหรือไม่ถูกต้อง
+SIMPLIFY_RETRIES = 3
+
+# ฟังก์ชันลดจุดยอดของขอบเขตทั้งชุดโดยคงรอยต่อระหว่างพื้นที่ข้างเคียง (ไม่เกิดช่องว่าง/ซ้อนทับ)
+# ใช้ shapely.coverage_simplify (GEOS 3.12+) ถ้าไม่มีจะลดทีละขอบเขตแบบคง topology ของตัวเอง
+# ถ้ามีขอบเขตที่หายไปหรือไม่ถูกต้อง จะลดจุดทั้งชุดใหม่ด้วยค่าความคลาดเคลื่อนที่เล็กลง (หรือใช้ขอบเขตเดิมทั้งชุด)
+# เพราะการใช้ขอบเขตเดิมแทนเฉพาะบางพื้นที่จะทำให้รอยต่อกับพื้นที่ข้างเคียงไม่ตรงกัน
+# use_cache=True จะเก็บผลลัพธ์ใน cache เดียวกับผลการตัด คืนค่า (ขอบเขตที่ลดจุดแล้ว, รายงาน)
+def simplify_boundaries(boundaries, tolerance_m, use_cache=False):
+    polygons = np.empty(len(boundaries), dtype=object)
+    polygons[:] = [polygon for _, polygon in boundaries]
+    tolerance = tolerance_m / METERS_PER_DEGREE
+
+    key = hashlib.sha256()
+    for wkb in shapely.to_wkb(polygons):
+        key.update(wkb)
+    key.update(f"{SIMPLIFY_CACHE_VERSION}|{tolerance!r}".encode())
+    cache_path = os.path.join(CLIP_CACHE_DIR, f"{key.hexdigest()}.simplified.npz")
+
+    from_cache = use_cache and clip_cache_lookup(cache_path) is not None
+    if from_cache:
+        with np.load(cache_path) as data:
+            simplified = shapely.from_wkb(unpack_bytes(data["wkb"], data["wkb_offsets"]))
+            used_tolerance = float(data["tolerance"])
+    else:
+        simplified = None
+        used_tolerance = tolerance
+        if hasattr(shapely, "coverage_simplify"):
+            try:
+                for _ in range(SIMPLIFY_RETRIES + 1):
+                    simplified = shapely.coverage_simplify(polygons, used_tolerance)
+                    if not (shapely.is_empty(simplified) | ~shapely.is_valid(simplified)).any():
+                        break
+                    used_tolerance /= 2
+                else:
+                    # ลดค่าความคลาดเคลื่อนแล้วยังมีขอบเขตที่เสีย ใช้ขอบเขตเดิมทั้งชุด
+                    simplified, used_tolerance = polygons.copy(), 0.0
+            except shapely.errors.GEOSException:
+                # ขอบเขตซ้อนทับกันหรือไม่ถูกต้อง ใช้การลดจุดทีละขอบเขตแทน
+                simplified, used_tolerance = None, tolerance
+        if simplified is None:
+            simplified = shapely.simplify(polygons, tolerance, preserve_topology=True)
+            # ลดจุดทีละขอบเขตไม่มีรอยต่อร่วมกันอยู่แล้ว ขอบเขตที่เล็กกว่าค่าความคลาดเคลื่อนจนหายไปใช้ขอบเขตเดิมได้
+            lost = shapely.is_empty(simplified) | ~shapely.is_valid(simplified)
+            simplified[lost] = polygons[lost]
+
+        if use_cache:
+            os.makedirs(CLIP_CACHE_DIR, exist_ok=True)
+            wkb, wkb_offsets = pack_bytes(list(shapely.to_wkb(simplified)))
+            with tempfile.NamedTemporaryFile(dir=CLIP_CACHE_DIR, suffix=".tmp", delete=False) as tmp_cache:
+                np.savez(tmp_cache, wkb=wkb, wkb_offsets=wkb_offsets, tolerance=used_tolerance)
+            os.replace(tmp_cache.name, cache_path)
+
+    report = {
+        "tolerance_m": tolerance_m,
+        "tolerance_used_m": used_tolerance * METERS_PER_DEGREE,
+        "vertices_before": int(shapely.get_num_coordinates(polygons).sum()),
+        "vertices_after": int(shapely.get_num_coordinates(simplified).sum()),
+        "from_cache": from_cache,
+        "intersection_speedup": measure_simplify_speedup(polygons, simplified),
+    }
+    return [(area_name, polygon) for (area_name, _), polygon in zip(boundaries, simplified)], report
+
+# ฟังก์ชันวัดว่าการตัดเส้นที่คร่อมขอบเขตเร็วขึ้นกี่เท่าหลังลดจุด
+# ใช้เส้นสุ่ม (seed คงที่) ที่ลากผ่านกรอบของแต่ละขอบเขต แล้วจับเวลา shapely.intersection กับขอบเขตเดิม/ที่ลดจุดแล้ว
+def measure_simplify_speedup(polygons, simplified, total_samples=2000):
+    per_boundary = max(1, total_samples // max(len(polygons), 1))
+    rng = np.random.default_rng(0)
+    bounds = np.repeat(shapely.bounds(polygons), per_boundary, axis=0)
+    t = rng.random((len(bounds), 4))
+    lines = shapely.linestrings(np.stack([
+        np.stack([bounds[:, 0] + t[:, 0] * (bounds[:, 2] - bounds[:, 0]), bounds[:, 1]], axis=1),
+        np.stack([bounds[:, 0] + t[:, 1] * (bounds[:, 2] - bounds[:, 0]), bounds[:, 3]], axis=1),
+    ], axis=1))
+
+    timings = []
+    for targets in (polygons, simplified):
+        targets = np.repeat(targets, per_boundary)
+        start = time.perf_counter()
+        shapely.intersection(lines, targets)
+        timings.append(time.perf_counter() - start)
+    return timings[0] / timings[1] if timings[1] > 0 else float("inf")
+
+# ฟังก์ชันแสดงผลการลดจุดยอดของขอบเขต
+def show_simplify_report(report):
+    removed = report["vertices_before"] - report["vertices_after"]
+    with st.expander("✂️ ผลการลดจุดยอดของขอบเขต"):
+        st.write(f"- ค่าความคลาดเคลื่อน: {report['tolerance_m']:g} เมตร" + (" (ใช้ผลจาก cache)" if report["from_cache"] else ""))
+        if report["tolerance_used_m"] == 0:
+            st.warning("ลดจุดแล้วมีขอบเขตที่หายไปหรือไม่ถูกต้อง จึงใช้ขอบเขตเดิมทั้งชุดเพื่อให้รอยต่อระหว่างพื้นที่ยังตรงกัน")
+        elif report["tolerance_used_m"] < report["tolerance_m"]:
+            st.write(f"- ลดค่าความคลาดเคลื่อนเหลือ {report['tolerance_used_m']:g} เมตร เพื่อไม่ให้มีขอบเขตที่หายไปหรือไม่ถูกต้อง")
+        st.write(
+            f"- จุดยอด: {report['vertices_before']:,} → {report['vertices_after']:,} "
+            f"(ลดลง {removed:,} จุด, {removed / max(report['vertices_before'], 1):.1%})"
+        )
+        st.write(f"- การตัดเส้นที่คร่อมขอบเขตเร็วขึ้นประมาณ {report['intersection_speedup']:.1f} เท่า (วัดจากเส้นตัวอย่าง)")
+        if "clip_seconds" in report:
+            st.write(f"- เวลาตัดจริงด้วยขอบเขตที่ลดจุดแล้ว: {report['clip_seconds']:.1f} วินาที")
+
+# ฟังก์ชันสำหรับประมวลผลทุกขอบเขต
+# คืนค่า list ของ (ผลการตัด, ชื่อพื้นที่) โดยผลการตัดเป็น list ของ (placemarks, kept) ในหน่วยความจำ
+# หรือ path ของไฟล์ใน cache; use_cache=True จะคำนวณใหม่เฉพาะขอบเขตที่ geometry เปลี่ยน
+# area_callback(b, ผลการตัด) ถูกเรียกทันทีที่แต่ละพื้นที่พร้อม (พื้นที่จาก cache ก่อน แล้วตามลำดับที่ตัดเสร็จ)
+# boundaries คือขอบเขตที่โหลดไว้แล้ว (ถ้าไม่ระบุจะโหลดจาก boundary_kml)
+def process_areas_with_red(input_kml, boundary_kml, workers=1, use_cache=False, tile_vertices=0, area_callback=None, boundaries=None):
+    area_outputs = []
+    try:
+        if boundaries is None:
+            boundaries = load_boundaries(boundary_kml)
+        if not boundaries:
+            return area_outputs
+        total_boundaries = len(boundaries)
+
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+
+        area_sources = [None] * total_boundaries
+        cache_paths = [None] * total_boundaries
+        if use_cache:
+            status_text.text("กำลังตรวจสอบผลการตัดใน cache...")
+            input_hash = file_sha256(input_kml)
+            for b, (_, polygon) in enumerate(boundaries):
+                cache_paths[b] = clip_cache_path(input_hash, polygon, f"tile_vertices={tile_vertices}")
+                area_sources[b] = clip_cache_lookup(cache_paths[b])
+                if area_sources[b] and area_callback:
+                    area_callback(b, area_sources[b])
+        missing = [b for b in range(total_boundaries) if area_sources[b] is None]
+
+        def finish_area(i, placemarks, kept):
+            b = missing[i]
+            area_sources[b] = [(placemarks, kept)]
+            if use_cache:
+                clip_cache_store(area_sources[b], boundaries[b][0], cache_paths[b])
+            if area_callback:
+                area_callback(b, area_sources[b])
+
+        def update_progress(done, total, b):
+            status_text.text(f"กำลังประมวลผลพื้นที่: {boundaries[missing[b]][0]} ({done}/{total})")
+            progress_bar.progress(done / total)
+
+        if missing:
+            status_text.text(f"กำลังอ่านไฟล์และสร้างดัชนีขอบเขต {len(missing)} พื้นที่...")
+            stats = new_clip_stats()
+            clip_all_areas(
+                input_kml, [boundaries[b] for b in missing], update_progress, stats,
+                workers=workers, tile_vertices=tile_vertices, area_callback=finish_area
+            )
+            st.session_state.clip_stats = stats
+
+        if use_cache:
+            st.info(
+                f"ใช้ผลจาก cache {total_boundaries - len(missing)} พื้นที่, "
+                f"คำนวณใหม่ {len(missing)} พื้นที่"
+            )
+
+        area_outputs = [(source, area_name) for source, (area_name, _) in zip(area_sources, boundaries)]
+
+        status_text.text("ประมวลผลเสร็จสิ้น!")
+        time.sleep(1)
+        status_text.empty()
+        progress_bar.empty()
+    except Exception as e:
+        st.error(f"เกิดข้อผิดพลาดในการประมวลผลไฟล์ขอบเขต: {e}")
+    return area_outputs
+
+# ฟังก์ชันหารายชื่อไฟล์ KML ใน ZIP (zip_data คือไบต์ของไฟล์ ZIP ที่อัปโหลด)
+def list_zip_kml_members(zip_data):
+    with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zipf:
+        return [f for f in zipf.namelist() if f.endswith('.kml')]
+
+# ฟังก์ชันตัดไฟล์ KML หนึ่งไฟล์ใน ZIP โดยอ่านจาก stream ของ archive โดยตรง (ไม่แตกไฟล์ลงดิสก์)
+# แต่ละ thread เปิด BytesIO ของตัวเองบนไบต์ชุดเดียวกัน จึงไม่แย่งตำแหน่งอ่านกัน
+def clip_zip_member(zip_data, member, boundaries, tile_vertices=0):
+    stats = new_clip_stats()
+    with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zipf:
+        with zipf.open(member) as kml_file:
+            placemarks, area_results = clip_all_areas(
+                kml_file, boundaries, stats=stats, tile_vertices=tile_vertices
+            )
+    return placemarks, area_results, stats
+
+# ฟังก์ชันตัดทุกไฟล์ KML ใน ZIP พร้อมกันด้วย thread pool (lxml/shapely ปล่อย GIL ระหว่างคำนวณ)
+# คืนค่า list ของ (placemarks, ผลการตัดแยกตามพื้นที่) ตามลำดับไฟล์ใน ZIP (None = ไฟล์ที่ตัดไม่สำเร็จ)
+def process_zip_with_red(zip_data, members, boundaries, tile_vertices=0):
+    results = [None] * len(members)
+    # เตรียม boundary ครั้งเดียวก่อนใช้ร่วมกันหลาย thread
+    shapely.prepare([polygon for _, polygon in boundaries])
+
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    stats = new_clip_stats()
+
+    with ThreadPoolExecutor(max_workers=min(len(members), os.cpu_count() or 1)) as pool:
+        futures = {
+            pool.submit(clip_zip_member, zip_data, member, boundaries, tile_vertices): i
+            for i, member in enumerate(members)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            try:
+                placemarks, area_results, member_stats = future.result()
+                results[i] = (placemarks, area_results)
+                for key, count in member_stats.items():
+                    stats[key] += count
+            except Exception as e:
+                st.error(f"ไม่สามารถตัดไฟล์ {members[i]}: {e}")
+            status_text.text(f"ตัดไฟล์เสร็จแล้ว: {members[i]} ({done}/{len(members)})")
+            progress_bar.progress(done / len(members))
+
+    st.session_state.clip_stats = stats
+    status_text.empty()
+    progress_bar.empty()
+    return results
+
+# ฟังก์ชันเพิ่มสไตล์ของไฟล์รวม (เส้นที่ตัดแล้ว + ขอบเขตพื้นที่) ลงใน Document
+def add_combined_styles(document_elem, ns=""):
+    # Add styles for better visualization in Google Earth
+    style_elem = etree.SubElement(document_elem, f"{ns}Style", id="normalPlacemark")
+    line_style = etree.SubElement(style_elem, f"{ns}LineStyle")
+    etree.SubElement(line_style, f"{ns}color").text = "ff0000ff"  # Red
+    etree.SubElement(line_style, f"{ns}width").text = "2"
+    
+    poly_style = etree.SubElement(style_elem, f"{ns}PolyStyle")
+    etree.SubElement(poly_style, f"{ns}color").text = "7f0000ff"  # Semi-transparent red
+    etree.SubElement(poly_style, f"{ns}outline").text = "1"
+
+    # ===== สไตล์สำหรับขอบเขตพื้นที่ =====
+    boundary_style = etree.SubElement(document_elem, f"{ns}Style", id="boundaryPlacemark")
+    # เส้นขอบ
+    ls_b = etree.SubElement(boundary_style, f"{ns}LineStyle")
+    etree.SubElement(ls_b, f"{ns}color").text = "ff00ff00"   # ทึบเขียว
+    etree.SubElement(ls_b, f"{ns}width").text = "3"
+    # พื้นที่เติม
+    ps_b = etree.SubElement(boundary_style, f"{ns}PolyStyle")
+    etree.SubElement(ps_b, f"{ns}color").text   = "4000ff00"  # 25% โปร่งใสเขียว
+    etree.SubElement(ps_b, f"{ns}fill").text    = "1"         # เปิดเติมสี
+    etree.SubElement(ps_b, f"{ns}outline").text = "1"         # แสดงเส้นขอบด้วย
+
+    # ===== สไตล์สำหรับขอบเขตพื้นที่ =====
+    boundary_style = etree.SubElement(document_elem, f"{ns}Style", id="boundaryPlacemark")
+    # เส้นขอบ
+    ls_b = etree.SubElement(boundary_style, f"{ns}LineStyle")
+    etree.SubElement(ls_b, f"{ns}color").text = "ff00ff00"   # เส้นขอบเขียวทึบ
+    etree.SubElement(ls_b, f"{ns}width").text = "3"
+    # พื้นที่เติม
+    ps_b = etree.SubElement(boundary_style, f"{ns}PolyStyle")
+    etree.SubElement(ps_b, f"{ns}color").text   = "0000ff00"  # เติมสีเขียว แต่ alpha=00 => มองไม่เห็น
+    etree.SubElement(ps_b, f"{ns}fill").text    = "1"         # เปิดเติม (แต่โปร่งใสหมด)
+    etree.SubElement(ps_b, f"{ns}outline").text = "1"         # แสดงเส้นขอบ
+
+# ฟังก์ชันโหลด Placemark ของขอบเขตเก็บตามชื่อ (ใช้วางขอบเขตเดิมไว้ในแต่ละโฟลเดอร์)
+def load_boundary_placemarks(boundary_kml):
+    compiled = compiled_boundary_path(boundary_kml)
+    if compiled and os.path.exists(compiled):
+        boundary_dict = {}
+        for name, (xml, tail) in load_compiled_boundaries(compiled)[2].items():
+            boundary_dict[name] = etree.fromstring(xml)
+            boundary_dict[name].tail = tail or None
+        return boundary_dict
+
+    boundary_root = parse_kml(boundary_kml).getroot()
+    boundary_dict = {}
+    for b in boundary_root.findall(f".//{KML_NS}Placemark"):
+        nm = b.find(f".//{KML_NS}name")
+        if nm is not None:
+            boundary_dict[nm.text] = b
+    return boundary_dict
+
+# ฟังก์ชันเขียนไฟล์ KML รวมทีละโฟลเดอร์ด้วย etree.xmlfile (ไม่สร้าง tree ของไฟล์รวมทั้งไฟล์)
+# areas คือ iterable ของ (ชื่อพื้นที่, Placemark ที่ตัดแล้วของพื้นที่นั้น) progress_callback รับจำนวนพื้นที่ที่เขียนแล้ว
+def write_combined_kml(output, input_file_name, boundary_dict, areas, progress_callback=None):
+    style_holder = etree.Element(f"{KML_NS}Document", nsmap={None: KML_NS[1:-1]})
+    add_combined_styles(style_holder, KML_NS)
+
+    with etree.xmlfile(output, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(f"{KML_NS}kml", nsmap={None: KML_NS[1:-1]}):
+            with xf.element(f"{KML_NS}Document"):
+                with xf.element(f"{KML_NS}name"):
+                    xf.write(os.path.splitext(input_file_name)[0])
+                for style in style_holder:
+                    xf.write(style)
+
+                for done, (area_name, placemarks) in enumerate(areas, 1):
+                    with xf.element(f"{KML_NS}Folder"):
+                        with xf.element(f"{KML_NS}name"):
+                            xf.write(area_name)
+
+                        # ----- เพิ่มขอบเขตเดิมก่อน placemark ที่ตัดแล้ว -----
+                        if area_name in boundary_dict:
+                            b_placemark = copy.deepcopy(boundary_dict[area_name])
+                            etree.SubElement(b_placemark, f"{KML_NS}styleUrl").text = "#boundaryPlacemark"
+                            xf.write(b_placemark)
+
+                        for placemark in placemarks:
+                            # ใส่ styleUrl ชั่วคราวระหว่างเขียน แล้วเอาออก (element อาจเป็นของ tree input)
+                            style_url = etree.SubElement(placemark, f"{KML_NS}styleUrl")
+                            style_url.text = "#normalPlacemark"
+                            xf.write(placemark)
+                            placemark.remove(style_url)
+                    xf.flush()
+
+                    if progress_callback:
+                        progress_callback(done)
+    return output
+
+# ฟังก์ชันวน Placemark ของผลการตัดหนึ่งพื้นที่ (ในหน่วยความจำ หรือไฟล์ใน cache)
+def area_source_placemarks(source, area_name):
+    if not isinstance(source, str):
+        return iter_area_placemarks(source)
+    try:
+        return parse_kml(source).getroot().findall(f".//{KML_NS}Placemark")
+    except (OSError, etree.XMLSyntaxError) as e:
+        st.error(f"ไม่สามารถรวมไฟล์ {area_name}: {e}")
+        return []
+
+# ฟังก์ชันรวมผลการตัดทุกพื้นที่เป็นไฟล์ KML เดียว (serialize ครั้งเดียวตอนท้าย)
+# area_outputs คือผลจาก process_areas_with_red: list ของ (ผลการตัดในหน่วยความจำหรือ path ใน cache, ชื่อพื้นที่)
+# ผลลัพธ์เขียนลง output (ค่าเริ่มต้นคือ new_output_buffer() ที่ย้ายไปดิสก์เองเมื่อเกินขนาดที่กำหนด)
+def combine_kml_files(area_outputs, input_file_name, boundary_kml, output=None):
+    if output is None:
+        output = new_output_buffer()
+
+    # โหลด boundary KML มาเก็บตามชื่อ
+    boundary_dict = load_boundary_placemarks(boundary_kml)
+
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+
+    def iter_areas():
+        for source, area_name in area_outputs:
+            status_text.text(f"กำลังรวมพื้นที่: {area_name}")
+            yield area_name, area_source_placemarks(source, area_name)
+
+    def update_progress(done):
+        progress_bar.progress(done / len(area_outputs))
+
+    write_combined_kml(output, input_file_name, boundary_dict, iter_areas(), update_progress)
+
+    status_text.text("รวมไฟล์เสร็จสิ้น!")
+    time.sleep(1)
+    status_text.empty()
+    progress_bar.empty()
+
+    return output
+
+# รูปแบบผลลัพธ์: ไฟล์ KML รวม หรือชุดไฟล์ KML แยกตามพื้นที่ใน ZIP / KMZ
+AREA_OUTPUT_MERGED = "ไฟล์ KML รวมไฟล์เดียว"
+AREA_OUTPUT_ZIP = "ZIP แยกไฟล์ KML ตามพื้นที่"
+AREA_OUTPUT_KMZ = "KMZ แยกไฟล์ตามพื้นที่ (เปิดใน Google Earth ได้ทันที)"
+AREA_OUTPUT_SUFFIX = {AREA_OUTPUT_MERGED: ".kml", AREA_OUTPUT_ZIP: ".zip", AREA_OUTPUT_KMZ: ".kmz"}
+
+# ฟังก์ชันตั้งชื่อไฟล์ของแต่ละพื้นที่ในชุดไฟล์ (ชื่อซ้ำจะเติมลำดับต่อท้าย)
+def area_bundle_names(area_names, folder=""):
+    used = set()
+    arcnames = []
+    for i, area_name in enumerate(area_names):
+        stem = re.sub(r'[\\/:*?"<>|]', "_", area_name or "").strip() or f"area_{i+1}"
+        name, n = stem, 2
+        while name.lower() in used:
+            name, n = f"{stem}_{n}", n + 1
+        used.add(name.lower())
+        arcnames.append(f"{folder}{name}.kml")
+    return arcnames
+
+# ฟังก์ชันเขียน doc.kml ของ KMZ ที่มี NetworkLink ไปยังไฟล์ของทุกพื้นที่
+def write_kmz_doc(output, input_file_name, area_names, arcnames):
+    with etree.xmlfile(output, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(f"{KML_NS}kml", nsmap={None: KML_NS[1:-1]}):
+            with xf.element(f"{KML_NS}Document"):
+                with xf.element(f"{KML_NS}name"):
+                    xf.write(os.path.splitext(input_file_name)[0])
+                for area_name, arcname in zip(area_names, arcnames):
+                    link = etree.Element(f"{KML_NS}NetworkLink", nsmap={None: KML_NS[1:-1]})
+                    etree.SubElement(link, f"{KML_NS}name").text = area_name
+                    etree.SubElement(etree.SubElement(link, f"{KML_NS}Link"), f"{KML_NS}href").text = arcname
+                    xf.write(link)
+
+# ฟังก์ชันเปิด ZIP/KMZ สำหรับเขียนผลแยกไฟล์ตามพื้นที่ โดยเขียนแต่ละพื้นที่ลง ZIP ทันทีที่พร้อม
+# (ไม่สร้างไฟล์รวม) คืนค่า (add_area(b, placemarks), finish() ที่ปิด ZIP แล้วคืน output)
+# KMZ จะมี doc.kml เป็นไฟล์แรก และเก็บไฟล์ของแต่ละพื้นที่ไว้ในโฟลเดอร์ files/
+def open_area_bundle(output, input_file_name, area_names, boundary_dict, kmz=False):
+    zipf = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+    arcnames = area_bundle_names(area_names, "files/" if kmz else "")
+    if kmz:
+        with zipf.open("doc.kml", 'w') as doc:
+            write_kmz_doc(doc, input_file_name, area_names, arcnames)
+
+    def add_area(b, placemarks):
+        with zipf.open(arcnames[b], 'w') as entry:
+            write_combined_kml(entry, f"{area_names[b]}.kml", boundary_dict, [(area_names[b], placemarks)])
+
+    def finish():
+        zipf.close()
+        return output
+
+    return add_area, finish
+
+# ฟังก์ชันเขียนผลการตัดที่ได้ครบแล้วเป็นชุดไฟล์แยกตามพื้นที่ (ใช้กับโหมด streaming และ ZIP)
+# areas คือ iterable ของ (ชื่อพื้นที่, Placemark ที่ตัดแล้วของพื้นที่นั้น) ตามลำดับขอบเขต
+def write_area_bundle(output, input_file_name, area_names, boundary_kml, areas, kmz=False, progress_callback=None):
+    boundary_dict = load_boundary_placemarks(boundary_kml)
+    add_area, finish = open_area_bundle(output, input_file_name, area_names, boundary_dict, kmz)
+    for b, (_, placemarks) in enumerate(areas):
+        add_area(b, placemarks)
+        if progress_callback:
+            progress_callback(b + 1)
+    return finish()
+
+# ฟังก์ชันตัดทุกขอบเขต (ขนานหลาย process ถ้า workers > 1) แล้วเขียนแต่ละพื้นที่ลง ZIP/KMZ เมื่อตัดเสร็จ
+# การเขียน KML และบีบอัดทำใน process หลักทีละพื้นที่ตามลำดับขอบเขต (ไม่ได้ทำแบบขนาน) พื้นที่ที่ตัดเสร็จก่อนลำดับ
+# จะรอจนพื้นที่ก่อนหน้าเขียนเสร็จ ลำดับไฟล์ใน ZIP/KMZ จึงเหมือนเดิมทุกครั้งไม่ว่าใช้กี่ process
+# ดาวน์โหลดได้ทันทีเมื่อพื้นที่สุดท้ายเสร็จ คืนค่า (output, รายชื่อพื้นที่)
+def process_areas_to_bundle(input_kml, boundary_kml, input_file_name, output, kmz=False, workers=1, use_cache=False, tile_vertices=0, boundaries=None):
+    if boundaries is None:
+        boundaries = load_boundaries(boundary_kml)
+    if not boundaries:
+        return None, []
+    area_names = [area_name for area_name, _ in boundaries]
+    boundary_dict = load_boundary_placemarks(boundary_kml)
+    add_area, finish = open_area_bundle(output, input_file_name, area_names, boundary_dict, kmz)
+
+    ready = {}
+    next_area = 0
+
+    def write_area(b, source):
+        nonlocal next_area
+        ready[b] = source
+        while next_area in ready:
+            add_area(next_area, area_source_placemarks(ready.pop(next_area), area_names[next_area]))
+            next_area += 1
+
+    area_outputs = process_areas_with_red(
+        input_kml, boundary_kml, workers=workers, use_cache=use_cache,
+        tile_vertices=tile_vertices, area_callback=write_area, boundaries=boundaries
+    )
+    finish()
+    if not area_outputs:
+        return None, []
+    return output, area_names
+
+# ฟังก์ชันตัดแบบ streaming สำหรับไฟล์ขนาดใหญ่มาก: อ่าน input ด้วย iterparse ทีละ Placemark
+# แล้วล้าง element ทิ้งทันที ผลการตัดเก็บเป็นไบต์ในไฟล์ spool ชั่วคราว (ในหน่วยความจำมีแค่ offset)
+# area_records เก็บ offset และความยาวของ Placemark ใน spool แยกตามพื้นที่ (สลับกันใน array เดียว)
+# เรียกซ้ำกับหลายไฟล์โดยใช้ spool/area_records เดิมได้ เพื่อรวมผลเป็นไฟล์เดียว
+def stream_clip_areas(f, total_bytes, boundaries, spool, area_records, progress_callback=None, stats=None, tile_vertices=0):
+    if stats is None:
+        stats = new_clip_stats()
+    polygons = [polygon for _, polygon in boundaries]
+    shapely.prepare(polygons)
+    boundary_bounds = [polygon.bounds for polygon in polygons]
+    boundary_tiles = [tile_boundary(polygon, tile_vertices) for polygon in polygons]
+    tree = STRtree(polygons)
+    all_areas = range(len(boundaries))
+    total_bytes = total_bytes or 1
+
+    context = etree.iterparse(f, events=("end",), tag=f"{KML_NS}Placemark", huge_tree=True)
+    for count, (_, placemark) in enumerate(context, 1):
+        kind, geom_elem = find_geometry_elem(placemark)
+        hits = []
+        unchanged = None
+
+        if kind == "point":
+            try:
+                x, y = parse_coords(geom_elem.find(f".//{KML_NS}coordinates"))[0]
+                hits = [
+                    (b, None) for b in sorted(tree.query(shapely.points(x, y)))
+                    if shapely.contains_xy(polygons[b], x, y)
+                ]
+            except (AttributeError, ValueError, IndexError):
+                hits = [(b, None) for b in all_areas]
+        else:
+            geom = parse_geometry(kind, geom_elem) if kind else None
+            if geom is None:
+                hits = [(b, None) for b in all_areas]
+            else:
+                candidates = sorted(tree.query(geom))
+                stats["bbox_reject"] += len(boundaries) - len(candidates)
+                for b in candidates:
+                    keep, clip_value = clip_geometry(
+                        geom, polygons[b], boundary_bounds[b], stats, boundary_tiles[b]
+                    )
+                    if keep:
+                        hits.append((b, clip_value))
+
+        for b, clip_value in hits:
+            if clip_value is None:
+                # Placemark ที่ไม่ต้องแก้พิกัดเขียนลง spool ครั้งเดียวแล้วใช้ร่วมกันทุกพื้นที่
+                if unchanged is None:
+                    unchanged = spool.tell(), spool.write(etree.tostring(placemark))
+                record = unchanged
+            else:
+                restore = apply_clip_value(placemark, clip_value)
+                record = spool.tell(), spool.write(etree.tostring(placemark))
+                restore()
+            area_records[b].extend(record)
+
+        # ล้าง element ที่ใช้แล้ว เพื่อให้หน่วยความจำคงที่
+        placemark.clear(keep_tail=False)
+        while placemark.getprevious() is not None:
+            del placemark.getparent()[0]
+
+        if progress_callback and count % 1000 == 0:
+            progress_callback(min(f.tell() / total_bytes, 1.0))
+    del context
+
+# ฟังก์ชันเขียนไฟล์ KML รวม (หรือชุดไฟล์แยกตามพื้นที่) จาก Placemark ที่เก็บไว้ใน spool ของโหมด streaming
+def write_combined_kml_stream(spool, area_records, boundaries, input_file_name, boundary_kml, progress_callback=None, output=None, area_output=AREA_OUTPUT_MERGED):
+    if output is None:
+        output = new_output_buffer()
+
+    def iter_spooled(records):
+        for i in range(0, len(records), 2):
+            spool.seek(records[i])
+            yield etree.fromstring(spool.read(records[i + 1]))
+
+    def update_progress(done):
+        if progress_callback:
+            progress_callback(done / len(boundaries))
+
+    areas = ((area_name, iter_spooled(area_records[b])) for b, (area_name, _) in enumerate(boundaries))
+    if area_output != AREA_OUTPUT_MERGED:
+        area_names = [area_name for area_name, _ in boundaries]
+        return write_area_bundle(
+            output, input_file_name, area_names, boundary_kml, areas, area_output == AREA_OUTPUT_KMZ, update_progress
+        )
+    boundary_dict = load_boundary_placemarks(boundary_kml)
+    return write_combined_kml(output, input_file_name, boundary_dict, areas, update_progress)
+
+# ฟังก์ชันประมวลผลแบบ streaming ตั้งแต่อ่าน input จนได้ไฟล์รวม
+# inputs คือ list ของ (ฟังก์ชันเปิดไฟล์แบบไบนารี, ขนาดไฟล์) ถ้ามีหลายไฟล์จะรวมผลไว้ในพื้นที่เดียวกัน
+def process_areas_streaming(inputs, boundary_kml, input_file_name, tile_vertices=0, area_output=AREA_OUTPUT_MERGED, output=None, boundaries=None):
+    try:
+        if boundaries is None:
+            boundaries = load_boundaries(boundary_kml)
+        if not boundaries:
+            return None, []
+
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        total_bytes = sum(size for _, size in inputs) or 1
+        done_bytes = 0
+
+        def update_progress(fraction):
+            progress_bar.progress(fraction)
+
+        def update_input_progress(fraction):
+            progress_bar.progress(min((done_bytes + fraction * size) / total_bytes, 1.0))
+
+        status_text.text(f"กำลังตัดข้อมูลแบบ streaming ({len(boundaries)} พื้นที่)...")
+        stats = new_clip_stats()
+        area_records = [array("q") for _ in boundaries]
+        with tempfile.TemporaryFile() as spool:
+            for open_input, size in inputs:
+                with open_input() as f:
+                    stream_clip_areas(
+                        f, size, boundaries, spool, area_records, update_input_progress, stats, tile_vertices
+                    )
+                done_bytes += size
+            st.session_state.clip_stats = stats
+
+            status_text.text("กำลังเขียนไฟล์รวมทีละพื้นที่...")
+            progress_bar.progress(0)
+            combined_kml = write_combined_kml_stream(
+                spool, area_records, boundaries, input_file_name, boundary_kml, update_progress, output, area_output
+            )
+
+        status_text.text("ประมวลผลเสร็จสิ้น!")
+        time.sleep(1)
+        status_text.empty()
+        progress_bar.empty()
+        return combined_kml, [area_name for area_name, _ in boundaries]
+    except Exception as e:
+        st.error(f"เกิดข้อผิดพลาดในการตัดข้อมูลแบบ streaming: {e}")
+        return None, []
+
+ZIP_OUTPUT_MERGED = "รวมเป็นไฟล์ KML เดียว"
+ZIP_OUTPUT_PER_MEMBER = "ZIP แยกผลลัพธ์ตามไฟล์ KML ต้นทาง"
+
+# ฟังก์ชันรวมไฟล์ผลลัพธ์ของแต่ละ KML ต้นทางเป็น ZIP เดียว
+def write_member_zip(member_outputs, output=None):
+    if output is None:
+        output = new_output_buffer()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for member, combined_kml in member_outputs:
+            stem = os.path.splitext(os.path.basename(member))[0]
+            combined_kml.seek(0)
+            with zipf.open(f"{stem}_combined.kml", 'w') as dst:
+                shutil.copyfileobj(combined_kml, dst)
+            combined_kml.close()
+    return output
+
+# ฟังก์ชันตัดทุกไฟล์ KML ใน ZIP ที่อัปโหลด แล้วรวมเป็น KML เดียวหรือ ZIP แยกตามไฟล์ต้นทาง
+# zip_data คือไบต์ของไฟล์ ZIP (อ่านจากหน่วยความจำโดยตรง ไม่เขียนลงไฟล์ชั่วคราว)
+def process_zip_upload(zip_data, boundary_kml, input_file_name, boundaries=None):
+    members = list_zip_kml_members(zip_data)
+    if not members:
+        st.error("ไม่พบไฟล์ KML ในไฟล์ ZIP")
+        return None, []
+
+    st.info(f"เริ่มประมวลผลไฟล์ KML จำนวน {len(members)} ไฟล์...")
+    per_member = st.session_state.zip_output_mode == ZIP_OUTPUT_PER_MEMBER
+    tile_vertices = st.session_state.clip_tile_vertices
+    # ผลแยกไฟล์ตามพื้นที่ใช้กับผลที่รวมทุกไฟล์ใน ZIP เท่านั้น
+    area_output = st.session_state.clip_area_output
+    output = new_output_buffer(st.session_state.clip_memory_limit_mb)
+    member_outputs = []
+    area_names = []
+
+    if st.session_state.clip_streaming:
+        with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zipf:
+            inputs = [(partial(zipf.open, m), zipf.getinfo(m).file_size) for m in members]
+            if not per_member:
+                return process_areas_streaming(
+                    inputs, boundary_kml, input_file_name, tile_vertices, area_output, output, boundaries
+                )
+            for member, member_input in zip(members, inputs):
+                combined_kml, area_names = process_areas_streaming(
+                    [member_input], boundary_kml, os.path.basename(member), tile_vertices, boundaries=boundaries
+                )
+                if combined_kml:
+                    member_outputs.append((member, combined_kml))
+    else:
+        if boundaries is None:
+            boundaries = load_boundaries(boundary_kml)
+        if not boundaries:
+            return None, []
+        area_names = [area_name for area_name, _ in boundaries]
+        results = process_zip_with_red(zip_data, members, boundaries, tile_vertices)
+
+        if not per_member:
+            clipped = [result for result in results if result is not None]
+            if not clipped:
+                return None, []
+            area_outputs = [
+                ([(placemarks, area_results[b]) for placemarks, area_results in clipped], area_name)
+                for b, area_name in enumerate(area_names)
+            ]
+            if area_output != AREA_OUTPUT_MERGED:
+                st.info("กำลังเขียนไฟล์แยกตามพื้นที่...")
+                areas = ((area_name, iter_area_placemarks(parts)) for parts, area_name in area_outputs)
+                return write_area_bundle(
+                    output, input_file_name, area_names, boundary_kml, areas, area_output == AREA_OUTPUT_KMZ
+                ), area_names
+            st.info("กำลังรวมไฟล์ KML...")
+            return combine_kml_files(area_outputs, input_file_name, boundary_kml, output), area_names
+
+        for member, result in zip(members, results):
+            if result is None:
+                continue
+            placemarks, area_results = result
+            area_outputs = [
+                ([(placemarks, kept)], area_name)
+                for area_name, kept in zip(area_names, area_results)
+            ]
+            member_outputs.append(
+                (member, combine_kml_files(area_outputs, os.path.basename(member), boundary_kml))
+            )
+
+    if not member_outputs:
+        return None, []
+    return write_member_zip(member_outputs, output), area_names
+
+# ===== ประเมินงานก่อนเริ่มตัด (preflight) =====
+# ขนาดตัวอย่าง Placemark ที่ใช้จับเวลาการแปลง/ตัด/เขียนบนเครื่องนี้
+PREFLIGHT_SAMPLE_SIZE = 500
+# ค่าประมาณหน่วยความจำที่วัดจากการใช้งานจริง: tree ของ lxml ใช้ราว 5 เท่าของขนาดไฟล์ KML
+TREE_BYTES_PER_INPUT_BYTE = 5
+FEATURE_BYTES = 150
+VERTEX_BYTES = 32
+KEPT_PAIR_BYTES = 100
+BASE_MEMORY_BYTES = 150 * 1024 ** 2
+
+# ฟังก์ชันอ่านหน่วยความจำที่ยังว่างของเครื่อง (None ถ้าอ่านไม่ได้)
+def available_memory_bytes():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def new_preflight_scan():
+    return {
+        "kinds": dict.fromkeys(["point", "line", "polygon", "multi", None], 0),
+        "vertices": 0,
+        "bytes": 0,
+        "bboxes": array("d"),
+        "is_point": array("b"),
+        "no_geometry": 0,
+        "sample": [],
+        "seen": 0,
+        "seconds": 0.0,
+    }
+
+# ฟังก์ชันสแกนไฟล์ KML แบบ streaming (ใช้หน่วยความจำคงที่): นับ Placemark ตามชนิด geometry, จำนวนจุดยอด
+# และ bounding box ของแต่ละ feature พร้อมสุ่มตัวอย่าง Placemark (reservoir sampling) ไว้จับเวลา
+def scan_kml_stream(f, total_bytes, scan, progress_callback=None):
+    rng = random.Random(0)
+    start = time.perf_counter()
+    total_bytes = total_bytes or 1
+
+    context = etree.iterparse(f, events=("end",), tag=f"{KML_NS}Placemark", huge_tree=True)
+    for count, (_, placemark) in enumerate(context, 1):
+        kind, geom_elem = find_geometry_elem(placemark)
+        scan["kinds"][kind] += 1
+
+        bbox = None
+        if geom_elem is not None:
+            xs, ys = [], []
+            for coords_elem in geom_elem.iter(f"{KML_NS}coordinates"):
+                tuples = coords_elem.text.split() if coords_elem.text else []
+                if not tuples:
+                    continue
+                scan["vertices"] += len(tuples)
+                dims = tuples[0].count(",") + 1
+                try:
+                    values = np.array(",".join(tuples).split(","), dtype=float).reshape(len(tuples), dims)
+                except ValueError:
+                    continue
+                xs.append(values[:, 0])
+                ys.append(values[:, 1])
+            if xs:
+                xs, ys = np.concatenate(xs), np.concatenate(ys)
+                bbox = xs.min(), ys.min(), xs.max(), ys.max()
+
+        if bbox is None:
+            # ไม่มีพิกัดให้ตัด จะถูกเก็บไว้ในทุกพื้นที่
+            scan["no_geometry"] += 1
+        else:
+            scan["bboxes"].extend(bbox)
+            scan["is_point"].append(kind == "point")
+            scan["seen"] += 1
+            if len(scan["sample"]) < PREFLIGHT_SAMPLE_SIZE:
+                scan["sample"].append(etree.tostring(placemark))
+            else:
+                j = rng.randrange(scan["seen"])
+                if j < PREFLIGHT_SAMPLE_SIZE:
+                    scan["sample"][j] = etree.tostring(placemark)
+
+        placemark.clear(keep_tail=False)
+        while placemark.getprevious() is not None:
+            del placemark.getparent()[0]
+
+        if progress_callback and count % 1000 == 0:
+            progress_callback(min(f.tell() / total_bytes, 1.0))
+    del context
+
+    scan["bytes"] += total_bytes
+    scan["seconds"] += time.perf_counter() - start
+    return scan
+
+# ฟังก์ชันจับเวลาการแปลง geometry, การตัด และการเขียน Placemark จากตัวอย่างที่สุ่มไว้
+# คืนค่า (วินาทีต่อจุดยอด, วินาทีต่อคู่ feature/ขอบเขต, วินาทีต่อ Placemark ที่เขียน, ขนาดเฉลี่ยต่อ Placemark)
+def calibrate_clip_costs(sample, boundaries, tile_vertices=0):
+    if not sample:
+        return 0.0, 0.0, 0.0, 0.0
+    placemarks = [etree.fromstring(xml) for xml in sample]
+
+    start = time.perf_counter()
+    features = read_features(placemarks)
+    build_seconds = time.perf_counter() - start
+    geoms = features["geoms"].copy()
+    is_point = features["is_point"]
+    geoms[is_point] = shapely.points(features["xs"][is_point], features["ys"][is_point])
+    has_geom = shapely.is_geometry(geoms)
+    vertices = int(shapely.get_num_coordinates(geoms[has_geom]).sum())
+
+    tree = STRtree([polygon for _, polygon in boundaries])
+    feature_idx, boundary_idx = tree.query(geoms[has_geom])
+    feature_idx = np.flatnonzero(has_geom)[feature_idx]
+    start = time.perf_counter()
+    for b in np.unique(boundary_idx):
+        clip_area(features, boundaries[b][1], feature_idx[boundary_idx == b], tile_vertices=tile_vertices)
+    clip_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    written = sum(len(etree.tostring(placemark)) for placemark in placemarks)
+    write_seconds = time.perf_counter() - start
+
+    return (
+        build_seconds / max(vertices, 1),
+        clip_seconds / max(len(feature_idx), 1),
+        write_seconds / len(placemarks),
+        written / len(placemarks),
+    )
+
+# ฟังก์ชันทำนายเวลาและหน่วยความจำสูงสุดของแต่ละโหมดจากผลสแกน แล้วแนะนำโหมดที่เหมาะสม
+def estimate_clip_job(scan, boundaries, memory_limit_mb=IN_MEMORY_OUTPUT_LIMIT_MB, tile_vertices=0):
+    bboxes = np.frombuffer(scan["bboxes"], dtype=float).reshape(-1, 4)
+    is_point = np.frombuffer(scan["is_point"], dtype=np.int8).astype(bool)
+    polygons = [polygon for _, polygon in boundaries]
+    if len(bboxes) and polygons:
+        feature_idx, _ = STRtree(polygons).query(shapely.box(bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3]))
+    else:
+        feature_idx = np.empty(0, dtype=np.intp)
+    point_pairs = int(np.count_nonzero(is_point[feature_idx]))
+    shape_pairs = len(feature_idx) - point_pairs
+    total_pairs = len(feature_idx) + scan["no_geometry"] * len(boundaries)
+
+    per_vertex, per_pair, per_write, placemark_bytes = calibrate_clip_costs(scan["sample"], boundaries, tile_vertices)
+    read_seconds = scan["seconds"]
+    build_seconds = per_vertex * scan["vertices"]
+    clip_seconds = per_pair * len(feature_idx)
+    write_seconds = per_write * total_pairs
+    output_bytes = placemark_bytes * total_pairs
+
+    features = sum(scan["kinds"].values())
+    feature_memory = features * FEATURE_BYTES + scan["vertices"] * VERTEX_BYTES
+    output_memory = min(output_bytes, memory_limit_mb * 1024 ** 2)
+    workers = max(1, min(os.cpu_count() or 1, len(boundaries)))
+
+    estimate = {
+        "features": features,
+        "kinds": dict(scan["kinds"]),
+        "vertices": scan["vertices"],
+        "input_bytes": scan["bytes"],
+        "extent": (
+            tuple(float(v) for v in (*bboxes[:, :2].min(axis=0), *bboxes[:, 2:].max(axis=0)))
+            if len(bboxes) else None
+        ),
+        "boundaries": len(boundaries),
+        "point_pairs": point_pairs,
+        "shape_pairs": shape_pairs,
+        "output_bytes": output_bytes,
+        "workers": workers,
+        "modes": {
+            "normal": (
+                read_seconds + build_seconds + clip_seconds + write_seconds,
+                BASE_MEMORY_BYTES + scan["bytes"] * TREE_BYTES_PER_INPUT_BYTE + feature_memory
+                + total_pairs * KEPT_PAIR_BYTES + output_memory,
+            ),
+            "parallel": (
+                read_seconds + build_seconds + clip_seconds / workers + write_seconds + 0.5 * workers,
+                # process ลูกได้ tree และ geometry แบบ copy-on-write แต่จะคัดลอกหน้าหน่วยความจำของ geometry ที่ใช้
+                BASE_MEMORY_BYTES + scan["bytes"] * TREE_BYTES_PER_INPUT_BYTE + feature_memory * (workers + 1)
+                + total_pairs * KEPT_PAIR_BYTES + output_memory,
+            ),
+            "streaming": (
+                read_seconds + build_seconds + clip_seconds + 2 * write_seconds,
+                BASE_MEMORY_BYTES + total_pairs * 16 + output_memory,
+            ),
+        },
+    }
+
+    # เลือกโหมดที่เร็วที่สุดที่หน่วยความจำพอ (input ที่ใหญ่เกินขนาดที่กำหนดจะถูกตัดแบบ streaming อยู่แล้ว)
+    available = available_memory_bytes()
+    budget = available * 0.8 if available else float("inf")
+    if scan["bytes"] > memory_limit_mb * 1024 ** 2 or estimate["modes"]["normal"][1] > budget:
+        suggestion = "streaming"
+    elif workers > 1 and estimate["modes"]["parallel"][0] < 0.8 * estimate["modes"]["normal"][0] \
+            and estimate["modes"]["parallel"][1] <= budget:
+        suggestion = "parallel"
+    else:
+        suggestion = "normal"
+    estimate["available_memory"] = available
+    estimate["suggestion"] = suggestion
+    return estimate
+
+PREFLIGHT_MODE_LABELS = {
+    "normal": "ปกติ (process เดียว)",
+    "parallel": "ขนานหลาย process",
+    "streaming": "streaming",
+}
+
+# ฟังก์ชันประเมินงานจากไฟล์ที่อัปโหลด (KML หรือทุก KML ใน ZIP) ก่อนกดเริ่มประมวลผล
+def run_preflight():
+    registered_set = st.session_state.get("boundary_set", BOUNDARY_UPLOAD_OPTION)
+    use_registered = registered_set != BOUNDARY_UPLOAD_OPTION
+    input_file = st.session_state.input_file
+    if not input_file or not (st.session_state.boundary_file or use_registered):
+        st.error("กรุณาเลือกไฟล์ให้ครบถ้วน")
+        return
+
+    boundary_kml = boundary_library_path(registered_set) if use_registered else st.session_state.boundary_file
+    try:
+        with st.spinner("กำลังสแกนไฟล์เพื่อประเมินงาน..."):
+            boundaries = load_boundaries(boundary_kml)
+            if st.session_state.clip_simplify_m > 0:
+                boundaries, _ = simplify_boundaries(
+                    boundaries, st.session_state.clip_simplify_m, st.session_state.clip_use_cache
+                )
+
+            progress_bar = st.progress(0)
+            scan = new_preflight_scan()
+            if input_file.name.endswith(".zip"):
+                with zipfile.ZipFile(io.BytesIO(input_file.getvalue()), 'r') as zipf:
+                    for member in list_zip_kml_members(input_file.getvalue()):
+                        with zipf.open(member) as f:
+                            scan_kml_stream(f, zipf.getinfo(member).file_size, scan, progress_bar.progress)
+            else:
+                input_file.seek(0)
+                scan_kml_stream(input_file, input_file.size, scan, progress_bar.progress)
+            progress_bar.empty()
+
+            st.session_state.preflight = estimate_clip_job(
+                scan, boundaries, st.session_state.clip_memory_limit_mb, st.session_state.clip_tile_vertices
+            )
+    except Exception as e:
+        st.error(f"ไม่สามารถประเมินงานได้: {e}")
+
+# ฟังก์ชันปรับตัวเลือกขั้นสูงตามโหมดที่ preflight แนะนำ
+def apply_preflight_suggestion():
+    estimate = st.session_state.preflight
+    st.session_state.clip_streaming = estimate["suggestion"] == "streaming"
+    st.session_state.clip_workers = estimate["workers"] if estimate["suggestion"] == "parallel" else 1
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} วินาที"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} นาที"
+    return f"{seconds / 3600:.1f} ชั่วโมง"
+
+# ฟังก์ชันแสดงผลการประเมินงาน
+def show_preflight(estimate):
+    with st.expander("🔍 ผลการประเมินงานก่อนเริ่มตัด", expanded=True):
+        kinds = estimate["kinds"]
+        st.write(
+            f"- Placemark ทั้งหมด {estimate['features']:,} รายการ: Point {kinds['point']:,}, "
+            f"LineString {kinds['line']:,}, Polygon {kinds['polygon']:,}, MultiGeometry {kinds['multi']:,}, "
+            f"ไม่มี geometry {kinds[None]:,}"
+        )
+        st.write(f"- จุดยอดรวม {estimate['vertices']:,} จุด, ขนาดไฟล์ {estimate['input_bytes'] / 1024 ** 2:,.1f} MB")
+        if estimate["extent"]:
+            st.write("- ขอบเขตข้อมูล (lon/lat): " + ", ".join(f"{v:.5f}" for v in estimate["extent"]))
+        st.write(
+            f"- คู่ feature/ขอบเขตที่ bounding box ซ้อนทับ: เส้น/พื้นที่ {estimate['shape_pairs']:,} คู่, "
+            f"Point {estimate['point_pairs']:,} คู่ (ขอบเขต {estimate['boundaries']:,} พื้นที่)"
+        )
+        st.write(f"- ขนาดผลลัพธ์โดยประมาณ {estimate['output_bytes'] / 1024 ** 2:,.1f} MB")
+
+        st.write("**เวลาและหน่วยความจำสูงสุดโดยประมาณ**")
+        for mode, (seconds, memory) in estimate["modes"].items():
+            label = PREFLIGHT_MODE_LABELS[mode]
+            if mode == "parallel":
+                label += f" ({estimate['workers']} process)"
+            marker = " ⬅️ แนะนำ" if mode == estimate["suggestion"] else ""
+            st.write(f"- {label}: {format_duration(seconds)}, หน่วยความจำ {memory / 1024 ** 2:,.0f} MB{marker}")
+        if estimate["available_memory"]:
+            st.caption(f"หน่วยความจำว่างของเครื่องนี้ {estimate['available_memory'] / 1024 ** 2:,.0f} MB")
+
+        st.button("✅ ใช้โหมดที่แนะนำ", on_click=apply_preflight_suggestion, key="apply_preflight_button")
+
+# ฟังก์ชันลงทะเบียนไฟล์ขอบเขตที่อัปโหลดไว้ในคลัง
+def register_uploaded_boundary():
+    set_name = st.session_state.boundary_set_name.strip()
+    if not st.session_state.boundary_file or not set_name:
+        st.error("กรุณาอัปโหลดไฟล์ขอบเขตและตั้งชื่อชุดขอบเขต")
+        return
+    try:
+        _, count = register_boundary_set(set_name, st.session_state.boundary_file.getvalue())
+        st.success(f"ลงทะเบียนชุดขอบเขต '{set_name}' แล้ว ({count} พื้นที่)")
+    except Exception as e:
+        st.error(f"ไม่สามารถลงทะเบียนชุดขอบเขตได้: {e}")
+
+BOUNDARY_UPLOAD_OPTION = "(ใช้ไฟล์ที่อัปโหลด)"
+
+# ฟังก์ชันเริ่มประมวลผล
+def start_processing():
+    registered_set = st.session_state.get("boundary_set", BOUNDARY_UPLOAD_OPTION)
+    use_registered = registered_set != BOUNDARY_UPLOAD_OPTION
+    if st.session_state.input_file and (st.session_state.boundary_file or use_registered):
+        st.session_state.processing = True
+        
+        # Create spinner while processing
+        with st.spinner("กำลังประมวลผลข้อมูล..."):
+            # ไฟล์ที่อัปโหลดอยู่ในหน่วยความจำแล้ว ส่งต่อให้แต่ละขั้นตอนโดยตรง ไม่เขียนลงไฟล์ชั่วคราว
+            input_file = st.session_state.input_file
+            if use_registered:
+                boundary_kml = boundary_library_path(registered_set)
+            else:
+                boundary_kml = st.session_state.boundary_file
+
+            try:
+                input_file_name = input_file.name
+                memory_limit_mb = st.session_state.clip_memory_limit_mb
+                area_output = st.session_state.clip_area_output
+                combined_kml, area_names = None, []
+                # input ที่ใหญ่เกินขนาดที่กำหนดจะใช้โหมด streaming ซึ่งพักผลการตัดไว้บนดิสก์
+                use_streaming = st.session_state.clip_streaming or input_file.size > memory_limit_mb * 1024 ** 2
+
+                # ลดจุดยอดของขอบเขตก่อนตัด (ถ้ากำหนดค่าความคลาดเคลื่อนไว้)
+                boundaries, simplify_report = None, None
+                if st.session_state.clip_simplify_m > 0:
+                    st.info("กำลังลดจุดยอดของขอบเขต...")
+                    boundaries, simplify_report = simplify_boundaries(
+                        load_boundaries(boundary_kml), st.session_state.clip_simplify_m,
+                        st.session_state.clip_use_cache
+                    )
+                clip_start = time.perf_counter()
+
+                if input_file_name.endswith(".zip"):
+                    combined_kml, area_names = process_zip_upload(
+                        input_file.getvalue(), boundary_kml, input_file_name, boundaries
+                    )
+                elif use_streaming:
+                    st.info("เริ่มประมวลผลไฟล์ KML แบบ streaming...")
+                    input_data = input_file.getvalue()
+                    combined_kml, area_names = process_areas_streaming(
+                        [(partial(io.BytesIO, input_data), len(input_data))],
+                        boundary_kml, input_file_name, st.session_state.clip_tile_vertices,
+                        area_output, new_output_buffer(memory_limit_mb), boundaries
+                    )
+                elif area_output != AREA_OUTPUT_MERGED:
+                    st.info("เริ่มประมวลผลไฟล์ KML และเขียนไฟล์แยกตามพื้นที่...")
+                    combined_kml, area_names = process_areas_to_bundle(
+                        input_file, boundary_kml, input_file_name, new_output_buffer(memory_limit_mb),
+                        kmz=area_output == AREA_OUTPUT_KMZ,
+                        workers=st.session_state.clip_workers,
+                        use_cache=st.session_state.clip_use_cache,
+                        tile_vertices=st.session_state.clip_tile_vertices,
+                        boundaries=boundaries
+                    )
+                else:
+                    st.info("เริ่มประมวลผลไฟล์ KML...")
+                    area_outputs = process_areas_with_red(
+                        input_file, boundary_kml,
+                        workers=st.session_state.clip_workers,
+                        use_cache=st.session_state.clip_use_cache,
+                        tile_vertices=st.session_state.clip_tile_vertices,
+                        boundaries=boundaries
+                    )
+                    if area_outputs:
+                        st.info("กำลังรวมไฟล์ KML...")
+                        combined_kml = combine_kml_files(
+                            area_outputs, input_file_name, boundary_kml, new_output_buffer(memory_limit_mb)
+                        )
+                        area_names = [name for _, name in area_outputs]
+
+                if simplify_report:
+                    simplify_report["clip_seconds"] = time.perf_counter() - clip_start
+                st.session_state.simplify_report = simplify_report
+                if st.session_state.clip_use_cache:
+                    evict_clip_cache()
+
+                if combined_kml:
+                    if st.session_state.combined_kml:
+                        st.session_state.combined_kml.close()
+                    st.session_state.combined_kml = combined_kml
+                    if input_file_name.endswith(".zip") and st.session_state.zip_output_mode == ZIP_OUTPUT_PER_MEMBER:
+                        st.session_state.combined_suffix = ".zip"
+                    else:
+                        st.session_state.combined_suffix = AREA_OUTPUT_SUFFIX[area_output]
+                    st.session_state.processed_files = area_names
+                    
+                    st.success(f"ประมวลผลเสร็จสิ้น! ได้ทั้งหมด {len(area_names)} พื้นที่")
+                else:
+                    st.error("ไม่พบข้อมูลที่ตรงกับเงื่อนไข")
+            finally:
+                st.session_state.processing = False
+        
+    else:
+        st.error("กรุณาเลือกไฟล์ให้ครบถ้วน")
+
+# Streamlit UI
+def main():
+    # Header
+    st.markdown("<h1 class='main-header'>🗺️ โปรแกรมตัดพื้นที่จากไฟล์ KML</h1>", unsafe_allow_html=True)
+    st.markdown("<div class='info-box'>โปรแกรมสำหรับตัดพื้นที่จากไฟล์ KML ตามขอบเขตที่กำหนด</div>", unsafe_allow_html=True)
+    
+    # Create tabs
+    tab1, tab2 = st.tabs(["📋 ประมวลผลข้อมูล", "ℹ️ คำแนะนำการใช้งาน"])
+    
+    with tab1:
+        # Upload section
+        st.markdown("<h2 class='sub-header'>อัปโหลดไฟล์</h2>", unsafe_allow_html=True)
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown("<div class='upload-section'>", unsafe_allow_html=True)
+            st.file_uploader(
+                "📁 เลือกไฟล์ KML หรือ ZIP ที่มี KML", 
+                type=['zip', 'kml'],
+                help="กรณีไฟล์ KML มีขนาดใหญ่ให้ทำเป็นไฟล์ ZIP",
+                key="input_file"
+            )
+            st.markdown("</div>", unsafe_allow_html=True)
+            
+        with col2:
+            st.markdown("<div class='upload-section'>", unsafe_allow_html=True)
+            st.file_uploader(
+                "📁 เลือกไฟล์ขอบเขต KML",
+                type=['kml'],
+                help="ไฟล์ KML ที่กำหนดขอบเขตพื้นที่ที่ต้องการตัด",
+                key="boundary_file"
+            )
+            st.selectbox(
+                "📚 หรือเลือกชุดขอบเขตที่ลงทะเบียนไว้",
+                [BOUNDARY_UPLOAD_OPTION] + list_boundary_library(),
+                help="ชุดขอบเขตที่ลงทะเบียนแล้วโหลดได้ทันทีโดยไม่ต้องอัปโหลดและแปลงไฟล์ใหม่",
+                key="boundary_set"
+            )
+            with st.popover("📌 ลงทะเบียนไฟล์ขอบเขตที่อัปโหลด"):
+                st.text_input("ชื่อชุดขอบเขต", key="boundary_set_name")
+                st.button("บันทึกลงคลัง", on_click=register_uploaded_boundary, key="register_boundary_button")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+        with st.expander("⚙️ ตัวเลือกขั้นสูง"):
+            st.number_input(
+                "จำนวน process สำหรับตัดพื้นที่แบบขนาน",
+                min_value=1,
+                max_value=os.cpu_count() or 1,
+                value=1,
+                help="มากกว่า 1 = กระจายการตัดแต่ละขอบเขตไปหลาย CPU (เหมาะกับขอบเขตจำนวนมาก)",
+                key="clip_workers"
+            )
+            st.number_input(
+                "แบ่งขอบเขตที่มีจุดยอดเกินจำนวนนี้เป็นตาราง tile (0 = ไม่แบ่ง)",
+                min_value=0,
+                value=0,
+                step=1000,
+                help="เหมาะกับขอบเขตที่ละเอียดมาก เช่น จังหวัดติดชายฝั่ง เส้นจะถูกตัดกับเฉพาะ tile ที่ทับกันแล้วต่อกลับ",
+                key="clip_tile_vertices"
+            )
+            st.number_input(
+                "ลดจุดยอดของขอบเขตก่อนตัด: ค่าความคลาดเคลื่อน (เมตร, 0 = ไม่ลด)",
+                min_value=0.0,
+                value=0.0,
+                step=1.0,
+                help="ขอบเขตจาก GIS มักมีจุดละเอียดเกินความแม่นยำของเส้นทาง การลดจุดช่วยให้ตัดเร็วขึ้น "
+                     "โดยคงรอยต่อระหว่างพื้นที่ข้างเคียงไว้ (ไม่เกิดช่องว่างหรือซ้อนทับ)",
+                key="clip_simplify_m"
+            )
+            st.checkbox(
+                "โหมด streaming สำหรับไฟล์ขนาดใหญ่มาก",
+                value=False,
+                help="อ่านและเขียนไฟล์ทีละ Placemark ใช้หน่วยความจำคงที่ไม่ขึ้นกับขนาดไฟล์ (ไม่ใช้จำนวน process ด้านบน)",
+                key="clip_streaming"
+            )
+            st.number_input(
+                "ขนาดข้อมูลสูงสุดที่ประมวลผลในหน่วยความจำ (MB)",
+                min_value=16,
+                value=IN_MEMORY_OUTPUT_LIMIT_MB,
+                step=64,
+                help="ไฟล์ input ที่ใหญ่กว่านี้จะใช้โหมด streaming อัตโนมัติ และไฟล์ผลลัพธ์ที่ใหญ่กว่านี้จะถูกย้ายไปพักบนดิสก์",
+                key="clip_memory_limit_mb"
+            )
+            st.checkbox(
+                "ใช้ cache ผลการตัด (คำนวณใหม่เฉพาะขอบเขตที่เปลี่ยน)",
+                value=False,
+                help="เก็บผลการตัดรายพื้นที่และขอบเขตที่ลดจุดแล้วไว้บนดิสก์ รันซ้ำด้วยไฟล์เดิมจะคำนวณเฉพาะขอบเขตที่ geometry เปลี่ยน "
+                     "(ใช้กับไฟล์ KML เดี่ยวแบบปกติ) cache อยู่ในโฟลเดอร์ชั่วคราวของ server ที่ผู้ใช้ทุกคนของ server อ่านได้",
+                key="clip_use_cache"
+            )
+            st.caption(
+                f"cache: {CLIP_CACHE_DIR} ใช้อยู่ {clip_cache_size() / 1024 ** 2:,.1f} MB "
+                f"(สูงสุด {CLIP_CACHE_MAX_BYTES / 1024 ** 3:g} GB ลบผลที่ไม่ได้ใช้นานที่สุดออกก่อน)"
+            )
+            st.radio(
+                "รูปแบบไฟล์ผลลัพธ์",
+                [AREA_OUTPUT_MERGED, AREA_OUTPUT_ZIP, AREA_OUTPUT_KMZ],
+                help="แยกไฟล์ตามพื้นที่: ได้ไฟล์ KML หนึ่งไฟล์ต่อพื้นที่ใน ZIP/KMZ ไม่ต้องเปิดไฟล์รวมขนาดใหญ่เพื่อแยกเอง "
+                     "(การตัดใช้หลาย process ได้ แต่การเขียนแต่ละพื้นที่ลง ZIP/KMZ ทำทีละพื้นที่ใน process หลัก)",
+                key="clip_area_output"
+            )
+            st.radio(
+                "ผลลัพธ์เมื่ออัปโหลดไฟล์ ZIP",
+                [ZIP_OUTPUT_MERGED, ZIP_OUTPUT_PER_MEMBER],
+                help="ทุกไฟล์ KML ใน ZIP จะถูกตัดพร้อมกัน แล้วรวมเป็นไฟล์เดียวหรือแยกไฟล์ตามต้นทาง (แยกตามต้นทางจะไม่ใช้รูปแบบแยกตามพื้นที่)",
+                key="zip_output_mode"
+            )
+        
+        # Process button
+        if st.session_state.processing:
+            st.button("⏳ กำลังประมวลผล...", disabled=True)
+        else:
+            col_run, col_preflight = st.columns(2)
+            with col_run:
+                st.button("🚀 เริ่มประมวลผล", on_click=start_processing, key="process_button")
+            with col_preflight:
+                st.button(
+                    "🔍 ประเมินเวลาและหน่วยความจำก่อนเริ่ม",
+                    on_click=run_preflight,
+                    help="สแกนไฟล์แบบรวดเร็วเพื่อทำนายเวลาและหน่วยความจำ และแนะนำโหมดที่เหมาะสม",
+                    key="preflight_button"
+                )
+        if st.session_state.preflight:
+            show_preflight(st.session_state.preflight)
+        
+        # Show results
+        if st.session_state.combined_kml:
+            st.markdown("<div class='success-message'>✅ ประมวลผลเสร็จสิ้น</div>", unsafe_allow_html=True)
+            
+            # Show processed areas
+            if st.session_state.processed_files:
+                with st.expander("📋 พื้นที่ที่ประมวลผล"):
+                    for i, area in enumerate(st.session_state.processed_files):
+                        st.write(f"{i+1}. {area}")
+
+            if st.session_state.clip_stats:
+                show_clip_stats(st.session_state.clip_stats)
+            if st.session_state.simplify_report:
+                show_simplify_report(st.session_state.simplify_report)
+            
+            # Download button
+            # ผลลัพธ์อยู่ในหน่วยความจำ (หรือไฟล์ชั่วคราวถ้าเกินขนาดที่กำหนด) อ่านเฉพาะตอนกดดาวน์โหลด
+            # ไม่ใช่ทุกครั้งที่หน้ารันใหม่
+            def read_combined_kml(combined_kml=st.session_state.combined_kml):
+                combined_kml.seek(0)
+                return combined_kml.read()
+
+            input_file_name = os.path.splitext(st.session_state.input_file.name)[0]
+            if st.session_state.combined_suffix == ".zip":
+                download_label = "🔗 ดาวน์โหลดไฟล์ ZIP ผลลัพธ์แยกไฟล์"
+                combined_file_name = f"{input_file_name}_combined.zip"
+                mime = "application/zip"
+            elif st.session_state.combined_suffix == ".kmz":
+                download_label = "🔗 ดาวน์โหลดไฟล์ KMZ แยกตามพื้นที่"
+                combined_file_name = f"{input_file_name}_areas.kmz"
+                mime = "application/vnd.google-earth.kmz"
+            else:
+                download_label = "🔗 ดาวน์โหลดไฟล์ KML รวม"
+                combined_file_name = f"{input_file_name}_combined.kml"
+                mime = "application/vnd.google-earth.kml+xml"
+            
+            st.download_button(
+                label=download_label,
+                data=read_combined_kml,
+                file_name=combined_file_name,
+                mime=mime,
+                key="download_button"
+            )
+    
+    with tab2:
+        st.markdown("""
+        ## 📌 คำแนะนำการใช้งาน
+        
+        ### วิธีการใช้งาน
+        1. อัปโหลดไฟล์ KML ที่ต้องการตัดพื้นที่ (หรือไฟล์ ZIP ที่มี KML อยู่ภายใน)
+            - กรณีที่ไฟล์ KML มีขนาดใหญ่ ให้บีบอัดเป็นไฟล์ ZIP ก่อนอัปโหลด
+            - โปรแกรมจะตัดทุกไฟล์ KML ในไฟล์ ZIP พร้อมกัน แล้วรวมเป็นไฟล์เดียวหรือแยกเป็น ZIP ตามไฟล์ต้นทาง
+        
+        2. อัปโหลดไฟล์ขอบเขต KML
+            - ไฟล์นี้จะกำหนดขอบเขตพื้นที่ที่ต้องการตัด
+            - สามารถมีหลายพื้นที่ (Placemark) ในไฟล์เดียวกัน
+        
+        3. กดปุ่ม "เริ่มประมวลผล" เพื่อดำเนินการ
+            - โปรแกรมจะตัดพื้นที่ตามขอบเขตที่กำหนด
+            - ผลลัพธ์จะถูกรวมเป็นไฟล์ KML เดียว โดยแบ่งตามพื้นที่
+            - หรือเลือก "แยกไฟล์ตามพื้นที่" ใน ⚙️ ตัวเลือกขั้นสูง เพื่อได้ ZIP/KMZ ที่มีไฟล์ KML หนึ่งไฟล์ต่อพื้นที่
+        
+        4. ดาวน์โหลดไฟล์ KML ผลลัพธ์
+        
+        ### หมายเหตุ
+        - พื้นที่ที่อยู่นอกขอบเขตจะถูกตัดออก
+        - ชื่อของแต่ละพื้นที่จะถูกนำมาจากชื่อ Placemark ในไฟล์ขอบเขต
+        - ไฟล์ผลลัพธ์สามารถเปิดด้วย Google Earth หรือโปรแกรมอื่นๆ ที่รองรับไฟล์ KML
+        """)
+
+if __name__ == "__main__":
+    main()
@@ -2,22 +2,14 @@ import os
 import re
 import pandas as pd
 import simplekml
+import numpy as np
+from lxml import etree
 import streamlit as st
 from io import BytesIO
 import tempfile  # ✅ ใช้โฟลเดอร์ชั่วคราว
 from datetime import datetime
 import xml.etree.ElementTree as ET
-
-# ฟังก์ชันดึงค่าพิกัดจากข้อความโดยใช้ Regex
-def parse_coordinates(coord_str):
-    try:
-        matches = re.findall(r"[-+]?\d*\.\d+|[-+]?\d+", coord_str)
-        if len(matches) != 2:
-            raise ValueError("Invalid coordinate format")
-        lat, lon = map(float, matches)
-        return lon, lat
-    except Exception:
-        return None
+from excel_coordinates import parse_coordinates, parse_coordinate_column, coordinate_rejects
 
 # ฟังก์ชันดึงพิกัดจากข้อความที่มีหลายพิกัด
 def parse_multiple_coordinates(coord_str):
@@ -35,8 +27,117 @@ def filter_by_projects(data, selected_projects):
         return data[data['ชื่อโปรเจค'].isin(selected_projects)]
     return data  # ถ้าไม่เลือกโครงการใดๆ ให้คืนค่าข้อมูลทั้งหมด
 
+# ฟังก์ชันสร้าง KML ด้วย simplekml (ตัวเขียนเดิม) แล้วบันทึกลงไฟล์
+def save_simplekml(data, temp_file_path):
+    # ✅ สร้างไฟล์ KML
+    kml = simplekml.Kml()
+
+    # ✅ สร้างโฟลเดอร์หลัก
+    main_folder = kml.newfolder(name="ข้อมูลทั้งหมด")
+
+    # ✅ จัดกลุ่มข้อมูลตาม ID และสร้างโฟลเดอร์แยก
+    for device_id, group in data.groupby('id'):
+        folder = main_folder.newfolder(name=f"ID: {device_id}")  # ✅ สร้างโฟลเดอร์แยกตาม ID
+        coords = group.sort_values('ลำดับพิกัด')['พิกัด'].tolist()
+
+        # ✅ สร้างเส้น (LineString) ในโฟลเดอร์ของแต่ละ ID
+        linestring = folder.newlinestring(name=f"{group['ชื่อชุมสาย'].iloc[0]} {device_id}")
+        linestring.coords = coords
+        linestring.style.linestyle.color = simplekml.Color.blue
+        linestring.style.linestyle.width = 3
+
+        # ✅ ดึงข้อมูลทั้งหมดเป็น description
+        description = "\n".join([f"{col}: {group[col].iloc[0]}" for col in data.columns if col != 'พิกัด'])
+        linestring.description = description
+
+        # ✅ เพิ่มจุด (Point) สำหรับแต่ละพิกัดในโฟลเดอร์ของ ID นั้น
+        for _, row in group.iterrows():
+            point = folder.newpoint(name=f"จุดที่ {row['ลำดับพิกัด']}", coords=[row['พิกัด']])
+            point.description = "\n".join([f"{col}: {row[col]}" for col in data.columns if col != 'พิกัด'])
+            point.style.iconstyle.color = simplekml.Color.red
+
+    kml.save(temp_file_path)
+
+# ตัวเขียน KML ที่เลือกได้
+KML_ENGINE_STREAM = "เขียนตรงแบบสตรีม (เร็ว ใช้หน่วยความจำน้อย)"
+KML_ENGINE_SIMPLEKML = "simplekml (แบบเดิม)"
+
+# Namespace และ tag ของ KML สำหรับตัวเขียนแบบสตรีม
+KML_NS = "http://www.opengis.net/kml/2.2"
+KML_TAG = {
+    name: f"{{{KML_NS}}}{name}"
+    for name in [
+        "kml", "Document", "Folder", "Placemark", "name", "description", "styleUrl",
+        "Style", "LineStyle", "IconStyle", "Icon", "href", "color", "width",
+        "LineString", "Point", "coordinates",
+    ]
+}
+POINT_ICON = "http://maps.google.com/mapfiles/kml/pushpin/ylw-pushpin.png"
+
+# ฟังก์ชันเขียน element ที่มีแต่ข้อความลงสตรีม
+def write_text_element(xf, tag, text):
+    with xf.element(KML_TAG[tag]):
+        xf.write(text)
+
+# ฟังก์ชันเขียนสไตล์กลางของเส้นและหมุด (แทนสไตล์แยกของทุก Placemark แบบ simplekml)
+def write_kml_styles(xf):
+    with xf.element(KML_TAG["Style"], id="line"), xf.element(KML_TAG["LineStyle"]):
+        write_text_element(xf, "color", simplekml.Color.blue)
+        write_text_element(xf, "width", "3")
+    with xf.element(KML_TAG["Style"], id="point"), xf.element(KML_TAG["IconStyle"]):
+        write_text_element(xf, "color", simplekml.Color.red)
+        with xf.element(KML_TAG["Icon"]):
+            write_text_element(xf, "href", POINT_ICON)
+
+# ฟังก์ชันเขียน Placemark หนึ่งรายการ (geometry คือ "LineString" หรือ "Point")
+def write_placemark(xf, name, description, style, geometry, coordinates):
+    with xf.element(KML_TAG["Placemark"]):
+        write_text_element(xf, "name", name)
+        write_text_element(xf, "description", description)
+        write_text_element(xf, "styleUrl", style)
+        with xf.element(KML_TAG[geometry]):
+            write_text_element(xf, "coordinates", coordinates)
+
+# ฟังก์ชันเขียน KML จาก DataFrame ที่แปลงพิกัดแล้วลง output (ไฟล์หรือ BytesIO) ทีละ Placemark
+# โครงสร้างโฟลเดอร์และชื่อเหมือน save_simplekml แต่ไม่สร้าง object ของทั้งไฟล์ไว้ในหน่วยความจำ
+def write_kml_stream(data, output, include_points=True):
+    # เตรียมข้อความของทุกแถวครั้งเดียวแทนการ iterrows ทีละกลุ่ม
+    columns = [col for col in data.columns if col != 'พิกัด']
+    descriptions = [
+        "\n".join(f"{col}: {value}" for col, value in zip(columns, row))
+        for row in zip(*(data[col].tolist() for col in columns))
+    ]
+    coordinates = [f"{lon},{lat},0.0" for lon, lat in data['พิกัด']]
+    sequence = data['ลำดับพิกัด'].to_numpy()
+    point_names = [f"จุดที่ {value}" for value in data['ลำดับพิกัด'].tolist()]
+    exchange_names = data['ชื่อชุมสาย'].tolist()
+
+    with etree.xmlfile(output, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(KML_TAG["kml"], nsmap={None: KML_NS}), xf.element(KML_TAG["Document"]):
+            write_kml_styles(xf)
+            with xf.element(KML_TAG["Folder"]):
+                write_text_element(xf, "name", "ข้อมูลทั้งหมด")
+
+                # จัดกลุ่มตาม ID (positions เรียงตามลำดับแถวเดิมในแต่ละกลุ่ม)
+                for device_id, positions in data.groupby('id').indices.items():
+                    with xf.element(KML_TAG["Folder"]):
+                        write_text_element(xf, "name", f"ID: {device_id}")
+
+                        # เส้นเรียงจุดตามลำดับพิกัด
+                        line_positions = positions[np.argsort(sequence[positions], kind="stable")]
+                        first = positions[0]
+                        write_placemark(
+                            xf, f"{exchange_names[first]} {device_id}", descriptions[first], "#line",
+                            "LineString", " ".join(coordinates[i] for i in line_positions),
+                        )
+
+                        if include_points:
+                            for i in positions:
+                                write_placemark(xf, point_names[i], descriptions[i], "#point", "Point", coordinates[i])
+
 # แก้ไขฟังก์ชัน convert_excel_to_kml เพื่อรองรับการกรองโครงการ
-def convert_excel_to_kml(uploaded_file, sheet_name, selected_projects=None):
+def convert_excel_to_kml(uploaded_file, sheet_name, selected_projects=None, engine=KML_ENGINE_STREAM, include_points=True):
     try:
         status_text.text("📌 กำลังประมวลผล...")
 
@@ -53,38 +154,14 @@ def convert_excel_to_kml(uploaded_file, sheet_name, selected_projects=None):
             # ตรวจสอบว่ามีข้อมูลหลังจากกรองหรือไม่
             if data.empty:
                 status_text.text("❌ ไม่พบข้อมูลสำหรับโครงการที่เลือก!")
-                return None, None, None
-
-        # แปลงค่าพิกัด
-        data['พิกัด'] = data['พิกัด'].apply(lambda x: parse_coordinates(str(x)) if pd.notna(x) else None)
-        data = data.dropna(subset=['พิกัด'])
-
-        # ✅ สร้างไฟล์ KML
-        kml = simplekml.Kml()
-
-        # ✅ สร้างโฟลเดอร์หลัก
-        main_folder = kml.newfolder(name="ข้อมูลทั้งหมด")
-
-        # ✅ จัดกลุ่มข้อมูลตาม ID และสร้างโฟลเดอร์แยก
-        for device_id, group in data.groupby('id'):
-            folder = main_folder.newfolder(name=f"ID: {device_id}")  # ✅ สร้างโฟลเดอร์แยกตาม ID
-            coords = group.sort_values('ลำดับพิกัด')['พิกัด'].tolist()
-
-            # ✅ สร้างเส้น (LineString) ในโฟลเดอร์ของแต่ละ ID
-            linestring = folder.newlinestring(name=f"{group['ชื่อชุมสาย'].iloc[0]} {device_id}")
-            linestring.coords = coords
-            linestring.style.linestyle.color = simplekml.Color.blue
-            linestring.style.linestyle.width = 3
+                return None, None, None, None
 
-            # ✅ ดึงข้อมูลทั้งหมดเป็น description
-            description = "\n".join([f"{col}: {group[col].iloc[0]}" for col in data.columns if col != 'พิกัด'])
-            linestring.description = description
-
-            # ✅ เพิ่มจุด (Point) สำหรับแต่ละพิกัดในโฟลเดอร์ของ ID นั้น
-            for _, row in group.iterrows():
-                point = folder.newpoint(name=f"จุดที่ {row['ลำดับพิกัด']}", coords=[row['พิกัด']])
-                point.description = "\n".join([f"{col}: {row[col]}" for col in data.columns if col != 'พิกัด'])
-                point.style.iconstyle.color = simplekml.Color.red
+        # แปลงค่าพิกัด แถวที่แปลงไม่ได้เก็บไว้ในรายงานแทนการทิ้งไปเงียบๆ
+        parsed = parse_coordinate_column(data['พิกัด'])
+        rejects = coordinate_rejects(data, parsed)
+        valid = parsed['lat'].notna()
+        data = data[valid].copy()
+        data['พิกัด'] = list(zip(parsed.loc[valid, 'lon'].tolist(), parsed.loc[valid, 'lat'].tolist()))
 
         # ✅ ใช้โฟลเดอร์ชั่วคราวแทน `/tmp/`
         temp_dir = tempfile.gettempdir()
@@ -99,23 +176,30 @@ def convert_excel_to_kml(uploaded_file, sheet_name, selected_projects=None):
                 output_filename += "_selected_projects"
             output_filename += ".kml"
             
-        temp_file_path = os.path.join(temp_dir, output_filename)
+        if engine == KML_ENGINE_STREAM:
+            # ✅ เขียน KML ตรงลง BytesIO ไม่ผ่านไฟล์ชั่วคราว (ข้ามหมุดได้ตั้งแต่ตอนเขียน)
+            temp_file_path = None
+            kml_bytes = BytesIO()
+            write_kml_stream(data, kml_bytes, include_points)
+            kml_bytes.seek(0)
+        else:
+            temp_file_path = os.path.join(temp_dir, output_filename)
 
-        # ✅ บันทึกไฟล์ KML ลงโฟลเดอร์ชั่วคราว
-        kml.save(temp_file_path)
+            # ✅ บันทึกไฟล์ KML ลงโฟลเดอร์ชั่วคราว
+            save_simplekml(data, temp_file_path)
 
-        # ✅ โหลดไฟล์ KML กลับเป็น BytesIO
-        with open(temp_file_path, "rb") as f:
-            kml_bytes = BytesIO(f.read())
+            # ✅ โหลดไฟล์ KML กลับเป็น BytesIO
+            with open(temp_file_path, "rb") as f:
+                kml_bytes = BytesIO(f.read())
 
         status_text.text("✅ ประมวลผลเสร็จสิ้น!")
 
-        return temp_file_path, output_filename, kml_bytes
+        return temp_file_path, output_filename, kml_bytes, rejects
 
     except Exception as e:
         status_text.text("❌ เกิดข้อผิดพลาด!")
         st.error(f"เกิดข้อผิดพลาด: {e}")
-        return None, None, None
+        return None, None, None, None
 
 # ฟังก์ชันแปลงพิกัดที่ตกหล่นเป็น KML
 def convert_missing_coords_to_kml(additional_coords_str, status_text, description_dict=None):
@@ -223,16 +307,19 @@ if uploaded_file is not None:
         # 🔹 ปุ่มเริ่มแปลงไฟล์
         status_text = st.empty()
         remove_points = st.checkbox("❌ ลบหมุด (Point)")
+        kml_engine = st.radio("⚙️ ตัวเขียน KML", [KML_ENGINE_STREAM, KML_ENGINE_SIMPLEKML], horizontal=True)
 
         if st.button("🚀 เริ่มแปลงเป็น KML"):
             # ส่งพารามิเตอร์ selected_projects ไปยังฟังก์ชัน convert_excel_to_kml
-            temp_file_path, output_filename, kml_bytes = convert_excel_to_kml(uploaded_file, sheet_name, selected_projects)
+            temp_file_path, output_filename, kml_bytes, rejects = convert_excel_to_kml(
+                uploaded_file, sheet_name, selected_projects, kml_engine, include_points=not remove_points
+            )
 
             if kml_bytes:
                 st.success("✅ แปลงไฟล์ KML สำเร็จ!")
 
-                # 🔹 ลบหมุดจาก KML ถ้าผู้ใช้เลือก
-                if remove_points:
+                # 🔹 ลบหมุดจาก KML ถ้าผู้ใช้เลือก (ตัวเขียนแบบสตรีมข้ามหมุดไปแล้วตั้งแต่ตอนเขียน)
+                if remove_points and temp_file_path:
                     try:
                         tree = ET.parse(temp_file_path)
                         root = tree.getroot()
@@ -254,6 +341,9 @@ if uploaded_file is not None:
                     except Exception as e:
                         st.error(f"❌ เกิดข้อผิดพลาดในการลบหมุด: {e}")
                         st.exception(e)
+                elif remove_points:
+                    # ตัวเขียนแบบสตรีมไม่ได้เขียนหมุดลงไฟล์ตั้งแต่แรก แจ้งผลเหมือนตัวเขียนเดิม
+                    st.success("✔ ลบหมุดสำเร็จ!")
 
                 # 🔹 ให้ผู้ใช้ดาวน์โหลดไฟล์ KML
                 st.download_button(
@@ -263,6 +353,17 @@ if uploaded_file is not None:
                     mime="application/vnd.google-earth.kml+xml"
                 )
 
+                # 🔹 รายงานแถวที่แปลงพิกัดไม่ได้ (ไม่ถูกใส่ใน KML)
+                if not rejects.empty:
+                    st.warning(f"⚠️ มี {len(rejects):,} แถวที่แปลงพิกัดไม่ได้ และไม่ได้ถูกใส่ในไฟล์ KML")
+                    st.dataframe(rejects, use_container_width=True)
+                    st.download_button(
+                        label="📥 ดาวน์โหลดรายงานแถวที่แปลงพิกัดไม่ได้ (CSV)",
+                        data=rejects.to_csv(index=False).encode("utf-8-sig"),
+                        file_name=f"{os.path.splitext(output_filename)[0]}_rejects.csv",
+                        mime="text/csv"
+                    )
+
     except Exception as e:
         st.error(f"❌ ไม่สามารถโหลดไฟล์: {e}")
 
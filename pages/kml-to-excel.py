@@ -1,11 +1,8 @@
 import os
-import io
-import openpyxl
+import threading
+import time
+import pandas as pd
 import streamlit as st
-from lxml import etree
-from shapely.geometry import LineString
-from bs4 import BeautifulSoup
-import traceback
 
 # -------------------------------------
 # 🌟 ตกแต่ง UI ด้วย CSS & Bootstrap
@@ -73,230 +70,91 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
+from kml_to_excel_convert import (
+    EXPORT_FORMATS, MULTI_TABLE_FORMATS, OUTPUT_SEPARATE, OUTPUT_SHEETS, OUTPUT_ZIP, DEDUP_OFF, DEDUP_DROP, DEDUP_FLAG,
+    unique_name, new_conversion_job, run_conversion_job
+)
+
 # -------------------------------------
-# 🚀 ฟังก์ชันประมวลผล
+# ⏳ งานแปลงเบื้องหลังพร้อมตัวอย่างข้อมูล
 # -------------------------------------
-def extract_description_data(description_html):
-    """
-    Extract structured data from the HTML description.
-    
-    Args:
-        description_html (str): HTML content from KML description
-        
-    Returns:
-        dict: Dictionary containing extracted data
-    """
-    try:
-        soup = BeautifulSoup(description_html, 'html.parser')
-        extracted_data = {}
-        rows = soup.find_all('tr')
-        
-        for row in rows:
-            cells = row.find_all('td')
-            if len(cells) >= 2:
-                header = cells[0].get_text(strip=True)  
-                value = cells[1].get_text(strip=True)  
-                extracted_data[header] = value
-                
-        return extracted_data
-    except Exception as e:
-        st.warning(f"ไม่สามารถแยกข้อมูลจาก HTML description ได้: {str(e)}")
-        return {}
+def start_conversion_job(files, output_mode, workers, export_format, dedup_mode):
+    job = new_conversion_job(files)
+    st.session_state.conversion_job = job
+    threading.Thread(
+        target=run_conversion_job,
+        args=(job, files, output_mode, workers, export_format, dedup_mode),
+        daemon=True,
+    ).start()
 
-def parse_coordinates(coords_text):
-    """
-    Parse coordinate text into list of coordinate tuples.
-    
-    Args:
-        coords_text (str): Text containing coordinates
-        
-    Returns:
-        list: List of coordinate tuples [(lon, lat), ...]
-    """
-    coords = []
-    try:
-        for c in coords_text.split():
-            parts = c.split(',')
-            if len(parts) >= 2:
-                coords.append((float(parts[0]), float(parts[1])))
-            else:
-                st.warning(f"ข้อมูลพิกัดไม่ถูกต้อง: {c}")
-    except ValueError as e:
-        st.warning(f"ไม่สามารถแปลงพิกัดเป็นตัวเลขได้: {str(e)}")
-    
-    return coords
+def show_conversion_job(job, polling):
+    """Render a conversion job; runs as a fragment that re-renders itself while the job is running."""
+    if polling and not job["running"]:
+        # งานเสร็จแล้ว ให้ทั้งหน้ารันใหม่เพื่อหยุดการรีเฟรชและแสดงปุ่มดาวน์โหลด
+        st.rerun()
 
-def load_kml_lines(uploaded_file):
-    """
-    Load lines from a KML file and return them as Shapely LineString objects with metadata.
-    
-    Args:
-        uploaded_file: Streamlit uploaded file object
-        
-    Returns:
-        list: List of dictionaries containing line data
-    """
-    lines = []
-    
-    try:
-        kml_data = etree.fromstring(uploaded_file.getvalue())
-        ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-        
-        # ตรวจสอบความถูกต้องของไฟล์ KML
-        if kml_data.tag != '{http://www.opengis.net/kml/2.2}kml':
-            st.error(f"ไฟล์ {uploaded_file.name} ไม่ใช่ไฟล์ KML ที่ถูกต้อง")
-            return []
-        
-        for placemark in kml_data.xpath('.//kml:Placemark', namespaces=ns):
-            try:
-                line_string = placemark.xpath('.//kml:LineString/kml:coordinates', namespaces=ns)
-                
-                if line_string and line_string[0].text:
-                    coords_text = line_string[0].text.strip()
-                    coords = parse_coordinates(coords_text)
-                    
-                    if len(coords) > 1:
-                        line_geom = LineString(coords)
-                        
-                        # ดึงชื่อของ Placemark
-                        name_elements = placemark.xpath('./kml:name/text()', namespaces=ns)
-                        name = name_elements[0] if name_elements else "Unnamed"
-                        
-                        # ดึงคำอธิบายของ Placemark
-                        description_elements = placemark.xpath('./kml:description/text()', namespaces=ns)
-                        description_data = {}
-                        
-                        if description_elements:
-                            try:
-                                description_data = extract_description_data(description_elements[0])
-                            except Exception as e:
-                                st.warning(f"ไม่สามารถแยกข้อมูลจากคำอธิบายของ '{name}' ได้: {str(e)}")
-                        
-                        lines.append({
-                            "Name": name,
-                            "Description": description_data,
-                            "Line": line_geom,
-                            "Start_Coordinate": coords[0] if coords else None,
-                            "End_Coordinate": coords[-1] if coords else None
-                        })
-                    else:
-                        st.warning(f"ไม่มีพิกัดเพียงพอสำหรับการสร้าง LineString: {placemark.xpath('./kml:name/text()', namespaces=ns)[0] if placemark.xpath('./kml:name/text()', namespaces=ns) else 'Unnamed'}")
-                else:
-                    # ข้ามข้อมูลที่ไม่มี LineString
-                    pass
-                    
-            except Exception as e:
-                name = placemark.xpath('./kml:name/text()', namespaces=ns)
-                name = name[0] if name else "Unnamed"
-                st.warning(f"เกิดข้อผิดพลาดในการประมวลผล Placemark '{name}': {str(e)}")
-    
-    except Exception as e:
-        st.error(f"ไม่สามารถโหลดไฟล์ KML ได้: {str(e)}")
-        st.error(traceback.format_exc())
-    
-    return lines
+    total_files = len(job["file_names"])
+    lines_read = sum(job["counters"])
+    elapsed = (job["finished"] or time.time()) - job["started"]
+    if job["running"]:
+        label = f"⏳ กำลังประมวลผล... {job['done']}/{total_files} ไฟล์, อ่านแล้ว {lines_read:,} เส้น ({elapsed:.0f} วินาที)"
+    else:
+        label = f"✅ เสร็จสิ้น! {total_files} ไฟล์, {lines_read:,} เส้น ใน {elapsed:.1f} วินาที"
 
-def save_to_excel_memory(lines):
-    """
-    Save line data to Excel in memory.
-    
-    Args:
-        lines (list): List of line dictionaries
-        
-    Returns:
-        BytesIO: Excel file in memory
-    """
-    try:
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "KML Data"
-        
-        # กรณีไม่มีข้อมูลเลย
-        if not lines:
-            sheet.append(['ไม่พบข้อมูลเส้นที่ถูกต้อง'])
-            output = io.BytesIO()
-            workbook.save(output)
-            output.seek(0)
-            return output
-        
-        # สร้างส่วนหัวของตาราง
-        headers = ['Name', 'Start_Coordinate', 'End_Coordinate']
-        
-        # เพิ่มส่วนหัวจากข้อมูล Description ของเส้นแรก
-        description_headers = []
-        for line in lines:
-            if isinstance(line.get('Description'), dict) and line['Description']:
-                description_headers = list(line['Description'].keys())
-                break
-        
-        headers.extend(description_headers)
-        sheet.append(headers)
-        
-        # เพิ่มข้อมูลแต่ละแถว
-        for line in lines:
-            row = [
-                line.get("Name", "N/A"),
-                f"{line['Start_Coordinate'][0]},{line['Start_Coordinate'][1]}" if line.get("Start_Coordinate") else "N/A",
-                f"{line['End_Coordinate'][0]},{line['End_Coordinate'][1]}" if line.get("End_Coordinate") else "N/A"
-            ]
-            
-            # เพิ่มข้อมูล Description
-            if isinstance(line.get('Description'), dict):
-                for header in description_headers:
-                    row.append(line['Description'].get(header, "N/A"))
-            else:
-                # เพิ่มช่องว่างสำหรับคอลัมน์ Description ที่ไม่มีข้อมูล
-                for _ in description_headers:
-                    row.append("N/A")
-            
-            sheet.append(row)
-        
-        # ปรับความกว้างของคอลัมน์ให้เหมาะสม
-        for column in sheet.columns:
-            max_length = 0
-            column_letter = openpyxl.utils.get_column_letter(column[0].column)
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2) if max_length < 50 else 50
-            sheet.column_dimensions[column_letter].width = adjusted_width
-        
-        output = io.BytesIO()
-        workbook.save(output)
-        output.seek(0)
-        return output
-        
-    except Exception as e:
-        st.error(f"เกิดข้อผิดพลาดในการสร้างไฟล์ Excel: {str(e)}")
-        st.error(traceback.format_exc())
-        # สร้างไฟล์ Excel ว่างเพื่อไม่ให้โปรแกรมล่ม
-        empty_workbook = openpyxl.Workbook()
-        empty_sheet = empty_workbook.active
-        empty_sheet.append(['เกิดข้อผิดพลาดในการสร้างไฟล์ Excel'])
-        empty_output = io.BytesIO()
-        empty_workbook.save(empty_output)
-        empty_output.seek(0)
-        return empty_output
+    with st.status(label, expanded=True, state="running" if job["running"] else "complete"):
+        st.progress(job["done"] / total_files)
+        for index, file_name in enumerate(job["file_names"]):
+            st.caption(f"{file_name}: อ่านแล้ว {job['counters'][index]:,} เส้น")
+
+        if job["preview"] and len(job["preview"]) > 1:
+            st.write(f"ตัวอย่าง {len(job['preview']) - 1} แถวแรกของ {job['file_names'][0]}")
+            used = set()
+            st.dataframe(
+                pd.DataFrame(job["preview"][1:], columns=[unique_name(str(header), used) for header in job["preview"][0]]),
+                hide_index=True,
+            )
+
+        for level, message in list(job["log"]):
+            getattr(st, level)(message)
+
+        if not job["running"]:
+            for level, message in job["report"]:
+                getattr(st, level)(message)
+            for i, (label, data, file_name, mime) in enumerate(job["downloads"]):
+                st.download_button(label=label, data=data, file_name=file_name, mime=mime, key=f"download_{i}")
+
+            # สรุปผลการประมวลผล
+            if job["success"] > 0:
+                st.markdown(f'<p class="success-message">✅ ประมวลผลสำเร็จ {job["success"]} ไฟล์</p>', unsafe_allow_html=True)
+            if job["errors"] > 0:
+                st.markdown(f'<p class="error-message">❌ ประมวลผลไม่สำเร็จ {job["errors"]} ไฟล์</p>', unsafe_allow_html=True)
 
 # -------------------------------------
 # 🎯 ส่วน UI ของ Streamlit
 # -------------------------------------
+if 'conversion_job' not in st.session_state:
+    st.session_state.conversion_job = None
+
 st.markdown('<p class="main-title">KML to Excel Converter 🚀</p>', unsafe_allow_html=True)
 st.markdown('<p class="sub-title">📄 แปลงไฟล์ KML เป็น Excel พร้อมข้อมูล Metadata</p>', unsafe_allow_html=True)
 
 with st.expander("📌 คำแนะนำการใช้งาน", expanded=False):
     st.markdown("""
     1. อัปโหลดไฟล์ KML ที่มีข้อมูลเส้น (LineString)
-    2. คลิกปุ่ม "เริ่มประมวลผล" เพื่อแปลงไฟล์
+    2. คลิกปุ่ม "เริ่มประมวลผล" เพื่อแปลงไฟล์ (ระหว่างแปลงจะเห็นตัวอย่างข้อมูลและจำนวนเส้นที่อ่านแล้ว)
     3. ดาวน์โหลดไฟล์ Excel ที่ได้
     
     **หมายเหตุ:**
-    - รองรับไฟล์หลายไฟล์ในครั้งเดียว
+    - รองรับไฟล์หลายไฟล์ในครั้งเดียว โดยแปลงพร้อมกันหลาย process
+    - เลือกรวมผลเป็นไฟล์เดียว (Excel 1 sheet / GeoPackage 1 layer ต่อไฟล์) หรือ ZIP เดียวได้
+    - ส่งออกเป็น CSV, Parquet หรือ GeoPackage ได้ สำหรับข้อมูลที่เกินขนาดของ Excel หรือจะนำไปใช้ต่อใน pandas / GIS
+      (คอลัมน์จาก Description รวมหัวตารางของทุกเส้น ไม่ใช่เฉพาะเส้นแรก)
+    - ตัดหรือทำเครื่องหมายเส้นที่ซ้ำกันข้ามหลายไฟล์ได้ (ชื่อและพิกัดเดียวกัน)
     - แปลงเฉพาะข้อมูลประเภทเส้น (LineString) เท่านั้น
-    - ดึงข้อมูลจากฟิลด์ Description ที่อยู่ในรูปแบบตาราง HTML
+    - มีคอลัมน์ความยาวเส้นแบบ haversine บนทรงกลม (Length_m, เมตร), จำนวนจุดยอด (Vertex_Count)
+      และกรอบพิกัด (Min_Lon, Min_Lat, Max_Lon, Max_Lat) ของทุกเส้น
+    - ดึงข้อมูลจาก ExtendedData (SchemaData/SimpleData จาก QGIS, ogr2ogr หรือ Data จาก Google Earth)
+      หรือจากฟิลด์ Description ที่อยู่ในรูปแบบตาราง HTML
     """)
 
 uploaded_files = st.file_uploader("📂 อัปโหลดไฟล์ KML", type="kml", accept_multiple_files=True)
@@ -304,53 +162,49 @@ uploaded_files = st.file_uploader("📂 อัปโหลดไฟล์ KML",
 if uploaded_files:
     # แสดงจำนวนไฟล์ที่อัปโหลด
     st.info(f"อัปโหลดไฟล์ KML จำนวน {len(uploaded_files)} ไฟล์")
-    
-    # ปุ่มเริ่มประมวลผล
-    if st.button('⚡ เริ่มประมวลผล'):
-        with st.status("⏳ กำลังประมวลผล...", expanded=True) as status:
-            progress_bar = st.progress(0)
-            total_files = len(uploaded_files)
-            success_count = 0
-            error_count = 0
-            
-            for i, uploaded_file in enumerate(uploaded_files):
-                try:
-                    st.write(f"กำลังประมวลผลไฟล์ {uploaded_file.name}...")
-                    
-                    # โหลดข้อมูลจากไฟล์ KML
-                    lines = load_kml_lines(uploaded_file)
-                    
-                    if lines:
-                        st.success(f"พบข้อมูลเส้นทั้งหมด {len(lines)} เส้น")
-                        
-                        # บันทึกข้อมูลลง Excel
-                        output_memory = save_to_excel_memory(lines)
-                        
-                        # สร้างปุ่มดาวน์โหลด
-                        st.download_button(
-                            label=f"📥 ดาวน์โหลด {uploaded_file.name.replace('.kml', '.xlsx')}",
-                            data=output_memory,
-                            file_name=f"{uploaded_file.name.replace('.kml', '.xlsx')}",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
-                        success_count += 1
-                    else:
-                        st.warning(f"ไม่พบข้อมูลเส้นในไฟล์ {uploaded_file.name}")
-                        error_count += 1
-                        
-                except Exception as e:
-                    st.error(f"เกิดข้อผิดพลาดในการประมวลผลไฟล์ {uploaded_file.name}: {str(e)}")
-                    error_count += 1
-                
-                # อัปเดตแถบความคืบหน้า
-                progress_bar.progress((i + 1) / total_files)
-            
-            # สรุปผลการประมวลผล
-            if success_count > 0:
-                st.markdown(f'<p class="success-message">✅ ประมวลผลสำเร็จ {success_count} ไฟล์</p>', unsafe_allow_html=True)
-            if error_count > 0:
-                st.markdown(f'<p class="error-message">❌ ประมวลผลไม่สำเร็จ {error_count} ไฟล์</p>', unsafe_allow_html=True)
-                
-            status.update(label="✅ เสร็จสิ้น!", state="complete")
+
+    col_format, col_mode, col_workers = st.columns(3)
+    with col_format:
+        export_format = st.radio(
+            "ชนิดไฟล์ผลลัพธ์",
+            list(EXPORT_FORMATS),
+            help="Excel รับได้ไม่เกิน 1,048,576 แถวต่อ sheet; CSV / Parquet / GeoPackage ไม่มีข้อจำกัดนี้ "
+                 "และเก็บ geometry ของเส้นไว้ด้วย (CSV เป็น WKT, Parquet / GeoPackage เป็น WKB)"
+        )
+    with col_mode:
+        output_modes = [OUTPUT_SEPARATE, OUTPUT_SHEETS, OUTPUT_ZIP]
+        if export_format not in MULTI_TABLE_FORMATS:
+            output_modes.remove(OUTPUT_SHEETS)
+        output_mode = st.radio(
+            "รูปแบบไฟล์ผลลัพธ์",
+            output_modes,
+            help="รวมผลทุกไฟล์ไว้ในไฟล์เดียว (Excel แยก sheet, GeoPackage แยก layer) หรือ ZIP เดียว "
+                 "จะได้ไม่ต้องกดดาวน์โหลดทีละไฟล์"
+        )
+    with col_workers:
+        workers = st.number_input(
+            "จำนวน process ที่ใช้แปลงพร้อมกัน",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=min(os.cpu_count() or 1, len(uploaded_files)),
+            help="แปลงหลายไฟล์พร้อมกันบน CPU หลาย core (1 = แปลงทีละไฟล์)"
+        )
+        dedup_mode = st.radio(
+            "เส้นซ้ำข้ามไฟล์",
+            [DEDUP_OFF, DEDUP_DROP, DEDUP_FLAG],
+            help="เส้นที่มีชื่อและพิกัดเดียวกัน (ไม่สนทิศทางการลากเส้น) ถือว่าซ้ำ "
+                 "เก็บเส้นแรกตามลำดับไฟล์ที่อัปโหลดไว้"
+        )
+
+    # ปุ่มเริ่มประมวลผล (แปลงใน thread เบื้องหลัง หน้าเว็บจึงไม่ค้างและกดซ้ำระหว่างแปลงไม่ได้)
+    job = st.session_state.conversion_job
+    running = job is not None and job["running"]
+    if st.button('⚡ เริ่มประมวลผล', disabled=running):
+        files = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+        start_conversion_job(files, output_mode, workers, export_format, dedup_mode)
+        job, running = st.session_state.conversion_job, True
+
+    if job is not None:
+        st.fragment(show_conversion_job, run_every=0.5 if running else None)(job, running)
 else:
     st.info("กรุณาอัปโหลดไฟล์ KML อย่างน้อย 1 ไฟล์")
@@ -0,0 +1,29 @@
+# process pool สำหรับงานของหน้าเว็บที่รันอยู่ใน server ของ Streamlit (ใช้ร่วมกันหลายหน้า)
+import multiprocessing
+import sys
+from importlib.machinery import ModuleSpec
+
+
+def worker_context(preload=()):
+    """
+    Return a forkserver (or spawn) multiprocessing context for a process pool started from a page.
+
+    The Streamlit server runs many threads, and forking it can copy a lock held
+    by another thread into the child, which then hangs. forkserver and spawn
+    start the workers from a clean process instead, so the task functions must
+    live in importable modules (``preload`` names them, to import them once in
+    the forkserver rather than in every worker).
+
+    Streamlit installs the running page as ``__main__``, which these start
+    methods would otherwise re-run as ``__mp_main__`` in every worker; the
+    page is marked as a module named ``__main__`` so the workers skip it.
+    """
+    main_module = sys.modules["__main__"]
+    if getattr(main_module, "__spec__", None) is None:
+        main_module.__spec__ = ModuleSpec("__main__", None)
+
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(list(preload))
+        return context
+    return multiprocessing.get_context("spawn")